@@ -1,30 +1,91 @@
-import json
-from dash import Dash, dcc, html, callback, Input, Output, State, ctx 
+import logging
+import os
+import threading
+from functools import lru_cache
+from urllib.parse import urlencode
+from flask import Response, abort, request, send_from_directory, stream_with_context
+from dash import Dash, DiskcacheManager, dcc, html, callback, clientside_callback, \
+    ClientsideFunction, Input, Output, State, ctx, no_update
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+import diskcache
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
 
+from cache import CacheLRU, MemoDisco, Popularidad, clave_cache
+from comparacion import Comparacion
+from cubo import AcumuladoEje, CuboOD, crea_cubo
+from datos import TABLAS, abre_tabla, huella_datos, valores_unicos
+from exporta import escribe, esquema, formatos, lotes_arrow
+from geometria import archivo_geometria, centroides, niveles
+from mapas import Clasificacion, figura_flujos, figura_mapa, limites_usuario
+from metricas import Metricas
+from paralelo import PoolFiguras
+from transporte import codifica_figura, decodifica_figura
+
 #%%
 # Base de datos
-df_od0_19 = pd.read_parquet("assets/odmatrix_od_h_19.parquet")
-df_od0_20 = pd.read_parquet("assets/odmatrix_od_h_20.parquet")
-df_od0_21 = pd.read_parquet("assets/odmatrix_od_h_21.parquet")
-df_part0 = pd.read_parquet("assets/odmatrix_part_mod.parquet")
-df_h_i0 = pd.read_parquet("assets/odmatrix_h_i.parquet")
-df_dist0 = pd.read_parquet("assets/odmatrix_dist.parquet")
-    
-# ZATs
-with open('assets/BTA_ZAT.geojson') as jsonfile:
-    geo_zat = json.load(jsonfile)
-#Bta
-with open('assets/BTA_Localidades.geojson') as jsonfile:
-    geo_bta = json.load(jsonfile)
-# Vias principales    
-with open('assets/BTA_Vias_principales.geojson') as jsonfile:
-    geo_vias = json.load(jsonfile)
+# Cada tabla es un dataset de Parquet que se escanea con los filtros
+# empujados a la lectura. Las matrices OD de todos los años quedan en un solo
+# dataset (llave de partición: anio). Nada se lee al importar: las tablas y
+# los GeoJSON se abren la primera vez que se usan.
+
+# "memoria": los cubos codificados se guardan en carpeta_cache como Arrow IPC
+# y se abren con memory map, compartidos entre workers; "disco": cada
+# consulta escanea los archivos, para matrices más grandes que la memoria
+modo_datos = os.environ.get("MODO_DATOS", "memoria")
+carpeta_cache = os.environ.get("CARPETA_CACHE", "cache")
+# Todo lo derivado de los datos (cubos, figuras) se invalida cuando cambian
+version_datos = huella_datos()
+
+# Geometrías simplificadas por nivel de detalle (ver geometria.py). Se
+# sirven como archivos estáticos en /geo/ y las figuras solo llevan su URL
+carpeta_geo = os.path.join(carpeta_cache, "geo")
+ruta_zat = 'assets/BTA_ZAT.geojson'
+ruta_bta = 'assets/BTA_Localidades.geojson'
+ruta_vias = 'assets/BTA_Vias_principales.geojson'
+
+@lru_cache(maxsize=None)
+def url_geo(ruta, nivel, propiedades=()):
+    return app.get_relative_path("/geo/" + archivo_geometria(ruta, nivel, carpeta_geo,
+                                                              propiedades))
+
+@lru_cache(maxsize=None)
+def centroides_zat():
+    # (lon, lat) del centroide de cada ZAT del cubo OD; NaN si no tiene geometría
+    puntos = {str(k): v for k, v in centroides(ruta_zat, "ID").items()}
+    lon_lat = np.array([puntos.get(str(z), (np.nan, np.nan)) for z in cubo("od").zats])
+    return lon_lat[:, 0], lon_lat[:, 1]
+
+def capas_mapa():
+    # Localidades y vías principales sobre los mapas de ZAT, con el nivel de
+    # detalle que corresponde a cada rango de zoom
+    capas = []
+    for nivel, parametros in niveles.items():
+        zoom_min, zoom_max = parametros["zoom"]
+        capas += [
+            {
+                "source": url_geo(ruta_bta, nivel),
+                "sourcetype": "geojson",
+                "type": "line",
+                "color": "black",
+                "line": {"width": 2},
+                "minzoom": zoom_min,
+                "maxzoom": zoom_max,
+            },
+            {
+                "source": url_geo(ruta_vias, nivel),
+                "sourcetype": "geojson",
+                "type": "line",
+                "color": "#020081",
+                "line": {"width": 1.5},
+                "minzoom": zoom_min,
+                "maxzoom": zoom_max,
+            }
+        ]
+    return capas
 
 #%%
     
@@ -52,8 +113,48 @@ c_rango_dist="rango_dist"
 c_var_v = "var_viajes"
 c_var_v_p = "var_viajes_p"
 
-# Opciones generales
-anios_dispo = [2019, 2020, 2021]
+# Motor de agregación: tablas codificadas con enteros sobre un catálogo
+# común de ZAT. Ejes de salida de cada cubo:
+dims_cubos = {"od": [c_anio, c_tipo_dia, c_h_i2],
+              "part_mod": [c_anio, c_tipo_dia, c_modo],
+              "h_i": [c_anio, c_tipo_dia, c_modo, c_h_i],
+              "dist": [c_anio, c_tipo_dia, c_modo, c_rango_dist]}
+
+@lru_cache(maxsize=None)
+def zats_dispo():
+    # Solo se calcula cuando hay que construir algún cubo
+    return np.unique(np.concatenate(
+        [v for nombre in TABLAS
+         for v in valores_unicos(abre_tabla(nombre), [c_o, c_d]).values()]))
+
+# Resúmenes precalculados de cada cubo (por propósito, origen, destino y
+# OD); RESUMENES=0 consulta siempre la tabla completa
+resumenes_cubos = tuple(CuboOD.llaves_resumenes) \
+    if os.environ.get("RESUMENES", "1") == "1" else ()
+
+# Subir version_cubos cuando cambie el formato de los archivos de los cubos
+# para que se reconstruyan
+version_cubos = 6
+
+_cubos = dict()
+_lock_cubos = threading.Lock()
+def cubo(nombre):
+    if nombre not in _cubos:
+        with _lock_cubos:
+            if nombre not in _cubos:
+                ruta = os.path.join(carpeta_cache, "cubo_{}_{}.arrow".format(
+                    nombre, clave_cache(version_datos, dims_cubos[nombre], version_cubos)[:16]))
+                _cubos[nombre] = crea_cubo(abre_tabla(nombre), c_o, c_d, c_prop,
+                                           dims_cubos[nombre], c_viajes, zats_dispo,
+                                           en_disco=modo_datos == "disco",
+                                           ruta_cache=ruta, resumenes=resumenes_cubos)
+    return _cubos[nombre]
+
+# Opciones generales. Las que salen de los datos se calculan la primera vez
+# que se sirve la página (ver layout_pagina)
+@lru_cache(maxsize=None)
+def anios_dispo():
+    return [int(x) for x in cubo("od").catalogos[c_anio]]
 
 tipo_dia_dispo = ["lab", "sab", "dom"]
 dd_tipo_dia = [{"label":"Laborable", "value":"lab"},
@@ -64,24 +165,137 @@ horas_dispo = ["0"+str(x) if len(str(x))==1 else str(x) for x in range(0,24)]
 #sorted([x.replace("P","") for x in df_h_i0[c_h_i].unique()])
 # dd_horas=[{"label":x+":00", "value":"P"+x} for x in horas_dispo]
 
-zat_o_dispo = list(set(df_od0_19[c_o].unique())\
-                   .union(set(df_od0_20[c_o].unique())\
-                          .union(set(df_od0_21[c_o].unique()))))
-zat_d_dispo = list(set(df_od0_19[c_d].unique())\
-                   .union(set(df_od0_20[c_d].unique())\
-                          .union(set(df_od0_21[c_d].unique()))))
+@lru_cache(maxsize=None)
+def zat_o_dispo():
+    return cubo("od").zats_o.tolist()
 
-modo_dispo = df_part0[c_modo].dropna().unique()
+@lru_cache(maxsize=None)
+def zat_d_dispo():
+    return cubo("od").zats_d.tolist()
 
 prop_val = ['HBO','HBW','HBEdu','NHB']
+prop_defecto = 'HBEdu'
 prop_dispo = ["Otro", "Trabajo", "Educación", "No basado en el hogar"]
 dd_prop =  [{"label":x, "value":y} for x,y in zip(prop_dispo, prop_val)]
 
 rangos_dist = ["[0-0.5)", "[0.5-1)", "[1-2)", "[2-5)", "[5-10)", "[10-20)", "[20-50)","+50"]
+
+# Pares OD que se dibujan en el mapa de flujos principales
+n_flujos = int(os.environ.get("N_FLUJOS", 100))
+
+# Cache de los agregados intermedios (presupuesto en MB por worker)
+cache_agregados = CacheLRU(int(os.environ.get("CACHE_AGREGADOS_MB", 512)) * 2**20)
+# Figuras ya construidas, en disco y compartidas entre workers. Subir
+# version_figuras cuando cambie cómo se construyen para no servir las viejas
+version_figuras = 3
+memo_figuras = MemoDisco(os.path.join(carpeta_cache, "figuras"),
+                         int(os.environ.get("CACHE_FIGURAS_MB", 1024)) * 2**20,
+                         int(os.environ.get("TTL_FIGURAS_S", 24 * 3600)))
+# Segundo nivel en disco de los agregados: los precalculados al arrancar y
+# los de otros workers se leen de aquí en lugar de recalcularse. Las claves
+# llevan version_datos, así que no necesitan vencimiento
+memo_agregados = MemoDisco(os.path.join(carpeta_cache, "agregados"),
+                           int(os.environ.get("CACHE_AGREGADOS_DISCO_MB", 2048)) * 2**20,
+                           None)
+# Combinaciones de filtros más pedidas, para el precálculo
+popularidad = Popularidad(os.path.join(carpeta_cache, "popularidad"))
+# Tiempos, memoria y tamaño de respuesta de cada callback (ver /metrics)
+metricas = Metricas(rastrear_memoria=os.environ.get("METRICAS_TRACEMALLOC") == "1",
+                    carpeta_fondo=os.path.join(carpeta_cache, "metricas"))
+panel_metricas = os.environ.get("METRICAS_PANEL") == "1"
+# Procesos para construir en paralelo las figuras de un clic (0 = uno por
+# núcleo, 1 = en serie)
+pool_figuras = PoolFiguras(int(os.environ.get("N_PROCESOS_FIGURAS", 1)))
+# Cambio de pestañas en el navegador (assets/pestanas.js); con 0 lo hace el
+# servidor
+pestanas_cliente = os.environ.get("PESTANAS_CLIENTE", "1") == "1"
+# Arreglos de las figuras de los stores en binario (ver transporte.py) y
+# respuestas comprimidas con gzip/brotli
+transporte_binario = os.environ.get("TRANSPORTE_BINARIO", "1") == "1"
+comprimir = os.environ.get("COMPRIMIR", "1") == "1"
+# ZAT de origen por parte en la descarga de viajes OD (ver exporta.py)
+zats_por_lote_exporta = int(os.environ.get("EXPORTA_ZATS_LOTE", 100))
 #%%
 
 # Inicializa la app
-app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# Trabajos de fondo: los callbacks pesados (filtrar) corren en procesos
+# aparte y el hilo del worker queda libre para otras peticiones; la cola y
+# los resultados viven en disco. CALLBACKS_FONDO=0 los corre en la petición
+callbacks_fondo = os.environ.get("CALLBACKS_FONDO", "1") == "1"
+manager_fondo = None
+if callbacks_fondo:
+    manager_fondo = DiskcacheManager(diskcache.Cache(os.path.join(carpeta_cache, "trabajos")))
+
+app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP],
+           background_callback_manager=manager_fondo, compress=comprimir)
+# Para gunicorn: gunicorn app_wbg:server
+server = app.server
+# Las descargas van por partes: comprimirlas obligaría a juntarlas antes
+server.config["COMPRESS_STREAMS"] = False
+
+server.after_request(metricas.registra_respuesta)
+
+@server.route("/metrics")
+def sirve_metricas():
+    return Response(metricas.prometheus(), mimetype="text/plain; version=0.0.4")
+
+@server.route("/geo/<path:archivo>")
+def sirve_geo(archivo):
+    # El nombre lleva el hash del contenido: el navegador puede guardarlo
+    # en cache sin volver a preguntar
+    return send_from_directory(os.path.abspath(carpeta_geo), archivo,
+                               max_age=365 * 24 * 3600)
+
+def parametro(nombre, tipo):
+    # Valores de un parámetro repetible de la URL convertidos a ``tipo``
+    try:
+        return np.asarray(request.args.getlist(nombre)).astype(tipo)
+    except ValueError:
+        abort(400, "Valor inválido para " + nombre)
+
+def parametro_zats(nombre, tipo):
+    # Como en los controles: "Todas" no filtra y sin valores la selección
+    # queda vacía
+    if "Todas" in request.args.getlist(nombre):
+        return "Todas"
+    return parametro(nombre, tipo).tolist()
+
+@server.route("/exporta/viajes_od.<formato>")
+def exporta_od(formato):
+    # Viajes por año, tipo de día y par OD de la selección, sumando las horas
+    # del rango y los propósitos. Parámetros: o, d y prop (repetibles; o=Todas
+    # y d=Todas no filtran y sin valores no hay filas, igual que en
+    # normaliza_filtros), anio y dia (repetibles, sin ellos van todos) y h
+    # (hora inicial y final)
+    if formato not in formatos:
+        abort(404)
+    cubo_od = cubo("od")
+    cats = cubo_od.catalogos
+    filtros = normaliza_filtros(parametro_zats("o", cubo_od.zats.dtype),
+                                parametro_zats("d", cubo_od.zats.dtype),
+                                request.args.getlist("prop"))
+    anios = parametro("anio", cats[c_anio].dtype)
+    dias = request.args.getlist("dia")
+    horas_i = parametro("h", int).tolist() or [0, 23]
+
+    # Celda de salida (año x tipo de día) de cada celda del cubo
+    i_anio, i_dia, i_hora = np.indices(cubo_od.forma).reshape(3, -1)
+    horas = cats[c_h_i2][i_hora]
+    elegida = (min(horas_i) <= horas) & (horas <= max(horas_i))
+    if len(anios):
+        elegida &= np.isin(cats[c_anio], anios)[i_anio]
+    if dias:
+        elegida &= np.isin(cats[c_tipo_dia], dias)[i_dia]
+    salida = np.where(elegida, i_anio * cubo_od.forma[1] + i_dia, -1)
+
+    columnas = {c_anio: cats[c_anio], c_tipo_dia: cats[c_tipo_dia]}
+    esquema_od = esquema(columnas, cubo_od.zats)
+    pares = cubo_od.pares(salida, zats_por_lote=zats_por_lote_exporta, **filtros)
+    cuerpo = escribe(lotes_arrow(pares, columnas, cubo_od.zats, esquema_od),
+                     esquema_od, formato)
+    return Response(stream_with_context(cuerpo), mimetype=formatos[formato],
+                    headers={"Content-Disposition":
+                             "attachment; filename=viajes_od." + formato})
 
 encabezado = dbc.Row([    
     html.Div([
@@ -97,35 +311,36 @@ encabezado = dbc.Row([
     style={'position': 'relative'}) 
 ], className  ="pb-2 rounded text-*-center") # Fin Row encabezado
 
-filtros_1 = dbc.Row([
-    # ZAT O
-    dbc.Col([
-        html.P("ZAT origen", style={'marginBottom':5}),
-        dcc.Dropdown(options=["Todas"] + zat_o_dispo,
-                     value = "Todas",
-                     multi=True,
-                     placeholder="ZAT origen",
-                     id='dd-o'),
-    ], width=6, className  ="fs-6"
-    ),    
-    # ZAT D
-    dbc.Col([
-        html.P("ZAT destino", style={'marginBottom':5}),
-        dcc.Dropdown(options=["Todas"] + zat_d_dispo,
-                     value = "Todas",
-                     multi=True,
-                     placeholder="ZAT destino",
-                     id='dd-d'),
-    ], width=6, className  ="fs-6"
-    )
-]) # Fin Row filtros 1
+def crea_filtros_1(zats_o, zats_d):
+    return dbc.Row([
+        # ZAT O
+        dbc.Col([
+            html.P("ZAT origen", style={'marginBottom':5}),
+            dcc.Dropdown(options=["Todas"] + zats_o,
+                         value = "Todas",
+                         multi=True,
+                         placeholder="ZAT origen",
+                         id='dd-o'),
+        ], width=6, className  ="fs-6"
+        ),    
+        # ZAT D
+        dbc.Col([
+            html.P("ZAT destino", style={'marginBottom':5}),
+            dcc.Dropdown(options=["Todas"] + zats_d,
+                         value = "Todas",
+                         multi=True,
+                         placeholder="ZAT destino",
+                         id='dd-d'),
+        ], width=6, className  ="fs-6"
+        )
+    ]) # Fin Row filtros 1
 
 filtros_2 = dbc.Row([
     # Propósito
     dbc.Col([
         html.P("Propósito", style={'marginBottom':5}),
         dcc.Dropdown(options=dd_prop,
-                     value='HBEdu',
+                     value=prop_defecto,
                      multi=True,
                      placeholder="Propósito",
                      id='dd-prop'),
@@ -145,137 +360,170 @@ filtros_2 = dbc.Row([
             color="primary",
             id="button-filt-data",
             className  ="fs-5",
-        )        
+        ),
+        # Avance de los agregados del mapa y de los gráficos
+        dbc.Progress(id="progreso-filtro", value=0, max=1,
+                     style={"height": "4px"}, className="mt-1"),
+        dbc.Progress(id="progreso-grafs", value=0, max=1, color="info",
+                     style={"height": "4px"}, className="mt-1"),
     ], width={"size": 2, 'offset':5}, align="end") # Fin Col botón filtrar
     
 ])
 
 # Filtros generales        
-filtros = dbc.Card([
-    filtros_1, filtros_2
-], body=True,
-    className  ="border border-secondary p-2"
-) # Fin Card filtros
-
-
-controles_od = dbc.Card([
-    dcc.Dropdown(options= anios_dispo,
-                      value= max(anios_dispo),
-                      multi=False, 
-                      placeholder="Año",
-                      disabled = False,
-                      id='dd-v-anio',
-                      className   = "mb-1"), 
-    html.Div([
-        dcc.Checklist(
-           options=[
-               {'label': 'Comparar',
-                'value': 'Si',
-                "disabled":False}
-           ],
-           id = "check_comp",
-           className   = "mb-1"
-        )
-    ]),
-   
-    html.Div([
-        dcc.RadioItems(
-            # options=[{'label': 'Absoluto', 'value': 'Absoluto', 'disabled': True},
-            #     {'label': 'Porcentaje', 'value': 'Porcentaje', 'disabled': True}],
-            value="Absoluto",
-           inline=True,
-           id = "check_tipo_comp",
-           className="pe-2"
-        ),        
-        dcc.Dropdown(options=anios_dispo,
-                     value=min(anios_dispo),
-                     multi=False,
-                     placeholder="Año base",
-                     disabled=False,
-                     id='dd-v-anio-base'
-                     ),        
-        dcc.Dropdown(options=anios_dispo,
-                     value=max(anios_dispo),
-                     multi=False,
-                     placeholder="Año de comparación",
-                     disabled=False,
-                     id='dd-v-anio-comparacion'
-                     )
-        ], className="vstack gap-2 mb-4"
-        ),
-    html.Div([
-        dbc.Label("Tipo de día"),
-        dcc.Dropdown(options= dd_tipo_dia,
-                          value= "lab",
+def crea_filtros(zats_o, zats_d):
+    return dbc.Card([
+        crea_filtros_1(zats_o, zats_d), filtros_2
+    ], body=True,
+        className  ="border border-secondary p-2"
+    ) # Fin Card filtros
+
+
+def crea_controles_od(anios):
+    return dbc.Card([
+        dcc.Dropdown(options= anios,
+                          value= max(anios, default=None),
                           multi=False, 
-                          placeholder="Tipo de día",
+                          placeholder="Año",
                           disabled = False,
-                          id='dd-v-t-dia',
-                          className   = "mb-1"),
+                          id='dd-v-anio',
+                          className   = "mb-1"), 
+        html.Div([
+            dcc.Checklist(
+               options=[
+                   {'label': 'Comparar',
+                    'value': 'Si',
+                    "disabled":False}
+               ],
+               id = "check_comp",
+               className   = "mb-1"
+            )
+        ]),
+   
+        html.Div([
+            dcc.RadioItems(
+                # options=[{'label': 'Absoluto', 'value': 'Absoluto', 'disabled': True},
+                #     {'label': 'Porcentaje', 'value': 'Porcentaje', 'disabled': True}],
+                value="Absoluto",
+               inline=True,
+               id = "check_tipo_comp",
+               className="pe-2"
+            ),        
+            dcc.Dropdown(options=anios,
+                         value=min(anios, default=None),
+                         multi=False,
+                         placeholder="Año base",
+                         disabled=False,
+                         id='dd-v-anio-base'
+                         ),        
+            dcc.Dropdown(options=anios,
+                         value=max(anios, default=None),
+                         multi=False,
+                         placeholder="Año de comparación",
+                         disabled=False,
+                         id='dd-v-anio-comparacion'
+                         )
+            ], className="vstack gap-2 mb-4"
+            ),
+        html.Div([
+            dbc.Label("Tipo de día"),
+            dcc.Dropdown(options= dd_tipo_dia,
+                              value= "lab",
+                              multi=False, 
+                              placeholder="Tipo de día",
+                              disabled = False,
+                              id='dd-v-t-dia',
+                              className   = "mb-1"),
         
-    ]),    
-    html.Div([
-        dbc.Label("Hora de inicio"),
-        dcc.RangeSlider(0, 23,
-                        step=1,
-                        marks={i:str(i) for i in range(0,24) if i%4==0 or i==23},
-                        value=[0, 23],
-                        tooltip={"placement": "bottom", "always_visible": True},
-                        id='rs-h-i-od')
-    ], className = "mb-1"),
-    html.Div([
-        dbc.Label("Rangos"),
-        dcc.Input(type="text",
-              value="100, 500, 1000, 2000",
-              placeholder="Rangos, separados por comas",
-              # debounce=True,
-              id="in-rang",
-              style={'fontSize': 12, 'fontStyle': 'italic', "width":"100%"}
-              )
-    ], className="vstack gap-1 mb-4" ),
-    html.Div([
-        dbc.Button(
-            "Generar mapa",
-            color="primary",
-            id='button-gen-mapa-od',
-            className ="d-flex justify-content-center m-3"
-        )
-        ])
-], body=True, className  ="font-ligth fs-6") # Fin Card controles viajes OD
+        ]),    
+        html.Div([
+            dbc.Label("Hora de inicio"),
+            dcc.RangeSlider(0, 23,
+                            step=1,
+                            marks={i:str(i) for i in range(0,24) if i%4==0 or i==23},
+                            value=[0, 23],
+                            tooltip={"placement": "bottom", "always_visible": True},
+                            updatemode="drag",
+                            id='rs-h-i-od')
+        ], className = "mb-1"),
+        html.Div([
+            dbc.Label("Rangos"),
+            dcc.Dropdown(options=[{"label": "Definidos por el usuario", "value": "usuario"},
+                                  {"label": "Cuantiles", "value": "cuantiles"},
+                                  {"label": "Cortes naturales (Jenks)", "value": "jenks"}],
+                         value="usuario",
+                         clearable=False,
+                         id='dd-clasif',
+                         className="mb-1"),
+            dcc.Input(type="number",
+                  value=5, min=2, max=12, step=1,
+                  placeholder="Número de clases",
+                  id="in-n-clases",
+                  style={'fontSize': 12, "width":"100%"}
+                  ),
+            dcc.Input(type="text",
+                  value="100, 500, 1000, 2000",
+                  placeholder="Rangos, separados por comas",
+                  # debounce=True,
+                  id="in-rang",
+                  style={'fontSize': 12, 'fontStyle': 'italic', "width":"100%"}
+                  )
+        ], className="vstack gap-1 mb-4" ),
+        html.Div([
+            dbc.Button(
+                "Generar mapa",
+                color="primary",
+                id='button-gen-mapa-od',
+                className ="d-flex justify-content-center m-3"
+            )
+            ]),
+        # Descarga de los viajes OD de la selección actual
+        html.Div([
+            html.A("Descargar CSV", id="link-exporta-csv", download="viajes_od.csv"),
+            html.A("Descargar Parquet", id="link-exporta-parquet", download="viajes_od.parquet"),
+        ], className="d-flex justify-content-around fs-6")
+    ], body=True, className  ="font-ligth fs-6") # Fin Card controles viajes OD
 
 # Viajes por ZAT
-gr_od = dbc.Card([
-    dbc.Row([
-        html.H3("Viajes por ZAT", className  ="bg-info p-1 text-white rounded-top")
-    ]),
-    dbc.Row([
-        dbc.Tabs(
-            [
-                dbc.Tab(label="Origen", tab_id="tab-v-o"),
-                dbc.Tab(label="Destino", tab_id="tab-v-d"),
-                # dbc.Tab(label="Tasa de viajes", tab_id="tab-v-t"),
+def crea_gr_od(anios):
+    return dbc.Card([
+        dbc.Row([
+            html.H3("Viajes por ZAT", className  ="bg-info p-1 text-white rounded-top")
+        ]),
+        dbc.Row([
+            dbc.Tabs(
+                [
+                    dbc.Tab(label="Origen", tab_id="tab-v-o"),
+                    dbc.Tab(label="Destino", tab_id="tab-v-d"),
+                    dbc.Tab(label="Flujos principales", tab_id="tab-v-f"),
+                    # dbc.Tab(label="Tasa de viajes", tab_id="tab-v-t"),
 
-            ],
-            id="tabs-v",
-            active_tab="tab-v-o"
-        ),
-        # html.Br(),
-        # dbc.Tabs(
-        #     [
-        #         dbc.Tab(label="Hábil", tab_id="tab-v-hab"),
-        #         dbc.Tab(label="Sábado", tab_id="tab-v-sab"),
-        #         dbc.Tab(label="Domingo", tab_id="tab-v-dom"),
-
-        #     ],
-        #     id="tabs-v-d",
-        #     active_tab="tab-v-hab"
-        # )
-    ]), # Fin Row Tabs
-    dbc.Row([
-        dbc.Col(controles_od, width=2),
-        dbc.Col(id='gr-v')
-    ])
-],className  ="border order-light pt-2", body=True) # Fin Card viajes OD
+                ],
+                id="tabs-v",
+                active_tab="tab-v-o"
+            ),
+            # html.Br(),
+            # dbc.Tabs(
+            #     [
+            #         dbc.Tab(label="Hábil", tab_id="tab-v-hab"),
+            #         dbc.Tab(label="Sábado", tab_id="tab-v-sab"),
+            #         dbc.Tab(label="Domingo", tab_id="tab-v-dom"),
+
+            #     ],
+            #     id="tabs-v-d",
+            #     active_tab="tab-v-hab"
+            # )
+        ]), # Fin Row Tabs
+        dbc.Row([
+            dbc.Col(crea_controles_od(anios), width=2),
+            dbc.Col([
+                # La figura se cambia en el navegador al pasar de pestaña
+                dcc.Graph(id='fig-v', style={'display': 'none'}),
+                html.P("Los flujos principales se muestran para un solo año, sin comparación.",
+                       id='msg-v', className="m-3", style={'display': 'none'})
+            ], id='gr-v')
+        ])
+    ],className  ="border order-light pt-2", body=True) # Fin Card viajes OD
     
 # Partición modal
 gr_part_mod = dbc.Card([
@@ -292,7 +540,7 @@ gr_part_mod = dbc.Card([
             id="tabs-part-mod",
             active_tab="tab-part-mod-hab",
     ),
-    dbc.Row(id='gr-part-mod')  
+    dbc.Row(dcc.Graph(id='fig-part-mod', style={'display': 'none'}), id='gr-part-mod')
 ], className  ="border order-light pt-2", body=True) # Fin Card partición modal
 
 # Hora de inicio
@@ -310,7 +558,7 @@ gr_h_i = dbc.Card([
             id="tabs-h-i",
             active_tab="tab-h-i-hab",
     ),
-    dbc.Row(id='gr-h-i') 
+    dbc.Row(dcc.Graph(id='fig-h-i', style={'display': 'none'}), id='gr-h-i')
 ], className  ="border order-light pt-2", body=True) # Fin Card hora de inicio
 
 # Distancia
@@ -328,7 +576,7 @@ gr_dist = dbc.Card([
             id="tabs-distancia",
             active_tab="tab-dist-hab",
     ),
-    dbc.Row(id='gr-dist')
+    dbc.Row(dcc.Graph(id='fig-dist', style={'display': 'none'}), id='gr-dist')
 ], className  ="border order-light pt-2", body=True) # Fin Card distancia
 
 # Tasa de viajes
@@ -355,31 +603,49 @@ gr_dist = dbc.Card([
 ## Apariencia
 #############
 sto_type = "memory" #local, session, memory
-app.layout = dbc.Container([
-    # Almacena las tablas agregadas intermedias
-    dcc.Store(id='store-val-inter-od', storage_type=sto_type),
-    # Almacena las tablas agregadas intermedias
-    dcc.Store(id='store-val-inter-od-comp', storage_type=sto_type),
-    # Almacena los mapas    
-    dcc.Store(id='store-graf-od', storage_type=sto_type),
-    # Almacena los mapas de comparación    
-    dcc.Store(id='store-graf-od-comp', storage_type=sto_type),
-    # Almacena los gráficos de la partición modal
-    dcc.Store(id='store-graf-part-mod', storage_type=sto_type),
-    # Almacena los gráficos de la hora
-    dcc.Store(id='store-graf-h-i', storage_type=sto_type),
-    # Almacena los gráficos de la distancia
-    dcc.Store(id='store-graf-dist', storage_type=sto_type),
-    # Almacena los gráficos de la tasa de generación de viajes
-    # dcc.Store(id='store-graf-tasa', storage_type=sto_type),
-    encabezado,
-    filtros,
-    gr_od,
-    gr_part_mod,
-    gr_h_i,
-    gr_dist,
-    # gr_tasa    
-], fluid=True) # Fin Container general
+# Panel de depuración con las últimas invocaciones de los callbacks
+# (solo con METRICAS_PANEL=1)
+panel_depuracion = dbc.Card([
+    dbc.Row([
+        html.H3("Métricas de los callbacks", className  ="bg-secondary p-1 text-white rounded-top")
+    ]),
+    dcc.Interval(id='int-metricas', interval=5000),
+    html.Div(id='tabla-metricas', style={'fontSize': 12})
+],className  ="border order-light pt-2", body=True)
+
+def crea_layout(anios, zats_o, zats_d):
+    return dbc.Container([
+        # Almacena las tablas agregadas intermedias
+        dcc.Store(id='store-val-inter-od', storage_type=sto_type),
+        # Almacena las tablas agregadas intermedias
+        dcc.Store(id='store-val-inter-od-comp', storage_type=sto_type),
+        # Almacena los mapas    
+        dcc.Store(id='store-graf-od', storage_type=sto_type),
+        # Almacena los mapas de comparación    
+        dcc.Store(id='store-graf-od-comp', storage_type=sto_type),
+        # Almacena la clave de los agregados de partición modal, hora y
+        # distancia; cada gráfico se construye al abrir su pestaña
+        dcc.Store(id='store-val-grafs', storage_type=sto_type),
+        # Almacena los gráficos de la tasa de generación de viajes
+        # dcc.Store(id='store-graf-tasa', storage_type=sto_type),
+        encabezado,
+        crea_filtros(zats_o, zats_d),
+        crea_gr_od(anios),
+        gr_part_mod,
+        gr_h_i,
+        gr_dist,
+        # gr_tasa    
+    ] + ([panel_depuracion] if panel_metricas else []), fluid=True) # Fin Container general
+
+def layout_pagina():
+    # Se arma al servir la página: las opciones de años y ZAT salen de los
+    # cubos, que así no se construyen al importar la app
+    return crea_layout(anios_dispo(), zat_o_dispo(), zat_d_dispo())
+
+# Dash valida los callbacks contra un layout con los mismos ids; este va sin
+# opciones para no leer los datos
+app.validation_layout = crea_layout([], [], [])
+app.layout = layout_pagina
 # Fin apariencia
 
 
@@ -397,113 +663,224 @@ app.layout = dbc.Container([
 #     if filtro_act:
 #         return False
 
-# Filtrar para mapa
+def callback_fondo(*dependencias, progress=None, progress_default=None, cancel=None,
+                   **kwargs):
+    # Registra un callback como trabajo de fondo, con avance y cancelación;
+    # la función recibe primero set_progress. Sin trabajos de fondo corre en
+    # la petición y set_progress no hace nada
+    def decorador(funcion):
+        if callbacks_fondo:
+            return app.callback(*dependencias, background=True, progress=progress,
+                                progress_default=progress_default, cancel=cancel,
+                                **kwargs)(metricas.trabajo_fondo(funcion))
+        def sin_avance(*args):
+            return funcion(lambda valores: None, *args)
+        sin_avance.__name__ = funcion.__name__
+        return app.callback(*dependencias, **kwargs)(sin_avance)
+    return decorador
+
+# Cambiar los filtros cancela el trabajo en curso
+cancela_filtros = [Input('dd-o', 'value'), Input('dd-d', 'value'), Input('dd-prop', 'value')]
+
+# Limpia los agregados al cambiar los filtros
 @app.callback(
-    Output('store-val-inter-od', 'data'),
-    Output('button-filt-data', 'disabled'),
+    Output('store-val-inter-od', 'data', allow_duplicate=True),
+    Output('button-filt-data', 'disabled', allow_duplicate=True),
     Input('dd-o', 'value'),
     Input('dd-d', 'value'),
     Input('dd-prop', 'value'),
-    Input('button-filt-data', 'n_clicks'))
-def filtra_df_od(origenes, destinos, propositos, btn_filtrar):
+    State('button-filt-data', 'n_clicks'), prevent_initial_call=True)
+@metricas.instrumenta
+def reinicia_filtro(origenes, destinos, propositos, btn_filtrar):
+    if btn_filtrar is None:
+        raise PreventUpdate
+    return None, False
+
+# Filtrar para mapa
+@callback_fondo(
+    Output('store-val-inter-od', 'data'),
+    Output('button-filt-data', 'disabled'),
+    Input('button-filt-data', 'n_clicks'),
+    State('dd-o', 'value'),
+    State('dd-d', 'value'),
+    State('dd-prop', 'value'),
+    progress=[Output('progreso-filtro', 'value'), Output('progreso-filtro', 'max')],
+    progress_default=[0, 1],
+    cancel=cancela_filtros, prevent_initial_call=True)
+@metricas.instrumenta
+def filtra_df_od(set_progress, btn_filtrar, origenes, destinos, propositos):
     if btn_filtrar is None:
         raise PreventUpdate
     
-    if ctx.triggered_id != 'button-filt-data':
-        return None, False
-    
-    test_o_19 = df_od0_19[c_o] >=  0
-    test_o_20 = df_od0_20[c_o] >=  0
-    test_o_21 = df_od0_21[c_o] >=  0
-    test_d_19 = df_od0_19[c_d] >=  0
-    test_d_20 = df_od0_20[c_d] >=  0
-    test_d_21 = df_od0_21[c_d] >=  0
-    test_prop_19 = df_od0_19[c_prop].isin(prop_val)
-    test_prop_20 = df_od0_20[c_prop].isin(prop_val)
-    test_prop_21 = df_od0_21[c_prop].isin(prop_val)
+    filtros = normaliza_filtros(origenes, destinos, propositos)
+    popularidad.registra(filtros)
+    datos_od = {"clave": clave_cache("od", filtros), "filtros": filtros}
+    # Como trabajo de fondo corre en otro proceso: los agregados quedan en
+    # el nivel en disco de la cache, de donde los lee el mapa
+    set_progress((0, 1))
+    obtiene_agregados(datos_od, agrega_od)
+    set_progress((1, 1))
     
+    # Al navegador solo viaja la clave; los filtros permiten recalcular
+    # si la petición del mapa llega a otro worker
+    return datos_od, True
+
+def normaliza_filtros(origenes, destinos, propositos):
+    # None o "Todas" equivalen a no filtrar por ZAT
     if origenes is not None:
         if not isinstance(origenes,list):
-            origenes=[origenes]            
-        if "Todas" not in origenes:
-            test_o_19 = df_od0_19[c_o].isin(origenes)
-            test_o_20 = df_od0_20[c_o].isin(origenes)
-            test_o_21 = df_od0_21[c_o].isin(origenes)
-            
-            
+            origenes=[origenes]
+        origenes = None if "Todas" in origenes else sorted(set(origenes))
     if destinos is not None:
         if not isinstance(destinos,list):
-            destinos=[destinos]            
-        if "Todas" not in destinos:
-            test_d_19 = df_od0_19[c_d].isin(destinos)
-            test_d_20 = df_od0_20[c_d].isin(destinos)
-            test_d_21 = df_od0_21[c_d].isin(destinos)            
-            
-    if propositos is not None:
-        if not isinstance(propositos,list):
-            propositos=[propositos]            
-        test_prop_19 = df_od0_19[c_prop].isin(propositos)
-        test_prop_20 = df_od0_20[c_prop].isin(propositos)
-        test_prop_21 = df_od0_21[c_prop].isin(propositos)
-
-    df_od_19_filt = df_od0_19[(test_o_19) & (test_d_19) & (test_prop_19)]
-    df_od_20_filt = df_od0_20[(test_o_20) & (test_d_20) & (test_prop_20)]
-    df_od_21_filt = df_od0_21[(test_o_21) & (test_d_21) & (test_prop_21)]
-    
-    df_o_19 = df_od_19_filt.groupby(by=[c_anio, c_tipo_dia, c_h_i2, c_o])\
-    .agg(viajes_o=(c_viajes,"sum"))
-    df_o_19.reset_index(inplace=True)
-    df_d_19 = df_od_19_filt.groupby(by=[c_anio, c_tipo_dia, c_h_i2, c_d])\
-    .agg(viajes_d=(c_viajes,"sum"))
-    df_d_19.reset_index(inplace=True)
-    
-    df_o_20 = df_od_20_filt.groupby(by=[c_anio, c_tipo_dia, c_h_i2, c_o])\
-    .agg(viajes_o=(c_viajes,"sum"))
-    df_o_20.reset_index(inplace=True)
-    df_d_20 = df_od_20_filt.groupby(by=[c_anio, c_tipo_dia, c_h_i2, c_d])\
-    .agg(viajes_d=(c_viajes,"sum"))
-    df_d_20.reset_index(inplace=True)    
-    
-    df_o_21 = df_od_21_filt.groupby(by=[c_anio, c_tipo_dia, c_h_i2, c_o])\
-    .agg(viajes_o=(c_viajes,"sum"))
-    df_o_21.reset_index(inplace=True)
-    df_d_21 = df_od_21_filt.groupby(by=[c_anio, c_tipo_dia, c_h_i2, c_d])\
-    .agg(viajes_d=(c_viajes,"sum"))
-    df_d_21.reset_index(inplace=True)
-    
-    
-    datasets = {
-         'df_o_19': df_o_19.to_json(orient='split', date_format='iso'),
-         'df_d_19': df_d_19.to_json(orient='split', date_format='iso'),  
-         
-         'df_o_20': df_o_20.to_json(orient='split', date_format='iso'),
-         'df_d_20': df_d_20.to_json(orient='split', date_format='iso'), 
-         
-         'df_o_21': df_o_21.to_json(orient='split', date_format='iso'),
-         'df_d_21': df_d_21.to_json(orient='split', date_format='iso')
-     }
-    
-    return json.dumps(datasets), True
+            destinos=[destinos]
+        destinos = None if "Todas" in destinos else sorted(set(destinos))
+    if propositos is None:
+        propositos = prop_val
+    elif not isinstance(propositos,list):
+        propositos=[propositos]
+    return {"origenes": origenes, "destinos": destinos,
+            "propositos": sorted(set(propositos))}
+
+def agrega_od(filtros):
+    # Una sola pasada para todos los años. Se guardan las sumas acumuladas
+    # por hora (año x tipo de día x hora x ZAT): cambiar el rango de horas o
+    # el tipo de día no vuelve a agregar, solo resta dos cortes
+    cubo_od = cubo("od")
+    eje_hora = cubo_od.dims.index(c_h_i2)
+    horas = cubo_od.catalogos[c_h_i2]
+    (suma_o, pres_o), (suma_d, pres_d) = cubo_od.agrega([c_o, c_d], **filtros)
+    return {'acum_o': AcumuladoEje(suma_o, pres_o, horas, eje_hora),
+            'acum_d': AcumuladoEje(suma_d, pres_d, horas, eje_hora)}
+
+def viajes_anios(acumulado, t_dia, horas_i):
+    # (suma, presente) de todos los años x ZAT para un tipo de día y rango de
+    # horas, sobre el índice fijo de ZAT del cubo
+    cubo_od = cubo("od")
+    forma = (len(cubo_od.catalogos[c_anio]), len(cubo_od.zats))
+    i_dia = np.flatnonzero(cubo_od.catalogos[c_tipo_dia] == t_dia)
+    if len(i_dia) == 0:
+        return np.zeros(forma), np.zeros(forma, dtype=bool)
+    suma, presente = acumulado.rango(min(horas_i), max(horas_i))
+    return suma[:, i_dia[0]], presente[:, i_dia[0]]
+
+def indice_anio(anio):
+    i_anio = np.flatnonzero(cubo("od").catalogos[c_anio] == anio)
+    return i_anio[0] if len(i_anio) else None
+
+def viajes_zat(acumulado, anio, t_dia, horas_i):
+    # ZAT con registros y sus viajes para un año, tipo de día y rango de horas
+    zats = cubo("od").zats
+    i_anio = indice_anio(anio)
+    if i_anio is None:
+        return zats[:0], np.zeros(0)
+    suma, presente = viajes_anios(acumulado, t_dia, horas_i)
+    return zats[presente[i_anio]], suma[i_anio][presente[i_anio]]
+
+def matriz_flujos(filtros, anio, t_dia, horas_i):
+    # MatrizOD del año y tipo de día sumando las horas del rango. Solo se
+    # leen las filas de esas celdas (índice por propósito y celda del cubo,
+    # o el escaneo filtrado fuera de memoria)
+    cubo_od = cubo("od")
+    i_anio = np.flatnonzero(cubo_od.catalogos[c_anio] == anio)
+    i_dia = np.flatnonzero(cubo_od.catalogos[c_tipo_dia] == t_dia)
+    horas = cubo_od.catalogos[c_h_i2]
+    i_horas = np.flatnonzero((min(horas_i) <= horas) & (horas <= max(horas_i)))
+    celdas = []
+    if len(i_anio) and len(i_dia):
+        celdas = np.ravel_multi_index((i_anio[0], i_dia[0], i_horas), cubo_od.forma)
+    return cubo_od.matriz(celdas, **filtros)
+
+def args_flujos(filtros, anio, t_dia, horas_i):
+    # Argumentos de figura_flujos: líneas de deseo de los n_flujos pares OD
+    # con más viajes
+    zats = cubo("od").zats
+    lon, lat = centroides_zat()
+    o, d, viajes = matriz_flujos(filtros, anio, t_dia, horas_i).principales(n_flujos)
+    con_geometria = np.isfinite(lon[o]) & np.isfinite(lon[d])
+    o, d, viajes = o[con_geometria], d[con_geometria], viajes[con_geometria]
+    etiquetas = ["ZAT {} → ZAT {}".format(zats[i], zats[j]) for i, j in zip(o, d)]
+    return (lon[o], lat[o], lon[d], lat[d], viajes, etiquetas,
+            "Flujos principales en " + str(anio), capas_mapa())
+
+def empaqueta(figura):
+    # Figura (diccionario) tal como se guarda en los stores
+    return codifica_figura(figura) if transporte_binario else figura
+
+def figura_json(funcion, *args, **kwargs):
+    # Construye la figura y la devuelve como diccionario listo para enviar,
+    # así la validación de Plotly queda en el proceso que la arma
+    return funcion(*args, **kwargs).to_plotly_json()
+
+def obtiene_agregados(datos, agrega):
+    # Lee los agregados de la cache del worker; si no están (expulsados por
+    # el LRU o calculados en otro worker) se buscan en disco y si tampoco
+    # están se recalculan con los filtros.
+    clave = datos["clave"]
+    with metricas.fase("agregacion"):
+        datasets = cache_agregados.get(clave)
+        if datasets is None:
+            datasets = memo_agregados.obtiene(clave_cache(clave, version_datos),
+                                              lambda: agrega(datos["filtros"]))
+            cache_agregados.set(clave, datasets)
+    return datasets
 
 # Mapa
-@app.callback(
-    Output('gr-v', 'children'),    
-    Input('store-graf-od', 'data'),
-    Input('store-graf-od-comp', 'data'),
-    State('check_comp', 'value'),
-    State('check_tipo_comp', 'value'),
-    Input('tabs-v', "active_tab"), prevent_initial_call=True)
-def render_mapa_od(grafs, grafs_comp, comp, tipo_comp, active_tab_v):
-    if comp:
-        if active_tab_v == "tab-v-o":
-            return dcc.Graph(figure=grafs_comp["Origen"])
-        elif active_tab_v == "tab-v-d":
-            return dcc.Graph(figure=grafs_comp["Destino"])
-    if not comp:    
-        if active_tab_v == "tab-v-o":
-            return dcc.Graph(figure=grafs["Origen"])
-        elif active_tab_v == "tab-v-d":
-            return dcc.Graph(figure=grafs["Destino"])
+# Las pestañas del mapa solo eligen una figura de los stores, que ya están en
+# el navegador: con pestanas_cliente lo hace assets/pestanas.js y no hay
+# petición al servidor. render_mapa_od es la misma lógica en Python para
+# PESTANAS_CLIENTE=0. En los dos casos los arreglos binarios se decodifican
+# antes de pasar la figura a dcc.Graph
+oculto, visible = {'display': 'none'}, {'display': 'block'}
+pestanas_mapa = {"tab-v-o": "Origen", "tab-v-d": "Destino", "tab-v-f": "Flujos"}
+
+def render_mapa_od(grafs, grafs_comp, active_tab_v, comp):
+    if comp and active_tab_v == "tab-v-f":
+        return no_update, oculto, visible
+    figuras = grafs_comp if comp else grafs
+    if figuras is None or pestanas_mapa.get(active_tab_v) not in figuras:
+        raise PreventUpdate
+    return decodifica_figura(figuras[pestanas_mapa[active_tab_v]]), visible, oculto
+
+dependencias_mapa = (Output('fig-v', 'figure'),
+                     Output('fig-v', 'style'),
+                     Output('msg-v', 'style'),
+                     Input('store-graf-od', 'data'),
+                     Input('store-graf-od-comp', 'data'),
+                     Input('tabs-v', "active_tab"),
+                     State('check_comp', 'value'))
+
+if pestanas_cliente:
+    clientside_callback(ClientsideFunction("pestanas", "mapa_od"), *dependencias_mapa,
+                        prevent_initial_call=True)
+else:
+    app.callback(*dependencias_mapa, prevent_initial_call=True)(
+        metricas.instrumenta(render_mapa_od))
+
+# Partición modal, hora de inicio y distancia: (pestañas, gráfica). Cada
+# figura se construye en el servidor cuando se abre su pestaña, solo para ese
+# tipo de día, y queda en memo_figuras para la próxima vez
+pestanas_grafs = {"part_mod": ('tabs-part-mod', 'fig-part-mod'),
+                  "h_i": ('tabs-h-i', 'fig-h-i'),
+                  "dist": ('tabs-distancia', 'fig-dist')}
+
+def dia_pestana(active_tab):
+    # Las pestañas terminan en hab, sab o dom
+    sufijo = (active_tab or "hab").split("-")[-1]
+    return "lab" if sufijo == "hab" else sufijo
+
+def render_grafs(tipo):
+    def render(datos_grafs, active_tab):
+        if datos_grafs is None or active_tab is None:
+            raise PreventUpdate
+        return figura_grafs(tipo, datos_grafs, dia_pestana(active_tab)), visible
+    render.__name__ = "render_" + tipo
+    return render
+
+for tipo, (tabs, grafica) in pestanas_grafs.items():
+    app.callback(Output(grafica, 'figure'), Output(grafica, 'style'),
+                 Input('store-val-grafs', 'data'), Input(tabs, "active_tab"),
+                 prevent_initial_call=True)(metricas.instrumenta(render_grafs(tipo)))
 
 @app.callback(
     Output('store-graf-od', 'data'),
@@ -511,104 +888,53 @@ def render_mapa_od(grafs, grafs_comp, comp, tipo_comp, active_tab_v):
     Input('button-gen-mapa-od', 'n_clicks'),
     State('check_comp', 'value'),
     State('dd-v-anio', 'value'),
-    State('dd-v-t-dia', 'value'),
-    State('rs-h-i-od', 'value'),
-    State('in-rang', 'value'), prevent_initial_call=True)    
-def genera_mapa_od(datos_json, btn_gen, comparar, anio, t_dia, horas_i, rango_input):
+    Input('dd-v-t-dia', 'value'),
+    Input('rs-h-i-od', 'value'),
+    State('in-rang', 'value'),
+    State('dd-clasif', 'value'),
+    State('in-n-clases', 'value'), prevent_initial_call=True)    
+@metricas.instrumenta
+def genera_mapa_od(datos_od, btn_gen, comparar, anio, t_dia, horas_i, rango_input,
+                   metodo, n_clases):
     
-    if ctx.triggered_id != 'button-gen-mapa-od':
+    # El rango de horas y el tipo de día actualizan el mapa en vivo una vez
+    # filtrados los datos
+    if ctx.triggered_id not in ('button-gen-mapa-od', 'dd-v-t-dia', 'rs-h-i-od'):
+        raise PreventUpdate
+    if datos_od is None or t_dia is None:
         raise PreventUpdate
 
     if comparar:
         raise PreventUpdate
 
-    if rango_input is None:
-        rango_input="100,500,1000,2000"        
-    
-    limites = [int(x.strip()) for x in rango_input.split(",")]
-
-    label_limites = []
-    for l in range(len(limites)):
-        if l == 0:
-            label = "<{}".format(limites[l])
-        else:
-            label = "[{};{})".format(limites[l-1],limites[l])
-        label_limites.append(label)
-    label_limites.append(">={}".format(limites[-1]))    
-    
-    datasets = json.loads(datos_json)    
-
-    df_o = pd.read_json(datasets['df_o_'+str(anio)[-2:]], orient='split')
-    df_d = pd.read_json(datasets['df_d_'+str(anio)[-2:]], orient='split') 
-    
-    df_o = df_o[(min(horas_i)<=df_o[c_h_i2]) & (df_o[c_h_i2]<=max(horas_i)) 
-                & (df_o[c_tipo_dia]==t_dia)]
-    df_d = df_d[(min(horas_i)<=df_d[c_h_i2]) & (df_d[c_h_i2]<=max(horas_i))
-                & (df_d[c_tipo_dia]==t_dia)]
-    
-    df_o = df_o.groupby(by=[c_o]).agg(viajes_o=("viajes_o","sum"))
-    df_o.reset_index(inplace=True)
-    df_d = df_d.groupby(by=[c_d]).agg(viajes_d=("viajes_d","sum"))
-    df_d.reset_index(inplace=True)
+    try:
+        limites = limites_usuario(metodo, rango_input, "100,500,1000,2000", int)
+    except ValueError:
+        raise PreventUpdate
     
-    df_o['viajes_rango'] = df_o['viajes_o'].apply(lambda x: np.searchsorted(limites, x, side="right"))
-    df_d['viajes_rango'] = df_d['viajes_d'].apply(lambda x: np.searchsorted(limites, x, side="right"))
+    datasets = obtiene_agregados(datos_od, agrega_od)
 
-    df_od = [df_o, df_d]
-    cols_o_d = [c_o, c_d]
+    with metricas.fase("filtro"):
+        zats_viajes = [viajes_zat(datasets['acum_o'], anio, t_dia, horas_i),
+                       viajes_zat(datasets['acum_d'], anio, t_dia, horas_i)]
     od_aux = ["Origen","Destino"]
-    cols_viajes=['viajes_o','viajes_d' ]
-
-    escala_colores = [((0.0, px.colors.sequential.Plasma_r[grupo]),
-                       (1.0, px.colors.sequential.Plasma_r[grupo])) 
-                  for grupo in range(len(label_limites))]
-
-    figures_o_d = dict()
 
+    # Las tres figuras son independientes: se arman en el pool de procesos
+    tareas = []
     for od_temp in range(len(od_aux)):
-        df_anio_temp = df_od[od_temp]
-        
-        fig = go.Figure()
-        
-        if len(df_anio_temp) > 0:
-            for grupo in range(len(label_limites)):                
-                df_trace = df_anio_temp[df_anio_temp['viajes_rango'] == grupo]    
-                fig.add_choroplethmapbox(geojson=geo_zat,
-                                          locations=df_trace[cols_o_d[od_temp]],
-                                          z=df_trace[cols_viajes[od_temp]],#'viajes_rango'
-                                          featureidkey="properties.ID",
-                                          showlegend=True,
-                                          name=label_limites[grupo],
-                                          colorscale=escala_colores[grupo],
-                                          showscale=False,)
-                
-        fig.update_layout(
-            title=dict(text=od_aux[od_temp] + " de los viajes en " + str(anio)),
-            margin=dict(l=4, r=4, t=5, b=3),
-            mapbox=dict(
-                style='carto-positron',
-                zoom=8,
-                center={"lat": 4.657946861376187, "lon": -74.09476461866534},
-                layers= [
-                    {
-                        "source": geo_bta,
-                        "type": "line",
-                        "color": "black",
-                        "line": {"width": 2},
-                    },
-                    {
-                        "source": geo_vias,
-                        "type": "line",
-                        "color": "#020081",
-                        "line": {"width": 1.5},
-                    }
-                ],
-            ),
-        )
-        
-        figures_o_d[od_aux[od_temp]]=fig
+        zats, valores = zats_viajes[od_temp]
+        clasificacion = Clasificacion.crea(metodo, valores, limites, n_clases or 5)
+        tareas.append((figura_mapa, (zats, valores,
+                                     clasificacion, url_geo(ruta_zat, "medio", ("ID",)),
+                                     od_aux[od_temp] + " de los viajes en " + str(anio),
+                                     capas_mapa())))
 
-    return figures_o_d
+    with metricas.fase("flujos"):
+        tareas.append((figura_flujos, args_flujos(datos_od["filtros"], anio, t_dia, horas_i)))
+    with metricas.fase("figura"):
+        figuras = pool_figuras.mapa(tareas)
+
+    return dict(zip(od_aux + ["Flujos"], map(empaqueta, figuras)))
 
     
 @app.callback(
@@ -619,385 +945,253 @@ def genera_mapa_od(datos_json, btn_gen, comparar, anio, t_dia, horas_i, rango_in
     State('check_tipo_comp', 'value'),
     State('dd-v-anio-base', 'value'),
     State('dd-v-anio-comparacion', 'value'),
-    State('dd-v-t-dia', 'value'),
-    State('rs-h-i-od', 'value'),
-    State('in-rang', 'value'), prevent_initial_call=True)
-def genera_mapa_od_comp(datos_json, btn_gen, comparar, tipo_comp,
-                        anio_b, anio_c, t_dia, horas_i, rango_input):
+    Input('dd-v-t-dia', 'value'),
+    Input('rs-h-i-od', 'value'),
+    State('in-rang', 'value'),
+    State('dd-clasif', 'value'),
+    State('in-n-clases', 'value'), prevent_initial_call=True)
+@metricas.instrumenta
+def genera_mapa_od_comp(datos_od, btn_gen, comparar, tipo_comp,
+                        anio_b, anio_c, t_dia, horas_i, rango_input, metodo, n_clases):
     
-    if ctx.triggered_id != 'button-gen-mapa-od':
+    # El rango de horas y el tipo de día actualizan el mapa en vivo una vez
+    # filtrados los datos
+    if ctx.triggered_id not in ('button-gen-mapa-od', 'dd-v-t-dia', 'rs-h-i-od'):
+        raise PreventUpdate
+    if datos_od is None or t_dia is None:
         raise PreventUpdate
 
     if not comparar:
         raise PreventUpdate
 
-    if rango_input is None:
-        if tipo_comp == "Absoluto":
-            rango_input="-100, -50, -10, 0, 10, 50, 100"
-        else:
-            rango_input="-10, -5, -1, 0, 1, 5, 10"
-    
-    limites = [float(x.strip()) for x in rango_input.split(",")]
-
-    label_limites = []
-    for l in range(len(limites)):
-        if l == 0:
-            label = "<{}".format(limites[l])
-        else:
-            label = "[{};{})".format(limites[l-1],limites[l])
-        label_limites.append(label)
-    label_limites.append(">={}".format(limites[-1]))    
-    
-    datasets = json.loads(datos_json)    
-
-    # Lee el año de interés
-    df_o_b = pd.read_json(datasets['df_o_'+str(anio_b)[-2:]], orient='split')
-    df_d_b = pd.read_json(datasets['df_d_'+str(anio_b)[-2:]], orient='split') 
-    
-    df_o_c = pd.read_json(datasets['df_o_'+str(anio_c)[-2:]], orient='split')
-    df_d_c = pd.read_json(datasets['df_d_'+str(anio_c)[-2:]], orient='split')
-    
-    # Filtra las horas
-    df_o_b = df_o_b[(df_o_b[c_h_i2].between(min(horas_i), max(horas_i))) & 
-                    (df_o_b[c_tipo_dia]==t_dia)]
-    df_o_b = df_o_b.groupby(by=[c_anio, c_o]).agg(viajes_o=("viajes_o","sum"))
-    df_o_b.reset_index(inplace=True)
-    df_d_b = df_d_b[(df_d_b[c_h_i2].between(min(horas_i), max(horas_i))) &
-                    (df_d_b[c_tipo_dia]==t_dia)]
-    df_d_b = df_d_b.groupby(by=[c_anio, c_d]).agg(viajes_d=("viajes_d","sum"))
-    df_d_b.reset_index(inplace=True)
-    
-    df_o_c = df_o_c[(df_o_c[c_h_i2].between(min(horas_i), max(horas_i))) &
-                    (df_o_c[c_tipo_dia]==t_dia)]
-    df_o_c = df_o_c.groupby(by=[c_anio, c_o]).agg(viajes_o=("viajes_o","sum"))
-    df_o_c.reset_index(inplace=True)
-    df_d_c = df_d_c[(df_d_c[c_h_i2].between(min(horas_i), max(horas_i))) &
-                    (df_d_c[c_tipo_dia]==t_dia)]
-    df_d_c = df_d_c.groupby(by=[c_anio, c_d]).agg(viajes_d=("viajes_d","sum"))
-    df_d_c.reset_index(inplace=True)
-    
-    
-    df_o_diff = df_o_b.merge(df_o_c, how="left", on=[c_o])
-    df_o_diff["anio_y"]=df_o_diff["anio_y"].fillna(anio_c)
-    df_o_diff["viajes_o_y"]=df_o_diff["viajes_o_y"].fillna(0)
-    
-    df_d_diff = df_d_b.merge(df_d_c, how="left", on=[c_d])
-    df_d_diff["anio_y"]=df_d_diff["anio_y"].fillna(anio_c)
-    df_d_diff["viajes_d_y"]=df_d_diff["viajes_d_y"].fillna(0)
-    
-    
-    df_o_diff.insert(df_o_diff.shape[1], c_var_v, df_o_diff["viajes_o_y"]-df_o_diff["viajes_o_x"])
-    df_d_diff.insert(df_d_diff.shape[1], c_var_v, df_d_diff["viajes_d_y"]-df_d_diff["viajes_d_x"])
-    
-    if tipo_comp == "Porcentaje":
-        df_o_diff.insert(df_o_diff.shape[1], c_var_v_p, df_o_diff[c_var_v]*100/df_o_diff["viajes_o_x"])
-        df_d_diff.insert(df_d_diff.shape[1], c_var_v_p, df_d_diff[c_var_v]*100/df_d_diff["viajes_d_x"])
-        df_o_diff[c_var_v_p] = df_o_diff[c_var_v_p].round(2) 
-        df_d_diff[c_var_v_p] = df_d_diff[c_var_v_p].round(2)    
-    
-        df_o_diff['viajes_rango'] = df_o_diff[c_var_v_p].apply(lambda x: np.searchsorted(limites, x, side="right"))
-        df_d_diff['viajes_rango'] = df_d_diff[c_var_v_p].apply(lambda x: np.searchsorted(limites, x, side="right"))
-        valor_hover = c_var_v_p
-    
     if tipo_comp == "Absoluto":
-        df_o_diff['viajes_rango'] = df_o_diff[c_var_v].apply(lambda x: np.searchsorted(limites, x, side="right"))
-        df_d_diff['viajes_rango'] = df_d_diff[c_var_v].apply(lambda x: np.searchsorted(limites, x, side="right"))
-        valor_hover = c_var_v
+        rango_defecto = "-100, -50, -10, 0, 10, 50, 100"
+    else:
+        rango_defecto = "-10, -5, -1, 0, 1, 5, 10"
+    try:
+        limites = limites_usuario(metodo, rango_input, rango_defecto)
+    except ValueError:
+        raise PreventUpdate
     
+    datasets = obtiene_agregados(datos_od, agrega_od)
 
-    df_od = [df_o_diff, df_d_diff]
-    cols_o_d = [c_o, c_d]
+    # Todos los años quedan alineados sobre el mismo índice de ZAT; las ZAT
+    # nuevas o desaparecidas entre los dos años se conservan
+    zats = cubo("od").zats
+    i_b, i_c = indice_anio(anio_b), indice_anio(anio_c)
+    if i_b is None or i_c is None:
+        raise PreventUpdate
     od_aux = ["Origen","Destino"]
 
-    escala_colores = [((0.0, px.colors.sequential.Plasma_r[grupo]),
-                       (1.0, px.colors.sequential.Plasma_r[grupo])) 
-                  for grupo in range(len(label_limites))]
-
-    figures_o_d = dict()
-
-    for od_temp in range(len(od_aux)):
-        df_anio_temp = df_od[od_temp]
-        fig = go.Figure()
-        
-        if len(df_anio_temp) > 0:
-            for grupo in range(len(label_limites)):                
-                df_trace = df_anio_temp[df_anio_temp['viajes_rango'] == grupo]    
-                fig.add_choroplethmapbox(geojson=geo_zat,
-                                          locations=df_trace[cols_o_d[od_temp]],
-                                          z=df_trace[valor_hover],
-                                          featureidkey="properties.ID",
-                                          showlegend=True,
-                                          name=label_limites[grupo],
-                                          colorscale=escala_colores[grupo],
-                                          showscale=False,)
-    
-            fig.update_layout(
-                title=dict(text="Comparación del " + od_aux[od_temp].lower() + 
-                           " entre " + str(anio_b) + " y " + str(anio_c)),
-                margin=dict(l=4, r=4, t=5, b=3),
-                mapbox=dict(
-                    style='carto-positron',
-                    zoom=8,
-                    center={"lat": 4.657946861376187, "lon": -74.09476461866534},
-                    layers= [
-                        {
-                            "source": geo_bta,
-                            "type": "line",
-                            "color": "black",
-                            "line": {"width": 2},
-                        },
-                        {
-                            "source": geo_vias,
-                            "type": "line",
-                            "color": "#020081",
-                            "line": {"width": 1.5},
-                        }
-                    ],
-                ),
-            )
-        figures_o_d[od_aux[od_temp]]=fig
-
-    return figures_o_d
-
-# Partición modal
-@app.callback(
-    Output('gr-part-mod', 'children'),    
-    Input('store-graf-part-mod', 'data'),
-    Input('tabs-part-mod', "active_tab"), prevent_initial_call=True)
-def render_part_modal(grafs, active_tab):
-        
-    if active_tab == "tab-part-mod-hab":
-        return dcc.Graph(figure=grafs["lab"])
-    elif active_tab == "tab-part-mod-sab":
-        return dcc.Graph(figure=grafs["sab"])
-    elif active_tab == "tab-part-mod-dom":
-        return dcc.Graph(figure=grafs["dom"])
-    
-# Hora de inicio
-@app.callback(
-    Output('gr-h-i', 'children'),    
-    Input('store-graf-h-i', 'data'),
-    Input('tabs-h-i', "active_tab"), prevent_initial_call=True)
-def render_h_i(grafs, active_tab):        
-    if active_tab == "tab-h-i-hab":
-        return dcc.Graph(figure=grafs["lab"])
-    elif active_tab == "tab-h-i-sab":
-        return dcc.Graph(figure=grafs["sab"])
-    elif active_tab == "tab-h-i-dom":
-        return dcc.Graph(figure=grafs["dom"])
-    
-# Distancia de los viajes
-@app.callback(
-    Output('gr-dist', 'children'),    
-    Input('store-graf-dist', 'data'),
-    Input('tabs-distancia', "active_tab"), prevent_initial_call=True)
-def render_dist(grafs, active_tab):        
-    if active_tab == "tab-dist-hab":
-        return dcc.Graph(figure=grafs["lab"])
-    elif active_tab == "tab-dist-sab":
-        return dcc.Graph(figure=grafs["sab"])
-    elif active_tab == "tab-dist-dom":
-        return dcc.Graph(figure=grafs["dom"])
-    
-@app.callback(
-    Output('store-graf-part-mod', 'data'),
-    Output('store-graf-h-i', 'data'),
-    Output('store-graf-dist', 'data'),
+    tareas = []
+    for od_temp, acumulado in zip(od_aux, [datasets['acum_o'], datasets['acum_d']]):
+        with metricas.fase("filtro"):
+            dif = Comparacion(*viajes_anios(acumulado, t_dia, horas_i)).par(i_b, i_c)
+        presente = dif["presente"]
+        if tipo_comp == "Porcentaje":
+            # Sin viajes en el año base (p.ej. ZAT nuevas) no hay porcentaje
+            valores = dif["porcentaje"][presente].round(2)
+            sin_base = "Sin viajes en " + str(anio_b) if np.isnan(valores).any() else None
+            clasificacion = Clasificacion.crea(metodo, valores, limites, n_clases or 5,
+                                               decimales=2, etiqueta_nulo=sin_base)
+        else:
+            valores = dif["absoluta"][presente]
+            clasificacion = Clasificacion.crea(metodo, valores, limites, n_clases or 5)
+        tareas.append((figura_mapa, (
+            zats[presente], valores,
+            clasificacion, url_geo(ruta_zat, "medio", ("ID",)),
+            "Comparación del " + od_temp.lower() + 
+            " entre " + str(anio_b) + " y " + str(anio_c), capas_mapa(),
+            ",.2f" if tipo_comp == "Porcentaje" else ",.0f")))
+    with metricas.fase("figura"):
+        figuras = pool_figuras.mapa(tareas)
+
+    return dict(zip(od_aux, map(empaqueta, figuras)))
+
+@callback_fondo(
+    Output('store-val-grafs', 'data'),
     State('dd-o', 'value'),
     State('dd-d', 'value'),
     State('dd-prop', 'value'),
-    Input('button-filt-data', 'n_clicks'))
-def genera_grafs(origenes, destinos, propositos, btn_filtrar):
+    Input('button-filt-data', 'n_clicks'),
+    State('tabs-part-mod', 'active_tab'),
+    State('tabs-h-i', 'active_tab'),
+    State('tabs-distancia', 'active_tab'),
+    progress=[Output('progreso-grafs', 'value'), Output('progreso-grafs', 'max')],
+    progress_default=[0, 1],
+    cancel=cancela_filtros, prevent_initial_call=True)
+@metricas.instrumenta
+def genera_grafs(set_progress, origenes, destinos, propositos, btn_filtrar,
+                 tab_part_mod, tab_h_i, tab_dist):
     
     if btn_filtrar is None:
         raise PreventUpdate
         
-    if df_part0 is None or df_h_i0 is None or df_dist0 is None:
-        raise PreventUpdate
-        
-    test_o_part = df_part0[c_o] >=  0
-    test_d_part = df_part0[c_d] >=  0
-    test_prop_part = df_part0[c_prop].isin(prop_val)
-    
-    test_o_h_i = df_h_i0[c_o] >=  0
-    test_d_h_i = df_h_i0[c_d] >=  0
-    test_prop_h_i = df_h_i0[c_prop].isin(prop_val)
-    
-    test_o_dist = df_dist0[c_o] >=  0
-    test_d_dist = df_dist0[c_d] >=  0
-    test_prop_dist = df_dist0[c_prop].isin(prop_val)
-    
-    if origenes is not None:
-        if not isinstance(origenes,list):
-            origenes=[origenes]            
-        if "Todas" not in origenes:
-            test_o_part = df_part0[c_o].isin(origenes)
-            test_o_h_i = df_h_i0[c_o].isin(origenes)
-            test_o_dist = df_dist0[c_o].isin(origenes)
-            
-    if destinos is not None:
-        if not isinstance(destinos,list):
-            destinos=[destinos]            
-        if "Todas" not in destinos:
-            test_d_part = df_part0[c_d].isin(destinos)
-            test_d_h_i = df_h_i0[c_d].isin(destinos)
-            test_d_dist = df_dist0[c_d].isin(destinos)
-            
-    if propositos is not None:
-        if not isinstance(propositos,list):
-            propositos=[propositos]            
-        test_prop_part = df_part0[c_prop].isin(propositos)
-        test_prop_h_i = df_h_i0[c_prop].isin(propositos)
-        test_prop_dist = df_dist0[c_prop].isin(propositos)
-
-    df_part_filt = df_part0[(test_o_part) & (test_d_part) & (test_prop_part)]    
-    df_part = df_part_filt.groupby(by=[c_anio, c_tipo_dia, c_modo])\
-    .agg(viajes_modo=(c_viajes,"sum"))
-    df_part.reset_index(inplace=True)    
+    # Los agregados se calculan una vez. Con el pool en paralelo las figuras
+    # de las pestañas abiertas se arman aquí, fuera de la petición; las demás
+    # (y todas con el pool en serie) al abrir cada pestaña
+    filtros = normaliza_filtros(origenes, destinos, propositos)
+    datos_grafs = {"clave": clave_cache("grafs", filtros), "filtros": filtros}
+    set_progress((0, 2))
+    obtiene_agregados(datos_grafs, agrega_grafs)
+    set_progress((1, 2))
+    if pool_figuras.paralelo:
+        construye_grafs(datos_grafs, zip(generadores_grafs, map(dia_pestana,
+                                         [tab_part_mod, tab_h_i, tab_dist])))
+    set_progress((2, 2))
+    return datos_grafs
+
+def agrega_grafs(filtros):
+    df_part = cubo("part_mod").tabla("viajes_modo", **filtros)
     df_part.insert(0, c_anio+"2", df_part[c_anio].astype(str))   
     
-    df_h_i_filt = df_h_i0[(test_o_h_i) & (test_d_h_i) & (test_prop_h_i)]    
-    df_hi = df_h_i_filt.groupby(by=[c_anio, c_tipo_dia, c_modo, c_h_i])\
-    .agg(viajes_h_i=(c_viajes,"sum"))
-    df_hi.reset_index(inplace=True)
-    
+    df_hi = cubo("h_i").tabla("viajes_h_i", **filtros)
     
-    df_dist_filt = df_dist0[(test_o_dist) & (test_d_dist) & (test_prop_dist)]    
-    df_dist = df_dist_filt.groupby(by=[c_anio, c_tipo_dia, c_modo, c_rango_dist])\
-    .agg(viajes_dist=(c_viajes,"sum"))
-    df_dist.reset_index(inplace=True)     
+    df_dist = cubo("dist").tabla("viajes_dist", **filtros)
     df_dist.insert(0, c_anio+"2", df_dist[c_anio].astype(str))
     
-    figs_part = genera_part(df_part)
-    figs_h_i = genera_h_i(df_hi)
-    figs_dist = genera_dist(df_dist)
+    return {"part_mod": df_part, "h_i": df_hi, "dist": df_dist}
+
+def clave_figura(tipo, datos_grafs, t_dia):
+    return clave_cache(tipo, t_dia, version_figuras, version_datos, datos_grafs["filtros"])
+
+def figura_grafs(tipo, datos_grafs, t_dia):
+    # Figura de un tipo de día, memorizada en disco y guardada como
+    # diccionario listo para enviar al navegador
+    def calcula():
+        datasets = obtiene_agregados(datos_grafs, agrega_grafs)
+        with metricas.fase("figura"):
+            return figura_json(generadores_grafs[tipo], datasets[tipo], t_dia)
+    return memo_figuras.obtiene(clave_figura(tipo, datos_grafs, t_dia), calcula)
+
+def construye_grafs(datos_grafs, figuras):
+    # Las figuras (tipo, tipo de día) pedidas que falten en la cache, en el
+    # pool de procesos
+    pendientes = [(tipo, t_dia) for tipo, t_dia in figuras
+                  if clave_figura(tipo, datos_grafs, t_dia) not in memo_figuras]
+    if not pendientes:
+        return
+    datasets = obtiene_agregados(datos_grafs, agrega_grafs)
+    with metricas.fase("figura"):
+        figuras = pool_figuras.mapa([(figura_json, (generadores_grafs[tipo],
+                                                    datasets[tipo], t_dia))
+                                     for tipo, t_dia in pendientes])
+    for (tipo, t_dia), figura in zip(pendientes, figuras):
+        memo_figuras.set(clave_figura(tipo, datos_grafs, t_dia), figura)
     
-    return figs_part, figs_h_i, figs_dist
+def genera_part(df_part, t_dia):    
+    df_part_temp = df_part[df_part[c_tipo_dia]==t_dia]
+    
+    fig = px.bar(df_part_temp,
+                 x=c_modo,
+                 y="viajes_modo",
+                 labels={c_anio+"2": "Año",
+                         c_modo: "Modo",
+                         "viajes_modo": "Viajes"
+                        },
+                 color=c_anio+"2",
+                 barmode="group",
+
+                 # facet_row=c_modo, facet_row_spacing=0.3,
+                 #category_orders={c_tipo_dia:[x for x in ["lab","sab","dom"] if x in df_part[c_tipo_dia].unique()]},
+                 custom_data = [c_anio, "viajes_modo"])
+
+    # Los modos salen de la tabla y no del cubo: la figura se puede armar en
+    # un proceso del pool, que no tiene los cubos
+    modos = df_part[c_modo].unique().tolist()
+    fig.update_xaxes(            
+        tickmode = 'array',
+        tickvals = modos,
+        ticktext = modos
+        )
     
-def genera_part(df_part):    
-    figures_part_mod = dict()
+    fig.update_layout(
+        title=dict(text="Distribución modal de un día " + 
+                   [lv['label'] for lv in dd_tipo_dia if lv['value'] == t_dia][0].lower())
+        ) 
 
-    for t_dia in tipo_dia_dispo:
-        df_part_temp = df_part[df_part[c_tipo_dia]==t_dia]
-        
-        fig = px.bar(df_part_temp,
-                     x=c_modo,
-                     y="viajes_modo",
-                     labels={c_anio+"2": "Año",
-                             c_modo: "Modo",
-                             "viajes_modo": "Viajes"
-                            },
-                     color=c_anio+"2",
-                     barmode="group",
+     # Actualiza el hover tooltip
+    fig.update_traces(hovertemplate="<br>".join([
+                "Año: %{customdata[0]}",
+                "Viajes: %{customdata[1]:,.0f}"
+    ]))
 
-                     # facet_row=c_modo, facet_row_spacing=0.3,
-                     #category_orders={c_tipo_dia:[x for x in ["lab","sab","dom"] if x in df_part[c_tipo_dia].unique()]},
-                     custom_data = [c_anio, "viajes_modo"])
+    return fig
 
-        fig.update_xaxes(            
+def genera_h_i(df_hi, t_dia):
+    
+    d_h_i_temp = df_hi[df_hi[c_tipo_dia]==t_dia]
+    if len(d_h_i_temp) > 0:
+        fig = px.line(d_h_i_temp, x=c_h_i, y="viajes_h_i",
+                      color=c_anio, markers=True,
+                      labels={c_anio: "Año",
+                              c_tipo_dia:"Día",
+                              c_h_i: "Hora de inicio",
+                              c_modo: "Modo",
+                              "viajes_h_i": "Viajes"
+                             },
+                      facet_row=c_modo, facet_row_spacing=0.3,
+                      category_orders={c_tipo_dia:[x for x in ["lab","sab","dom"] if x in df_hi[c_tipo_dia].unique()]},
+                      custom_data = [c_anio, "viajes_h_i"])
+    
+        fig.update_xaxes(
             tickmode = 'array',
-            tickvals = modo_dispo,
-            ticktext = modo_dispo
+            tickvals = sorted(df_hi[c_h_i].unique()),
+            ticktext = horas_dispo
             )
         
         fig.update_layout(
-            title=dict(text="Distribución modal de un día " + 
+            title=dict(text="Hora de inicio de los viajes de un día " +
                        [lv['label'] for lv in dd_tipo_dia if lv['value'] == t_dia][0].lower())
-            ) 
-
-         # Actualiza el hover tooltip
+            )
+    
+        # Actualiza el hover tooltip
         fig.update_traces(hovertemplate="<br>".join([
                     "Año: %{customdata[0]}",
                     "Viajes: %{customdata[1]:,.0f}"
         ]))
+    else:
+        fig = go.Figure()
 
-        figures_part_mod[t_dia] = fig
+    return fig
 
-    return figures_part_mod
 
-def genera_h_i(df_hi):
-    
-    figures_h_i = dict()
-    
-    for t_dia in tipo_dia_dispo:
-        d_h_i_temp = df_hi[df_hi[c_tipo_dia]==t_dia]
-        if len(d_h_i_temp) > 0:
-            fig = px.line(d_h_i_temp, x=c_h_i, y="viajes_h_i",
-                          color=c_anio, markers=True,
-                          labels={c_anio: "Año",
-                                  c_tipo_dia:"Día",
-                                  c_h_i: "Hora de inicio",
-                                  c_modo: "Modo",
-                                  "viajes_h_i": "Viajes"
-                                 },
-                          facet_row=c_modo, facet_row_spacing=0.3,
-                          category_orders={c_tipo_dia:[x for x in ["lab","sab","dom"] if x in df_hi[c_tipo_dia].unique()]},
-                          custom_data = [c_anio, "viajes_h_i"])
+def genera_dist(df_dist, t_dia):
     
-            fig.update_xaxes(
-                tickmode = 'array',
-                tickvals = sorted(df_hi[c_h_i].unique()),
-                ticktext = horas_dispo
-                )
-            
-            fig.update_layout(
-                title=dict(text="Hora de inicio de los viajes de un día " +
-                           [lv['label'] for lv in dd_tipo_dia if lv['value'] == t_dia][0].lower())
-                )
+    df_dist_temp = df_dist[df_dist[c_tipo_dia]==t_dia]
+    if len(df_dist_temp) > 0:
+        fig = px.bar(df_dist_temp, x=c_rango_dist, y="viajes_dist",
+                     color=c_anio+"2",
+                     barmode="group",
+                     labels={c_anio+"2": "Año",
+                             c_tipo_dia:"Día",
+                             c_rango_dist: "Distancia",
+                             c_modo: "Modo",
+                             "viajes_dist": "Viajes"
+                            },
+                     facet_row=c_modo, facet_row_spacing=0.3,
+                     category_orders={c_tipo_dia:[x for x in ["lab","sab","dom"] if x in df_dist[c_tipo_dia].unique()],
+                                      c_rango_dist:rangos_dist},
+                     custom_data = ["viajes_dist", c_rango_dist])
     
-            # Actualiza el hover tooltip
-            fig.update_traces(hovertemplate="<br>".join([
-                        "Año: %{customdata[0]}",
-                        "Viajes: %{customdata[1]:,.0f}"
-            ]))
-        else:
-            fig = go.Figure()
+        fig.update_layout(
+            title=dict(text="Distancia de los viajes de un día "  + 
+                       [lv['label'] for lv in dd_tipo_dia if lv['value'] == t_dia][0].lower())
+            )
         
-        figures_h_i[t_dia] = fig
-
-    return figures_h_i
-
-
-def genera_dist(df_dist):
-    
-    figures_dist = dict()
-    
-    for t_dia in tipo_dia_dispo:
-        df_dist_temp = df_dist[df_dist[c_tipo_dia]==t_dia]
-        if len(df_dist_temp) > 0:
-            fig = px.bar(df_dist_temp, x=c_rango_dist, y="viajes_dist",
-                         color=c_anio+"2",
-                         barmode="group",
-                         labels={c_anio+"2": "Año",
-                                 c_tipo_dia:"Día",
-                                 c_rango_dist: "Distancia",
-                                 c_modo: "Modo",
-                                 "viajes_dist": "Viajes"
-                                },
-                         facet_row=c_modo, facet_row_spacing=0.3,
-                         category_orders={c_tipo_dia:[x for x in ["lab","sab","dom"] if x in df_dist[c_tipo_dia].unique()],
-                                          c_rango_dist:rangos_dist},
-                         custom_data = ["viajes_dist", c_rango_dist])
-    
-            fig.update_layout(
-                title=dict(text="Distancia de los viajes de un día "  + 
-                           [lv['label'] for lv in dd_tipo_dia if lv['value'] == t_dia][0].lower())
-                )
-            
-            # Actualiza el hover tooltip
-            fig.update_traces(hovertemplate="<br>".join([
-                        "Viajes: %{customdata[0]:,.0f}",
-                        "Dist: %{customdata[1]}"
-            ]))
-            
-            # fig.update_layout(height=700)
-        else:
-            fig = go.Figure()
+        # Actualiza el hover tooltip
+        fig.update_traces(hovertemplate="<br>".join([
+                    "Viajes: %{customdata[0]:,.0f}",
+                    "Dist: %{customdata[1]}"
+        ]))
         
-        figures_dist[t_dia] = fig
+        # fig.update_layout(height=700)
+    else:
+        fig = go.Figure()
     
-    return figures_dist
+    return fig
 
+generadores_grafs = {"part_mod": genera_part, "h_i": genera_h_i, "dist": genera_dist}
  
 @app.callback(
     Output('dd-v-anio', 'disabled'),
@@ -1005,6 +1199,7 @@ def genera_dist(df_dist):
     Output('dd-v-anio-comparacion', 'disabled'),
     Output('check_tipo_comp', 'options'),
     Input('check_comp', 'value'))
+@metricas.instrumenta
 def genera_dd_v_anio(comparar):  
     if comparar:
         return True, False, False, \
@@ -1020,13 +1215,14 @@ def genera_dd_v_anio(comparar):
     Output('dd-v-anio-comparacion', 'options'),
     State('dd-v-anio-base', 'disabled'),
     Input('dd-v-anio-base', 'value'), prevent_initial_call=True)
+@metricas.instrumenta
 def genera_v_anio_comp(anio_b_des, anio_base):
     if anio_b_des:
         PreventUpdate
     if anio_base is None:
         PreventUpdate
     elif anio_base is not None:
-        comp = [a for a in anios_dispo if a > anio_base]
+        comp = [a for a in anios_dispo() if a > anio_base]
         if len(comp) > 0:
             return comp
         else:
@@ -1050,16 +1246,105 @@ def genera_v_anio_comp(anio_b_des, anio_base):
     Output('button-gen-mapa-od', 'disabled'),
     Input('button-filt-data', 'n_clicks'),
     Input('store-val-inter-od', 'data'))
+@metricas.instrumenta
 def activa_butt_gen_mapa(btn_filtrar, datos_json):    
     if btn_filtrar is None:
         return True
     if ctx.triggered_id == 'store-val-inter-od':
         return False 
 
+@app.callback(
+    Output('link-exporta-csv', 'href'),
+    Output('link-exporta-parquet', 'href'),
+    Input('dd-o', 'value'),
+    Input('dd-d', 'value'),
+    Input('dd-prop', 'value'),
+    Input('dd-v-anio', 'value'),
+    Input('dd-v-t-dia', 'value'),
+    Input('rs-h-i-od', 'value'),
+    Input('check_comp', 'value'),
+    Input('dd-v-anio-base', 'value'),
+    Input('dd-v-anio-comparacion', 'value'))
+@metricas.instrumenta
+def genera_links_exporta(origenes, destinos, propositos, anio, t_dia, horas_i,
+                         comparar, anio_b, anio_c):
+    # Enlaces de descarga con la selección actual (ver exporta_od). Al
+    # comparar van los dos años comparados
+    filtros = normaliza_filtros(origenes, destinos, propositos)
+    anios = [anio_b, anio_c] if comparar else [anio]
+    parametros = {"o": ["Todas"] if filtros["origenes"] is None else filtros["origenes"],
+                  "d": ["Todas"] if filtros["destinos"] is None else filtros["destinos"],
+                  "prop": filtros["propositos"],
+                  "anio": [a for a in anios if a is not None],
+                  "dia": [] if t_dia is None else [t_dia],
+                  "h": horas_i or []}
+    consulta = urlencode(parametros, doseq=True)
+    return tuple(app.get_relative_path("/exporta/viajes_od." + formato) + "?" + consulta
+                 for formato in ("csv", "parquet"))
+
+# Panel de depuración
+if panel_metricas:
+    @app.callback(
+        Output('tabla-metricas', 'children'),
+        Input('int-metricas', 'n_intervals'))
+    def muestra_metricas(n_intervals):
+        recientes = metricas.tabla_recientes()
+        if not recientes:
+            return html.P("Sin invocaciones registradas.")
+        return dbc.Table.from_dataframe(pd.DataFrame(recientes), striped=True,
+                                        bordered=False, hover=True, size="sm")
+
+# Precálculo
+def precalcula(filtros):
+    # Agregados y figuras de los gráficos (pestañas por defecto, día hábil)
+    # de una combinación de filtros
+    datos_od = {"clave": clave_cache("od", filtros), "filtros": filtros}
+    obtiene_agregados(datos_od, agrega_od)
+    datos_grafs = {"clave": clave_cache("grafs", filtros), "filtros": filtros}
+    construye_grafs(datos_grafs, [(tipo, "lab") for tipo in generadores_grafs])
+
+def calienta():
+    # Vista por defecto (todas las ZAT, propósito por defecto) y las
+    # combinaciones más pedidas según lo registrado en disco
+    try:
+        # Archivos de geometría de los mapas
+        capas_mapa()
+        url_geo(ruta_zat, "medio", ("ID",))
+        centroides_zat()
+    except Exception:
+        logging.getLogger(__name__).exception("Falló la preparación de las geometrías")
+    pendientes = [normaliza_filtros("Todas", "Todas", prop_defecto)]
+    for filtros in popularidad.principales(n_precalculo):
+        if filtros not in pendientes:
+            pendientes.append(filtros)
+    for filtros in pendientes:
+        try:
+            precalcula(filtros)
+        except Exception:
+            logging.getLogger(__name__).exception("Falló el precálculo de %s", filtros)
+
+# Combinaciones populares que se precalculan (0 desactiva el precálculo)
+n_precalculo = int(os.environ.get("N_PRECALCULO", 5))
+_precalculo = None
+
+def inicia_precalculo():
+    # Lo llama el punto de entrada del servidor que atiende las peticiones
+    # (abajo, o post_worker_init en gunicorn.conf.py), no la importación: así
+    # no corre en el maestro de gunicorn con --preload, en el recargador de
+    # debug ni en los procesos que solo importan la app
+    global _precalculo
+    if n_precalculo > 0 and _precalculo is None:
+        _precalculo = threading.Thread(target=calienta, name="precalculo", daemon=True)
+        _precalculo.start()
+
 # Ejecuta la app
 if __name__ == '__main__':
     # hot-reloading: La app cambia automáticamente con cambios en el código
     # Para desactivar esto, cambiar el parám. por dev_tools_hot_reload=False
     # app.run_server(debug=True)
-    app.run_server(host='0.0.0.0', port=8050, debug=True) 
+    debug = True
+    # Con el recargador de debug el servidor corre en un proceso hijo
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        inicia_precalculo()
+    app.run_server(host='0.0.0.0', port=8050, debug=debug) 
 	
@@ -0,0 +1,68 @@
+// Cambio de pestañas del mapa en el navegador.
+// Las figuras de origen, destino y flujos ya están en los stores, así que
+// elegir una no pasa por el servidor. Misma lógica que render_mapa_od en
+// app_wbg.py.
+// Los arreglos que llegan en binario ({dtype, bdata}, ver transporte.py) se
+// convierten en arreglos tipados y los textos con diccionario
+// ({categorias, codigos}) en listas antes de pasar la figura a la gráfica.
+var tipos_arreglo = {
+    i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+    i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+};
+
+function decodifica(valor) {
+    if (valor === null || typeof valor !== "object" || Array.isArray(valor)) {
+        return valor;
+    }
+    if (typeof valor.bdata === "string" && valor.dtype in tipos_arreglo) {
+        var texto = atob(valor.bdata);
+        var bytes = new Uint8Array(texto.length);
+        for (var i = 0; i < texto.length; i++) {
+            bytes[i] = texto.charCodeAt(i);
+        }
+        var arreglo = new tipos_arreglo[valor.dtype](bytes.buffer);
+        if (typeof valor.shape !== "string") {
+            return arreglo;
+        }
+        // Matriz: una fila (arreglo tipado) por punto
+        var forma = valor.shape.split(",").map(Number), filas = [];
+        for (var f = 0; f < forma[0]; f++) {
+            filas.push(arreglo.subarray(f * forma[1], (f + 1) * forma[1]));
+        }
+        return filas;
+    }
+    if (Array.isArray(valor.categorias) && valor.codigos) {
+        return Array.from(decodifica(valor.codigos), function(codigo) {
+            return valor.categorias[codigo];
+        });
+    }
+    // Copia: la figura del store se vuelve a leer en el próximo cambio
+    var copia = {};
+    for (var clave in valor) {
+        copia[clave] = decodifica(valor[clave]);
+    }
+    return copia;
+}
+
+function decodifica_figura(figura) {
+    return Object.assign({}, figura, {data: (figura.data || []).map(decodifica)});
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    pestanas: {
+        mapa_od: function(grafs, grafs_comp, active_tab_v, comp) {
+            var oculto = {display: "none"}, visible = {display: "block"};
+            var nombres = {"tab-v-o": "Origen", "tab-v-d": "Destino", "tab-v-f": "Flujos"};
+            var comparar = comp && comp.length > 0;
+            if (comparar && active_tab_v === "tab-v-f") {
+                return [window.dash_clientside.no_update, oculto, visible];
+            }
+            var figuras = comparar ? grafs_comp : grafs;
+            var nombre = nombres[active_tab_v];
+            if (!figuras || !(nombre in figuras)) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            return [decodifica_figura(figuras[nombre]), visible, oculto];
+        }
+    }
+});
@@ -0,0 +1,148 @@
+#%%
+# Cache en memoria del proceso para los resultados intermedios del tablero.
+# Los callbacks guardan aquí las tablas agregadas (DataFrames / arreglos de
+# NumPy) y al navegador solo viaja la clave, de modo que no hay que
+# serializar ni volver a leer JSON en cada clic.
+# MemoDisco guarda en disco resultados ya listos (las figuras), compartidos
+# entre todos los usuarios y workers de la máquina. Popularidad cuenta, también
+# en disco, qué combinaciones de filtros se piden más.
+import hashlib
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+import diskcache
+import numpy as np
+import pandas as pd
+
+
+def clave_cache(*partes):
+    # Hash estable de cualquier combinación de valores serializables en JSON
+    texto = json.dumps(partes, sort_keys=True, default=str)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def tamano_bytes(valor):
+    # Estimación del tamaño en memoria de los objetos que se guardan en cache
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, pd.Series):
+        return int(valor.memory_usage(index=True, deep=True))
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, dict):
+        return sum(tamano_bytes(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sum(tamano_bytes(v) for v in valor)
+    if hasattr(valor, "nbytes"):
+        return int(valor.nbytes)
+    return sys.getsizeof(valor)
+
+
+class CacheLRU:
+    """Cache LRU con presupuesto de memoria en bytes.
+
+    Cuando la suma de los tamaños supera ``max_bytes`` se descartan las
+    entradas menos usadas recientemente. Es segura entre hilos, que es como
+    gunicorn/Flask atiende las peticiones dentro de un mismo worker.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, clave):
+        with self._lock:
+            return clave in self._datos
+
+    def __len__(self):
+        with self._lock:
+            return len(self._datos)
+
+    def get(self, clave, defecto=None):
+        with self._lock:
+            if clave not in self._datos:
+                return defecto
+            self._datos.move_to_end(clave)
+            return self._datos[clave][0]
+
+    def set(self, clave, valor):
+        tamano = tamano_bytes(valor)
+        if tamano > self.max_bytes:
+            # No cabe ni vaciando la cache: se entrega sin guardar
+            return False
+        with self._lock:
+            if clave in self._datos:
+                self.bytes -= self._datos.pop(clave)[1]
+            self._datos[clave] = (valor, tamano)
+            self.bytes += tamano
+            while self.bytes > self.max_bytes:
+                _, (_, tamano_viejo) = self._datos.popitem(last=False)
+                self.bytes -= tamano_viejo
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+            self.bytes = 0
+
+
+class MemoDisco:
+    """Memoización en disco compartida entre procesos.
+
+    ``max_bytes`` acota el tamaño total (se descartan las entradas menos
+    usadas) y ``ttl`` la vida en segundos de cada entrada.
+    """
+
+    def __init__(self, carpeta, max_bytes, ttl):
+        self.ttl = ttl
+        self._disco = diskcache.Cache(carpeta, size_limit=max_bytes,
+                                      eviction_policy="least-recently-used")
+
+    def __contains__(self, clave):
+        return clave in self._disco
+
+    def get(self, clave, defecto=None):
+        return self._disco.get(clave, defecto)
+
+    def set(self, clave, valor):
+        return self._disco.set(clave, valor, expire=self.ttl)
+
+    def clear(self):
+        self._disco.clear()
+
+    def obtiene(self, clave, calcula):
+        # Devuelve lo guardado o lo calcula y lo guarda
+        valor = self._disco.get(clave)
+        if valor is None:
+            valor = calcula()
+            self.set(clave, valor)
+        return valor
+
+
+class Popularidad:
+    """Contador en disco de las combinaciones de filtros pedidas.
+
+    Lo comparten los workers y sobrevive a los reinicios; ``principales``
+    devuelve las más pedidas para precalcularlas al arrancar.
+    """
+
+    def __init__(self, carpeta):
+        self._disco = diskcache.Cache(carpeta)
+
+    def registra(self, valor):
+        clave = clave_cache(valor)
+        self._disco.add(("valor", clave), valor)
+        self._disco.incr(("cuenta", clave), default=0)
+
+    def principales(self, n):
+        cuentas = []
+        for clave in self._disco.iterkeys():
+            if clave[0] == "cuenta":
+                cuentas.append((self._disco.get(clave, 0), clave[1]))
+        cuentas.sort(reverse=True)
+        valores = (self._disco.get(("valor", clave)) for _, clave in cuentas[:n])
+        return [v for v in valores if v is not None]
@@ -0,0 +1,43 @@
+#%%
+# Comparación de viajes entre años sobre el índice fijo de ZAT del cubo.
+# Todos los años quedan alineados en arreglos (año x ZAT), así que las
+# diferencias absolutas y porcentuales de un par de años, o de todos los
+# pares a la vez, son aritmética de arreglos sin merges. Una ZAT cuenta si
+# tiene registros en alguno de los dos años: las que solo aparecen en el año
+# de comparación (nuevas) o solo en el base (desaparecidas) se conservan.
+import numpy as np
+
+# Estado de cada ZAT en la comparación
+EN_AMBOS, NUEVA, DESAPARECIDA = 0, 1, 2
+
+
+class Comparacion:
+    """Diferencias entre años de ``suma`` / ``presente`` (años x ZAT)."""
+
+    def __init__(self, suma, presente):
+        self.suma = np.asarray(suma, dtype=float)
+        self.presente = np.asarray(presente, dtype=bool)
+
+    @staticmethod
+    def _diferencias(base, comp, pres_base, pres_comp):
+        presente = pres_base | pres_comp
+        base, comp = np.broadcast_arrays(base, comp)
+        absoluta = comp - base
+        # Sin viajes en el año base el porcentaje no está definido (NaN)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            porcentaje = np.where(base != 0, absoluta * 100 / np.where(base != 0, base, 1), np.nan)
+        estado = np.full(presente.shape, EN_AMBOS, dtype=np.int8)
+        estado[pres_comp & ~pres_base] = NUEVA
+        estado[pres_base & ~pres_comp] = DESAPARECIDA
+        return {"presente": presente, "base": base, "comparacion": comp,
+                "absoluta": absoluta, "porcentaje": porcentaje, "estado": estado}
+
+    def par(self, i_base, i_comp):
+        # Arreglos por ZAT para el par de años (índices en el eje de años)
+        return self._diferencias(self.suma[i_base], self.suma[i_comp],
+                                 self.presente[i_base], self.presente[i_comp])
+
+    def todos(self):
+        # Los mismos arreglos con ejes (año base, año de comparación, ZAT)
+        return self._diferencias(self.suma[:, None], self.suma[None, :],
+                                 self.presente[:, None], self.presente[None, :])
@@ -0,0 +1,665 @@
+#%%
+# Motor de agregación sobre tablas origen-destino codificadas con enteros.
+# Al iniciar, cada columna de la tabla larga (ZAT, propósito, tipo de día,
+# hora, modo, ...) se reemplaza por su índice dentro de un catálogo ordenado.
+# Un filtro se resuelve con tablas de búsqueda booleanas indexadas por esos
+# códigos y la agregación con np.bincount sobre el índice plano del tensor
+# de salida (p.ej. año x tipo de día x hora x ZAT), sin máscaras isin sobre
+# texto ni groupby de pandas en cada clic.
+#
+# Índice de filas por llave: las filas se guardan ordenadas por origen, así
+# las de cada ZAT de origen quedan contiguas; ``orden_d`` lista las filas
+# ordenadas por destino y ``orden_celda`` por propósito y celda de dims (año,
+# tipo de día, hora, ...). La selección de una llave es la unión de las
+# listas de sus valores; el filtro parte de la llave con menos filas y la
+# intersección con las demás se verifica solo sobre esas filas, por código:
+# el costo crece con las filas elegidas y no con el tamaño de la tabla.
+#
+# Cada arreglo se guarda con el tipo más angosto que alcanza: los códigos con
+# el entero más chico para el tamaño de su catálogo (int8/int16 en lugar de
+# int64) y los viajes en float32 cuando la conversión es exacta. Las sumas se
+# siguen acumulando en float64 (np.bincount).
+#
+# Los códigos se guardan en un archivo Arrow IPC sin comprimir que los
+# workers abren con memory map: la primera vez se construye y las siguientes
+# se abre al instante, y todos los procesos comparten las mismas páginas
+# físicas en lugar de tener cada uno su copia.
+#
+# Junto a cada cubo se guardan resúmenes (rollups): el mismo cubo con las
+# filas ya sumadas por propósito y dims, conservando solo el origen, solo el
+# destino, ninguno o ambos. Sin filtro de ZAT (el caso más común) la consulta
+# recorre el resumen por propósito, de unos cientos de filas, en lugar de la
+# tabla completa; cada eje de salida se responde con el resumen más chico
+# que tiene las llaves del filtro y del eje.
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from datos import carga, escanea, valores_unicos
+from matriz_od import MatrizOD, _compacta
+
+
+def codifica_zat(valores, zats):
+    # Posición de cada ZAT dentro del catálogo ordenado; -1 si no está
+    valores = np.asarray(valores)
+    cod = np.searchsorted(zats, valores)
+    cod = np.minimum(cod, len(zats) - 1)
+    cod[zats[cod] != valores] = -1
+    return cod
+
+
+def catalogo_zats(zats):
+    # Las ZAT con ID negativo marcan registros sin zona válida: quedan fuera
+    # del catálogo, así que sus filas se descartan (también con "Todas")
+    zats = np.asarray(zats)
+    return zats[zats >= 0]
+
+
+def factoriza(serie):
+    # Códigos sobre el catálogo ordenado de valores presentes; -1 si falta
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.cat.remove_unused_categories()
+        serie = serie.cat.reorder_categories(sorted(serie.cat.categories))
+        return serie.cat.codes.to_numpy(), np.asarray(serie.cat.categories)
+    cod, cat = pd.factorize(serie, sort=True)
+    return cod, np.asarray(cat)
+
+
+def entero_minimo(maximo):
+    # Entero con signo más chico que guarda valores en [-1, maximo]
+    for tipo in (np.int8, np.int16, np.int32):
+        if maximo <= np.iinfo(tipo).max:
+            return tipo
+    return np.int64
+
+
+def angosta_viajes(viajes):
+    # float32 solo si todos los valores se recuperan exactos (p.ej. viajes
+    # enteros); con decimales como 0.1 se conserva float64 para que las
+    # sumas y la descarga den los mismos números que la tabla
+    viajes = np.asarray(viajes, dtype=np.float64)
+    with np.errstate(over="ignore", invalid="ignore"):
+        reducido = viajes.astype(np.float32)
+    if np.array_equal(reducido, viajes):
+        return reducido
+    return viajes
+
+
+# Por encima de esta fracción de las filas el índice no conviene y se
+# recorre la tabla completa con una máscara
+fraccion_indice = 0.25
+
+
+def posiciones_tramos(inicio, seleccion):
+    # Posiciones [inicio[c], inicio[c + 1]) de los códigos ``seleccion``,
+    # concatenadas
+    desde, hasta = inicio[seleccion], inicio[seleccion + 1]
+    largos = hasta - desde
+    previos = np.concatenate([[0], np.cumsum(largos)[:-1]])
+    return np.repeat(desde - previos, largos) + np.arange(largos.sum())
+
+
+def filtros_celdas(celdas, forma, dims, catalogos):
+    # Filtro de escaneo por columna de dims que cubre las celdas pedidas:
+    # (mínimo, máximo) si los valores elegidos son contiguos en el catálogo,
+    # la lista de valores si no; las columnas con todos sus valores no se
+    # filtran. Las celdas exactas se verifican después de codificar
+    filtros = dict()
+    for col, n, cod in zip(dims, forma, np.unravel_index(np.asarray(celdas, dtype=np.int64),
+                                                          forma)):
+        cod = np.unique(cod)
+        if len(cod) == n:
+            continue
+        valores = catalogos[col][cod]
+        if len(cod) > 1 and cod[-1] - cod[0] == len(cod) - 1:
+            filtros[col] = (valores[0], valores[-1])
+        else:
+            filtros[col] = valores.tolist()
+    return filtros
+
+
+def catalogo(valores):
+    # Catálogo leído de los metadatos JSON; los textos quedan como objetos,
+    # igual que al factorizar con pandas
+    if len(valores) > 0 and isinstance(valores[0], str):
+        return np.array(valores, dtype=object)
+    return np.array(valores)
+
+
+def a_numpy(columna):
+    # Vista de NumPy sobre la columna de Arrow, sin copia cuando es un solo bloque
+    if columna.num_chunks == 1:
+        return columna.chunk(0).to_numpy()
+    return columna.to_numpy()
+
+
+def codifica_arrow(arreglo, catalogo):
+    # Igual que codifica_zat para una columna de Arrow de cualquier tipo
+    if pa.types.is_dictionary(arreglo.type):
+        arreglo = arreglo.dictionary_decode()
+    cod = pc.index_in(arreglo, value_set=pa.array(catalogo, type=arreglo.type))
+    return cod.fill_null(-1).to_numpy()
+
+
+class CuboBase:
+    """Consultas comunes a CuboOD y CuboDataset.
+
+    Cada subclase da sus filas con ``_filas`` (todas, con el propósito) y
+    ``_lotes`` (las que cumplen un filtro), su número de filas con
+    ``__len__`` y si conserva las llaves de ZAT con ``con_o`` / ``con_d``;
+    sobre eso se arman los resúmenes y las agregaciones.
+    """
+
+    # Resúmenes: nombre -> (conserva el origen, conserva el destino)
+    llaves_resumenes = {"proposito": (False, False), "origen": (True, False),
+                        "destino": (False, True), "od": (True, True)}
+
+    def resume(self, con_o, con_d):
+        # Cubo en memoria con las filas sumadas por propósito, dims y las
+        # llaves de ZAT que se conservan: cada fila es una celda con registros
+        z = len(self.zats)
+        n_base = int(np.prod(self.forma))
+        claves, viajes = [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+        for cod_prop, base, cod_o, cod_d, v in self._filas():
+            clave = cod_prop.astype(np.int64) * n_base + base
+            if con_o:
+                clave = clave * z + cod_o
+            if con_d:
+                clave = clave * z + cod_d
+            clave, v = _compacta(clave, v)
+            claves.append(clave)
+            viajes.append(v)
+        clave, viajes = _compacta(np.concatenate(claves), np.concatenate(viajes))
+
+        resumen = CuboOD.__new__(CuboOD)
+        for atributo in ["col_o", "col_d", "col_prop", "dims", "zats", "zats_o", "zats_d",
+                         "catalogos", "forma"]:
+            setattr(resumen, atributo, getattr(self, atributo))
+        resumen.cod_o = resumen.cod_d = None
+        if con_d:
+            resumen.cod_d = clave % z
+            clave = clave // z
+        if con_o:
+            resumen.cod_o = clave % z
+            clave = clave // z
+        resumen.base = clave % n_base
+        resumen.cod_prop = clave // n_base
+        resumen.viajes = viajes
+        resumen._ordena()
+        resumen._angosta()
+        resumen.resumenes = dict()
+        return resumen
+
+    def elegidas(self, celdas):
+        # Tabla de búsqueda: si cada celda de dims está en ``celdas``
+        elegidas = np.zeros(int(np.prod(self.forma)), dtype=bool)
+        elegidas[np.asarray(celdas, dtype=np.int64)] = True
+        return elegidas
+
+    def fuente(self, con_o=False, con_d=False):
+        # El cubo o resumen más chico que tiene las llaves de ZAT pedidas
+        candidatos = [self] + [r for r in self.resumenes.values()
+                               if (r.con_o or not con_o) and (r.con_d or not con_d)]
+        return min(candidatos, key=len)
+
+    def agrega(self, ejes, origenes=None, destinos=None, propositos=None):
+        # Un tensor denso por eje con la suma de viajes y si cada celda tiene
+        # registros. Cada eje es None (solo dims) o la columna de origen o de
+        # destino, que se agrega como último eje. Cada eje sale del resumen
+        # más chico que lo responde y cada fuente se recorre una sola vez.
+        filtros = {"origenes": origenes, "destinos": destinos, "propositos": propositos}
+        fuentes = [self.fuente(origenes is not None or eje == self.col_o,
+                               destinos is not None or eje == self.col_d) for eje in ejes]
+        resultado = [None] * len(ejes)
+        for fuente in {id(f): f for f in fuentes}.values():
+            indices = [i for i, f in enumerate(fuentes) if f is fuente]
+            for i, r in zip(indices, fuente._agrega([ejes[i] for i in indices], **filtros)):
+                resultado[i] = r
+        return resultado
+
+    def _agrega(self, ejes, origenes=None, destinos=None, propositos=None):
+        z = len(self.zats)
+        formas = [self.forma if eje is None else self.forma + (z,) for eje in ejes]
+        sumas = [np.zeros(int(np.prod(f))) for f in formas]
+        conteos = [np.zeros(int(np.prod(f)), dtype=np.int64) for f in formas]
+        for base, cod_o, cod_d, viajes in self._lotes(origenes, destinos, propositos):
+            for i, eje in enumerate(ejes):
+                clave = base
+                if eje is not None:
+                    # Los códigos angostos se suben a int64 antes de combinarlos
+                    clave = base.astype(np.int64) * z + (cod_o if eje == self.col_o else cod_d)
+                sumas[i] += np.bincount(clave, weights=viajes, minlength=len(sumas[i]))
+                conteos[i] += np.bincount(clave, minlength=len(conteos[i]))
+        return [(s.reshape(f), (c > 0).reshape(f))
+                for s, c, f in zip(sumas, conteos, formas)]
+
+    def matriz(self, celdas, origenes=None, destinos=None, propositos=None):
+        # MatrizOD con los viajes de las celdas de dims ``celdas`` sumadas
+        # (p.ej. un año, un tipo de día y un rango de horas). Solo se leen
+        # las filas de esas celdas: el costo crece con ellas y no con la tabla
+        fuente = self.fuente(True, True)
+        partes = list(zip(*fuente._lotes(origenes, destinos, propositos, celdas=celdas)))
+        if not partes:
+            return MatrizOD.desde_claves(np.zeros(0, dtype=np.int64), np.zeros(0), len(self.zats))
+        _, cod_o, cod_d, viajes = (np.concatenate(p) for p in partes)
+        return MatrizOD.desde_codigos(cod_o, cod_d, viajes, len(self.zats))
+
+    def pares(self, salida, origenes=None, destinos=None, propositos=None, zats_por_lote=100):
+        # Viajes por (celda de salida, origen, destino), por grupos de
+        # ``zats_por_lote`` ZAT de origen: cada grupo sale sumado y nunca está
+        # la matriz completa en memoria. ``salida`` da la celda de salida de
+        # cada celda de dims (-1 = se descarta). Produce tuplas
+        # (celda, cod_o, cod_d, viajes) ordenadas por celda, origen y destino
+        fuente = self.fuente(True, True)
+        z = len(self.zats)
+        salida = np.asarray(salida, dtype=np.int64)
+        celdas = np.flatnonzero(salida >= 0)
+        zats_o = self.zats_o if origenes is None else \
+            self.zats_o[np.isin(self.zats_o, origenes)]
+        for inicio in range(0, len(zats_o), zats_por_lote):
+            grupo = zats_o[inicio:inicio + zats_por_lote].tolist()
+            claves, viajes = [], []
+            for base, cod_o, cod_d, v in fuente._lotes(grupo, destinos, propositos,
+                                                       celdas=celdas):
+                celda = salida[base]
+                m = celda >= 0
+                claves.append((celda[m] * z + cod_o[m]) * z + cod_d[m])
+                viajes.append(v[m])
+            if not claves:
+                continue
+            claves, suma = _compacta(np.concatenate(claves), np.concatenate(viajes))
+            if len(claves):
+                yield claves // (z * z), claves // z % z, claves % z, suma
+
+    def a_tabla(self, suma, presente, nombre, eje=None):
+        # Mismo resultado que groupby(dims [+ eje]).agg(nombre=(viajes, "sum"))
+        cols = self.dims + ([eje] if eje is not None else [])
+        cats = [self.catalogos[col] for col in self.dims]
+        if eje is not None:
+            cats.append(self.zats)
+        idx = np.nonzero(presente)
+        df = pd.DataFrame({col: cat[i] for col, cat, i in zip(cols, cats, idx)})
+        df[nombre] = suma[idx]
+        return df
+
+    def tabla(self, nombre, eje=None, **filtros):
+        (suma, presente), = self.agrega([eje], **filtros)
+        return self.a_tabla(suma, presente, nombre, eje)
+
+
+class CuboOD(CuboBase):
+    """Tabla de viajes codificada para filtrar por ZAT y propósito.
+
+    ``dims`` son las columnas que se conservan como ejes del resultado. El
+    origen y el destino se codifican contra el catálogo común ``zats`` para
+    que todos los cubos compartan el mismo índice de ZAT. Las filas con
+    valores faltantes en alguna llave se descartan, igual que en un groupby.
+    """
+
+    def __init__(self, df, col_o, col_d, col_prop, dims, col_viajes, zats):
+        self.col_o = col_o
+        self.col_d = col_d
+        self.col_prop = col_prop
+        self.dims = list(dims)
+        self.zats = catalogo_zats(zats)
+
+        self.catalogos = dict()
+        codigos = dict()
+        for col in self.dims + [col_prop]:
+            codigos[col], self.catalogos[col] = factoriza(df[col])
+        cod_o = codifica_zat(df[col_o].to_numpy(), self.zats)
+        cod_d = codifica_zat(df[col_d].to_numpy(), self.zats)
+
+        validos = (cod_o >= 0) & (cod_d >= 0)
+        for cod in codigos.values():
+            validos &= cod >= 0
+
+        self.forma = tuple(len(self.catalogos[col]) for col in self.dims)
+        self.base = np.ravel_multi_index([codigos[col][validos] for col in self.dims],
+                                         self.forma)
+        self.cod_o = cod_o[validos]
+        self.cod_d = cod_d[validos]
+        self.cod_prop = codigos[col_prop][validos]
+        self.viajes = np.nan_to_num(df[col_viajes].to_numpy(dtype=np.float64))[validos]
+        self._ordena()
+        self._angosta()
+        # ZAT que aparecen como origen y como destino (opciones de los filtros)
+        self.zats_o = self.zats[np.unique(self.cod_o)]
+        self.zats_d = self.zats[np.unique(self.cod_d)]
+        self.resumenes = dict()
+
+    def _ordena(self):
+        # Filas ordenadas por origen y destino (solo por destino si no hay
+        # origen); con las dos llaves, orden_d son las filas por destino
+        llaves = [cod for cod in (self.cod_d, self.cod_o) if cod is not None]
+        if llaves:
+            orden = np.lexsort(llaves)
+            for nombre in ["base", "cod_o", "cod_d", "cod_prop", "viajes"]:
+                if getattr(self, nombre) is not None:
+                    setattr(self, nombre, getattr(self, nombre)[orden])
+        tipo_fila = entero_minimo(len(self.viajes) - 1)
+        self.orden_d = None
+        if self.con_o and self.con_d:
+            self.orden_d = np.argsort(self.cod_d, kind="stable").astype(tipo_fila)
+        self.orden_celda = np.argsort(self._clave_celda(), kind="stable").astype(tipo_fila)
+
+    def _clave_celda(self):
+        # Propósito x celda de dims de cada fila
+        return self.cod_prop.astype(np.int64) * int(np.prod(self.forma)) + self.base
+
+    def _angosta(self):
+        # Cada arreglo con el tipo más angosto que alcanza
+        self.base = self.base.astype(entero_minimo(int(np.prod(self.forma)) - 1))
+        tipo_zat = entero_minimo(len(self.zats) - 1)
+        if self.cod_o is not None:
+            self.cod_o = self.cod_o.astype(tipo_zat)
+        if self.cod_d is not None:
+            self.cod_d = self.cod_d.astype(tipo_zat)
+        tipo_prop = entero_minimo(len(self.catalogos[self.col_prop]) - 1)
+        self.cod_prop = self.cod_prop.astype(tipo_prop)
+        self.viajes = angosta_viajes(self.viajes)
+
+    # Columnas del archivo IPC y atributos de CuboOD que guardan; en los
+    # resúmenes cod_o o cod_d (y orden_d) pueden faltar (None)
+    _arreglos = ["base", "cod_o", "cod_d", "cod_prop", "viajes", "orden_d", "orden_celda"]
+
+    @property
+    def con_o(self):
+        return self.cod_o is not None
+
+    @property
+    def con_d(self):
+        return self.cod_d is not None
+
+    def guarda(self, ruta):
+        # Arrow IPC sin comprimir, en un solo bloque por columna, para poder
+        # abrirlo con memory map sin copiar
+        meta = {"col_o": self.col_o, "col_d": self.col_d, "col_prop": self.col_prop,
+                "dims": self.dims, "zats": self.zats.tolist(),
+                "zats_o": self.zats_o.tolist(), "zats_d": self.zats_d.tolist(),
+                "catalogos": {col: cat.tolist() for col, cat in self.catalogos.items()}}
+        tabla = pa.table({nombre: getattr(self, nombre) for nombre in self._arreglos
+                          if getattr(self, nombre) is not None})
+        tabla = tabla.replace_schema_metadata({"cubo": json.dumps(meta)})
+        # Se escribe aparte y se renombra para que otro worker nunca abra un
+        # archivo a medio escribir
+        temporal = "{}.{}.tmp".format(ruta, os.getpid())
+        with pa.OSFile(temporal, "wb") as archivo:
+            with pa.ipc.new_file(archivo, tabla.schema) as escritor:
+                escritor.write_table(tabla)
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def abre(cls, ruta):
+        # Los arreglos quedan como vistas de solo lectura sobre el archivo
+        tabla = pa.ipc.open_file(pa.memory_map(ruta)).read_all()
+        meta = json.loads(tabla.schema.metadata[b"cubo"])
+        cubo = cls.__new__(cls)
+        cubo.col_o = meta["col_o"]
+        cubo.col_d = meta["col_d"]
+        cubo.col_prop = meta["col_prop"]
+        cubo.dims = meta["dims"]
+        cubo.zats = catalogo(meta["zats"])
+        cubo.zats_o = catalogo(meta["zats_o"])
+        cubo.zats_d = catalogo(meta["zats_d"])
+        cubo.catalogos = {col: catalogo(cat) for col, cat in meta["catalogos"].items()}
+        cubo.forma = tuple(len(cubo.catalogos[col]) for col in cubo.dims)
+        for nombre in cls._arreglos:
+            setattr(cubo, nombre, a_numpy(tabla.column(nombre))
+                    if nombre in tabla.column_names else None)
+        cubo.resumenes = dict()
+        return cubo
+
+    def _filas(self):
+        # Lotes (cod_prop, base, cod_o, cod_d, viajes) de todas las filas
+        yield self.cod_prop, self.base, self.cod_o, self.cod_d, self.viajes
+
+    def __len__(self):
+        return len(self.viajes)
+
+    def mascara(self, origenes=None, destinos=None, propositos=None, celdas=None):
+        # None equivale a no filtrar por esa llave; ``celdas`` son índices
+        # planos de dims
+        m = np.ones(len(self), dtype=bool)
+        if celdas is not None:
+            m &= self.elegidas(celdas)[self.base]
+        if propositos is not None:
+            m &= np.isin(self.catalogos[self.col_prop], propositos)[self.cod_prop]
+        if origenes is not None:
+            m &= np.isin(self.zats, origenes)[self.cod_o]
+        if destinos is not None:
+            m &= np.isin(self.zats, destinos)[self.cod_d]
+        return m
+
+    def _inicio(self, llave):
+        # Dónde empiezan las filas de cada valor en el orden de la llave ("o",
+        # "d" o "celda"); se calcula la primera vez que se usa
+        inicios = self.__dict__.setdefault("_inicios", dict())
+        if llave not in inicios:
+            if llave == "celda":
+                cod = self._clave_celda()
+                n = len(self.catalogos[self.col_prop]) * int(np.prod(self.forma))
+            else:
+                cod = self.cod_o if llave == "o" else self.cod_d
+                n = len(self.zats)
+            inicios[llave] = np.concatenate([[0], np.cumsum(np.bincount(cod, minlength=n))])
+        return inicios[llave]
+
+    def filas(self, origenes=None, destinos=None, propositos=None, celdas=None):
+        # Índices ordenados de las filas que cumplen el filtro, partiendo de
+        # la llave más selectiva; None si conviene recorrer la tabla
+        candidatos = []
+        for llave, zats, tiene in (("o", origenes, self.con_o), ("d", destinos, self.con_d)):
+            if zats is not None and tiene:
+                candidatos.append((llave, np.flatnonzero(np.isin(self.zats, zats))))
+        if propositos is not None or celdas is not None:
+            props = np.arange(len(self.catalogos[self.col_prop])) if propositos is None else \
+                np.flatnonzero(np.isin(self.catalogos[self.col_prop], propositos))
+            n_base = int(np.prod(self.forma))
+            celdas_elegidas = np.arange(n_base) if celdas is None else \
+                np.unique(np.asarray(celdas, dtype=np.int64))
+            candidatos.append(("celda", (props[:, None] * n_base + celdas_elegidas).ravel()))
+        if not candidatos:
+            return None
+        tamanos = []
+        for llave, seleccion in candidatos:
+            inicio = self._inicio(llave)
+            tamanos.append(int((inicio[seleccion + 1] - inicio[seleccion]).sum()))
+        n, (llave, seleccion) = min(zip(tamanos, candidatos), key=lambda c: c[0])
+        if n > fraccion_indice * len(self):
+            return None
+        posiciones = posiciones_tramos(self._inicio(llave), seleccion)
+        if llave == "o" or (llave == "d" and not self.con_o):
+            # Las filas ya están ordenadas por esta llave
+            filas = posiciones
+        else:
+            orden = self.orden_d if llave == "d" else self.orden_celda
+            filas = np.sort(orden[posiciones])
+        m = np.ones(len(filas), dtype=bool)
+        if llave != "celda":
+            if celdas is not None:
+                m &= self.elegidas(celdas)[self.base[filas]]
+            if propositos is not None:
+                m &= np.isin(self.catalogos[self.col_prop], propositos)[self.cod_prop[filas]]
+        if origenes is not None and llave != "o":
+            m &= np.isin(self.zats, origenes)[self.cod_o[filas]]
+        if destinos is not None and llave != "d":
+            m &= np.isin(self.zats, destinos)[self.cod_d[filas]]
+        return filas[m]
+
+    def _lotes(self, origenes=None, destinos=None, propositos=None, celdas=None):
+        # Códigos de las filas que cumplen el filtro: (base, cod_o, cod_d, viajes)
+        # (cod_o o cod_d son None en los resúmenes que no los conservan)
+        m = self.filas(origenes, destinos, propositos, celdas)
+        if m is None:
+            m = self.mascara(origenes, destinos, propositos, celdas)
+        yield tuple(None if arreglo is None else arreglo[m]
+                    for arreglo in (self.base, self.cod_o, self.cod_d, self.viajes))
+
+
+
+class CuboDataset(CuboBase):
+    """Variante fuera de memoria de CuboOD.
+
+    No guarda filas: en cada consulta escanea el dataset de Parquet con los
+    filtros de ZAT, propósito y celdas de dims (año, tipo de día, rango de
+    horas, ...) empujados al escaneo, lee solo las columnas necesarias y
+    acumula los lotes en el mismo tensor de salida. Sirve para matrices más
+    grandes que la memoria del worker.
+    """
+
+    def __init__(self, dataset, col_o, col_d, col_prop, dims, col_viajes, zats):
+        self.col_o = col_o
+        self.col_d = col_d
+        self.col_prop = col_prop
+        self.col_viajes = col_viajes
+        self.dims = list(dims)
+        self.zats = catalogo_zats(zats)
+        self.dataset = dataset
+        self.catalogos = valores_unicos(dataset, self.dims + [col_prop, col_o, col_d])
+        zats_o = self.catalogos.pop(col_o)
+        zats_d = self.catalogos.pop(col_d)
+        self.zats_o = zats_o[np.isin(zats_o, self.zats)]
+        self.zats_d = zats_d[np.isin(zats_d, self.zats)]
+        self.forma = tuple(len(self.catalogos[col]) for col in self.dims)
+        self.resumenes = dict()
+        self._n_filas = None
+
+    # El escaneo tiene todas las llaves
+    con_o = con_d = True
+
+    def __len__(self):
+        # Contar las filas recorre los metadatos de todos los fragmentos: se
+        # hace una sola vez (fuente() lo consulta en cada agregación)
+        if self._n_filas is None:
+            self._n_filas = self.dataset.count_rows()
+        return self._n_filas
+
+    def _filas(self):
+        # Un escaneo por propósito, para conocer el propósito de cada fila
+        for i, prop in enumerate(self.catalogos[self.col_prop]):
+            for base, cod_o, cod_d, viajes in self._lotes(propositos=[prop]):
+                yield np.full(len(base), i, dtype=np.int16), base, cod_o, cod_d, viajes
+
+    def _lotes(self, origenes=None, destinos=None, propositos=None, celdas=None):
+        columnas = self.dims + [self.col_o, self.col_d, self.col_viajes]
+        # Sin filtro de propósito se piden todos los del catálogo: así quedan
+        # fuera las filas sin propósito, igual que en CuboOD
+        if propositos is None:
+            propositos = self.catalogos[self.col_prop].tolist()
+        filtros = {self.col_o: origenes, self.col_d: destinos,
+                   self.col_prop: propositos}
+        elegidas = None
+        if celdas is not None:
+            # Año, tipo de día, hora, ... también se filtran en el escaneo
+            filtros.update(filtros_celdas(celdas, self.forma, self.dims, self.catalogos))
+            elegidas = self.elegidas(celdas)
+        for lote in escanea(self.dataset, columnas, filtros):
+            codigos = [codifica_arrow(lote.column(col), self.catalogos[col])
+                       for col in self.dims]
+            cod_o = codifica_arrow(lote.column(self.col_o), self.zats)
+            cod_d = codifica_arrow(lote.column(self.col_d), self.zats)
+            validos = (cod_o >= 0) & (cod_d >= 0)
+            for cod in codigos:
+                validos &= cod >= 0
+            viajes = lote.column(self.col_viajes).to_numpy(zero_copy_only=False)
+            # Los nulos de viajes se suman como cero, igual que en pandas
+            viajes = np.nan_to_num(viajes.astype(np.float64))
+            base = np.ravel_multi_index([cod[validos] for cod in codigos], self.forma)
+            cod_o, cod_d, viajes = cod_o[validos], cod_d[validos], viajes[validos]
+            if elegidas is not None:
+                m = elegidas[base]
+                base, cod_o, cod_d, viajes = base[m], cod_o[m], cod_d[m], viajes[m]
+            yield base, cod_o, cod_d, viajes
+
+
+class AcumuladoEje:
+    """Sumas acumuladas de un tensor de CuboOD.agrega a lo largo de un eje.
+
+    Se usa con el eje de la hora: la suma de cualquier rango [a, b] es la
+    resta de dos cortes del acumulado, sin volver a recorrer los registros.
+    Junto a la suma se acumula el número de celdas con registros, para saber
+    qué ZAT tienen viajes dentro del rango.
+    """
+
+    def __init__(self, suma, presente, valores, eje):
+        self.valores = np.asarray(valores)
+        self.eje = eje
+        forma = list(suma.shape)
+        forma[eje] = 1
+        self.suma = np.concatenate([np.zeros(forma), np.cumsum(suma, axis=eje)], axis=eje)
+        self.conteo = np.concatenate([np.zeros(forma, dtype=np.int32),
+                                      np.cumsum(presente, axis=eje, dtype=np.int32)], axis=eje)
+
+    @property
+    def nbytes(self):
+        return self.suma.nbytes + self.conteo.nbytes
+
+    def rango(self, minimo, maximo):
+        # (suma, presente) del rango cerrado [minimo, maximo] de valores del
+        # eje; el eje desaparece del resultado
+        i = int(np.searchsorted(self.valores, minimo, side="left"))
+        j = int(np.searchsorted(self.valores, maximo, side="right"))
+        suma = np.take(self.suma, j, axis=self.eje) - np.take(self.suma, i, axis=self.eje)
+        conteo = np.take(self.conteo, j, axis=self.eje) - np.take(self.conteo, i, axis=self.eje)
+        return suma, conteo > 0
+
+
+def ruta_resumen(ruta_cache, nombre):
+    return "{}.{}.arrow".format(ruta_cache[:-len(".arrow")], nombre)
+
+
+def agrega_resumenes(cubo, nombres, ruta_cache=None):
+    # Abre los resúmenes guardados junto al cubo o los construye y los guarda
+    for nombre in nombres:
+        ruta = None if ruta_cache is None else ruta_resumen(ruta_cache, nombre)
+        if ruta is not None and os.path.exists(ruta):
+            cubo.resumenes[nombre] = CuboOD.abre(ruta)
+            continue
+        resumen = cubo.resume(*CuboBase.llaves_resumenes[nombre])
+        if ruta is not None:
+            resumen.guarda(ruta)
+            resumen = CuboOD.abre(ruta)
+        cubo.resumenes[nombre] = resumen
+    return cubo
+
+
+def crea_cubo(dataset, col_o, col_d, col_prop, dims, col_viajes, zats,
+              en_disco=False, ruta_cache=None, resumenes=tuple(CuboBase.llaves_resumenes)):
+    # ``zats`` puede ser una función: el catálogo solo se calcula si hay que
+    # construir el cubo. Con ``ruta_cache`` el cubo se abre con memory map si
+    # ya existe y, si no, se construye una vez y se guarda ahí; lo mismo sus
+    # ``resumenes``. Fuera de memoria no se construye el resumen "od", que
+    # tendría casi tantas filas como la tabla.
+    if en_disco:
+        resumenes = [r for r in resumenes if r != "od"]
+    if not en_disco and ruta_cache is not None and os.path.exists(ruta_cache):
+        return agrega_resumenes(CuboOD.abre(ruta_cache), resumenes, ruta_cache)
+    if callable(zats):
+        zats = zats()
+    if en_disco:
+        cubo = CuboDataset(dataset, col_o, col_d, col_prop, dims, col_viajes, zats)
+        if ruta_cache is not None:
+            os.makedirs(os.path.dirname(ruta_cache) or ".", exist_ok=True)
+        return agrega_resumenes(cubo, resumenes, ruta_cache)
+    # Solo se cargan las columnas del cubo y el DataFrame se descarta una vez
+    # codificado
+    df = carga(dataset, list(dims) + [col_o, col_d, col_prop, col_viajes])
+    cubo = CuboOD(df, col_o, col_d, col_prop, dims, col_viajes, zats)
+    del df
+    if ruta_cache is None:
+        return agrega_resumenes(cubo, resumenes)
+    os.makedirs(os.path.dirname(ruta_cache) or ".", exist_ok=True)
+    cubo.guarda(ruta_cache)
+    # Versiones anteriores del mismo cubo y sus resúmenes (otros datos); en
+    # Linux los workers que aún las tengan abiertas siguen leyendo sin problema
+    prefijo = ruta_cache.rsplit("_", 1)[0]
+    for ruta in glob.glob(prefijo + "_*.arrow"):
+        if not ruta.startswith(ruta_cache[:-len(".arrow")]):
+            os.remove(ruta)
+    return agrega_resumenes(CuboOD.abre(ruta_cache), resumenes, ruta_cache)
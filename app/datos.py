@@ -0,0 +1,101 @@
+#%%
+# Capa de acceso a las tablas del tablero. Cada tabla se abre como un
+# pyarrow.dataset sobre sus archivos Parquet: los filtros de los controles se
+# traducen a expresiones que se empujan al escaneo (los grupos de filas se
+# descartan con las estadísticas del archivo) y solo se leen las columnas
+# necesarias.
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Patrón de archivos de cada tabla dentro de la carpeta de datos. La matriz
+# OD tiene un archivo por año (odmatrix_od_h_19.parquet, ...)
+TABLAS = {
+    "od": "odmatrix_od_h_*.parquet",
+    "part_mod": "odmatrix_part_mod.parquet",
+    "h_i": "odmatrix_h_i.parquet",
+    "dist": "odmatrix_dist.parquet",
+}
+
+
+def rutas_tabla(nombre, carpeta="assets"):
+    return sorted(glob.glob(os.path.join(carpeta, TABLAS[nombre])))
+
+
+def huella_datos(carpeta="assets"):
+    # Cambia cuando cambia cualquiera de los archivos de datos; sirve para
+    # invalidar lo que se construye a partir de ellos
+    partes = []
+    for nombre in TABLAS:
+        for ruta in rutas_tabla(nombre, carpeta):
+            info = os.stat(ruta)
+            partes.append((os.path.basename(ruta), info.st_size, info.st_mtime_ns))
+    return hashlib.sha1(json.dumps(partes).encode("utf-8")).hexdigest()[:16]
+
+
+def abre_tabla(nombre, carpeta="assets"):
+    # Todos los años de la matriz OD quedan en un solo dataset; el año es la
+    # llave de partición en la columna anio
+    return ds.dataset(rutas_tabla(nombre, carpeta), format="parquet")
+
+
+def expresion_filtros(filtros):
+    # {columna: lista de valores | (mínimo, máximo) | None} -> expresión de
+    # pyarrow para el escaneo. None equivale a no filtrar por esa columna.
+    expr = None
+    for col, valores in filtros.items():
+        if valores is None:
+            continue
+        if isinstance(valores, tuple):
+            e = (pc.field(col) >= valores[0]) & (pc.field(col) <= valores[1])
+        elif len(valores) == 0:
+            e = pc.scalar(False)
+        else:
+            e = pc.field(col).isin(list(valores))
+        expr = e if expr is None else expr & e
+    return expr
+
+
+def escanea(dataset, columnas=None, filtros=None):
+    # Lotes de registros (pyarrow.RecordBatch) que cumplen los filtros
+    filtro = expresion_filtros(filtros) if filtros else None
+    return dataset.to_batches(columns=columnas, filter=filtro)
+
+
+def carga(dataset, columnas, filtros=None):
+    # Materializa en pandas solo las columnas pedidas; los textos pasan
+    # directo de Arrow a categorías
+    filtro = expresion_filtros(filtros) if filtros else None
+    tabla = dataset.to_table(columns=columnas, filter=filtro)
+    return tabla.to_pandas(strings_to_categorical=True)
+
+
+def valores_unicos(dataset, columnas):
+    # Catálogo ordenado de cada columna, leyendo solo esas columnas por lotes
+    unicos = {col: set() for col in columnas}
+    for lote in dataset.to_batches(columns=columnas):
+        for col in columnas:
+            unicos[col].update(pc.unique(lote.column(col)).to_pylist())
+    return {col: np.array(sorted(v for v in valores if v is not None))
+            for col, valores in unicos.items()}
+
+
+def ordena_parquet(ruta, columnas, filas_por_grupo=250_000, ruta_salida=None):
+    # Reescribe un archivo ordenado por las columnas de filtro (p.ej. origen,
+    # destino) para que las estadísticas de cada grupo de filas sean
+    # estrechas y el escaneo pueda descartar la mayoría de ellos
+    tabla = pq.read_table(ruta).sort_by([(col, "ascending") for col in columnas])
+    pq.write_table(tabla, ruta_salida or ruta, row_group_size=filas_por_grupo)
+
+
+if __name__ == "__main__":
+    # python datos.py: ordena los archivos de datos por origen y destino
+    for nombre in TABLAS:
+        for ruta in rutas_tabla(nombre):
+            ordena_parquet(ruta, ["origen", "destino"])
@@ -0,0 +1,64 @@
+#%%
+# Exportación de los viajes OD filtrados como CSV o Parquet.
+# El resultado sale por partes: CuboOD.pares suma los viajes por grupos de
+# ZAT de origen, cada grupo se convierte en un RecordBatch de Arrow y el
+# escritor de pyarrow lo pasa a bytes, que se envían de inmediato. Ni la
+# matriz completa ni el archivo quedan en la memoria del worker.
+import io
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+formatos = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+def esquema(columnas, zats):
+    # ``columnas`` = {nombre: catálogo} de las columnas de la celda de salida
+    campos = [(nombre, pa.array(catalogo).type) for nombre, catalogo in columnas.items()]
+    tipo_zat = pa.array(zats).type
+    return pa.schema(campos + [("origen", tipo_zat), ("destino", tipo_zat),
+                               ("viajes", pa.float64())])
+
+
+def lotes_arrow(pares, columnas, zats, esquema_salida):
+    # RecordBatch de cada grupo de CuboOD.pares. Las celdas de salida se
+    # numeran como np.ravel_multi_index sobre los catálogos de ``columnas``
+    catalogos = [np.asarray(catalogo) for catalogo in columnas.values()]
+    forma = tuple(len(catalogo) for catalogo in catalogos)
+    for celda, cod_o, cod_d, viajes in pares:
+        indices = np.unravel_index(celda, forma)
+        arreglos = [catalogo[i] for catalogo, i in zip(catalogos, indices)]
+        arreglos += [zats[cod_o], zats[cod_d], viajes]
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(a, type=campo.type) for a, campo in zip(arreglos, esquema_salida)],
+            schema=esquema_salida)
+
+
+def escribe(lotes, esquema_salida, formato):
+    # Bytes del archivo a medida que se escribe cada lote (cada lote es un
+    # row group en Parquet)
+    salida = io.BytesIO()
+    if formato == "parquet":
+        escritor = pq.ParquetWriter(salida, esquema_salida)
+    else:
+        escritor = pacsv.CSVWriter(salida, esquema_salida)
+
+    def vacia():
+        datos = salida.getvalue()
+        salida.seek(0)
+        salida.truncate()
+        return datos
+
+    try:
+        for lote in lotes:
+            escritor.write_batch(lote)
+            datos = vacia()
+            if datos:
+                yield datos
+    finally:
+        escritor.close()
+    datos = vacia()
+    if datos:
+        yield datos
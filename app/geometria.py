@@ -0,0 +1,215 @@
+#%%
+# Preparación de las geometrías de los mapas (ZAT, localidades, vías).
+# Las formas se simplifican sin romper los bordes compartidos entre polígonos
+# vecinos: cada tramo entre dos uniones se simplifica una sola vez y el mismo
+# resultado se usa en los dos polígonos que lo comparten. Las coordenadas se
+# redondean y se escribe un archivo compacto por nivel de detalle, que el
+# navegador descarga una sola vez en lugar de recibirlo dentro de cada figura.
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+
+# Tolerancia de simplificación (grados), decimales de las coordenadas y rango
+# de zoom del mapa en que se usa cada nivel de detalle
+niveles = {
+    "bajo": {"tolerancia": 0.001, "decimales": 4, "zoom": (0, 10)},
+    "medio": {"tolerancia": 0.0002, "decimales": 5, "zoom": (10, 13)},
+    "alto": {"tolerancia": 0.00005, "decimales": 5, "zoom": (13, 24)},
+}
+
+# Subir si cambia el algoritmo, para regenerar los archivos
+version_geometria = 1
+
+
+def douglas_peucker(puntos, tolerancia):
+    # Máscara de los puntos que se conservan; los extremos siempre quedan
+    n = len(puntos)
+    conservar = np.zeros(n, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1:
+            continue
+        a, b = puntos[i], puntos[j]
+        medio = puntos[i + 1:j]
+        ab = b - a
+        largo = np.hypot(ab[0], ab[1])
+        if largo == 0:
+            dist = np.hypot(medio[:, 0] - a[0], medio[:, 1] - a[1])
+        else:
+            dist = np.abs(ab[0] * (medio[:, 1] - a[1]) - ab[1] * (medio[:, 0] - a[0])) / largo
+        k = int(np.argmax(dist))
+        if dist[k] > tolerancia:
+            k += i + 1
+            conservar[k] = True
+            pila.append((i, k))
+            pila.append((k, j))
+    return conservar
+
+
+def _lineas(coordenadas, tipo):
+    # Anillos y líneas de una geometría, en el orden en que aparecen
+    if tipo == "LineString":
+        return [(coordenadas, False)]
+    if tipo == "MultiLineString":
+        return [(linea, False) for linea in coordenadas]
+    if tipo == "Polygon":
+        return [(anillo, True) for anillo in coordenadas]
+    if tipo == "MultiPolygon":
+        return [(anillo, True) for poligono in coordenadas for anillo in poligono]
+    return []
+
+
+def _reconstruye(coordenadas, tipo, nuevas):
+    # Misma estructura de la geometría con las líneas simplificadas
+    if tipo in ("LineString",):
+        return next(nuevas)
+    if tipo in ("MultiLineString", "Polygon"):
+        return [next(nuevas) for _ in coordenadas]
+    if tipo == "MultiPolygon":
+        return [[next(nuevas) for _ in poligono] for poligono in coordenadas]
+    return coordenadas
+
+
+def _cuantiza(linea, decimales):
+    # Redondea y quita puntos repetidos consecutivos
+    puntos = []
+    for x, y in (p[:2] for p in linea):
+        p = (round(x, decimales), round(y, decimales))
+        if not puntos or puntos[-1] != p:
+            puntos.append(p)
+    return puntos
+
+
+def simplifica(geojson, tolerancia, decimales, propiedades=()):
+    geometrias = [f["geometry"] for f in geojson["features"]]
+    lineas = [(_cuantiza(linea, decimales), cerrada)
+              for g in geometrias if g is not None
+              for linea, cerrada in _lineas(g["coordinates"], g["type"])]
+
+    # Uniones: puntos donde se separan bordes que antes coincidían (sus
+    # vecinos cambian de una línea a otra) y extremos de las líneas abiertas
+    vecinos = defaultdict(set)
+    uniones = set()
+    for puntos, cerrada in lineas:
+        if cerrada:
+            anillo = puntos[:-1] if puntos[0] == puntos[-1] else puntos
+            for i, p in enumerate(anillo):
+                vecinos[p].add(frozenset((anillo[i - 1], anillo[(i + 1) % len(anillo)])))
+        else:
+            uniones.update([puntos[0], puntos[-1]])
+            for i in range(1, len(puntos) - 1):
+                vecinos[puntos[i]].add(frozenset((puntos[i - 1], puntos[i + 1])))
+    uniones.update(p for p, v in vecinos.items() if len(v) > 1)
+
+    tramos_simplificados = dict()
+
+    def simplifica_tramo(tramo):
+        # Un tramo compartido se recorre en sentidos opuestos en cada
+        # polígono; se simplifica en un sentido canónico y se reutiliza
+        directo, inverso = tuple(tramo), tuple(reversed(tramo))
+        clave = min(directo, inverso)
+        if clave not in tramos_simplificados:
+            arreglo = np.array(clave)
+            tramos_simplificados[clave] = [clave[i] for i in
+                                           np.flatnonzero(douglas_peucker(arreglo, tolerancia))]
+        resultado = tramos_simplificados[clave]
+        return resultado if clave == directo else resultado[::-1]
+
+    def simplifica_linea(puntos, cerrada):
+        if len(puntos) < 3:
+            return puntos
+        if cerrada:
+            anillo = puntos[:-1] if puntos[0] == puntos[-1] else puntos
+            cortes = [i for i, p in enumerate(anillo) if p in uniones]
+            # Sin uniones se empieza en el punto menor para que dos anillos
+            # iguales (isla y hueco) den el mismo resultado
+            inicio = cortes[0] if cortes else anillo.index(min(anillo))
+            anillo = anillo[inicio:] + anillo[:inicio]
+            anillo.append(anillo[0])
+            cortes = [i for i, p in enumerate(anillo) if p in uniones]
+            cortes = sorted(set([0, len(anillo) - 1] + cortes))
+        else:
+            anillo = puntos
+            cortes = sorted(set([0, len(anillo) - 1] +
+                                [i for i, p in enumerate(anillo) if p in uniones]))
+        nueva = [anillo[0]]
+        for a, b in zip(cortes[:-1], cortes[1:]):
+            nueva.extend(simplifica_tramo(anillo[a:b + 1])[1:])
+        if cerrada and len(nueva) < 4:
+            # El anillo colapsó: se deja sin simplificar
+            return anillo
+        return nueva
+
+    nuevas = iter([[list(p) for p in simplifica_linea(puntos, cerrada)]
+                   for puntos, cerrada in lineas])
+    features = []
+    for f, g in zip(geojson["features"], geometrias):
+        if g is not None:
+            g = {"type": g["type"],
+                 "coordinates": _reconstruye(g["coordinates"], g["type"], nuevas)}
+        props = {k: v for k, v in (f.get("properties") or {}).items() if k in propiedades}
+        features.append({"type": "Feature", "properties": props, "geometry": g})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def archivo_geometria(ruta, nivel, carpeta, propiedades=()):
+    # Nombre del archivo simplificado del nivel pedido dentro de ``carpeta``;
+    # se genera la primera vez. El nombre lleva un hash del contenido de
+    # origen y de los parámetros, así que puede guardarse en cache del
+    # navegador sin vencimiento.
+    parametros = niveles[nivel]
+    with open(ruta, "rb") as archivo:
+        huella = hashlib.sha1(archivo.read())
+    huella.update(json.dumps([version_geometria, parametros, sorted(propiedades)]).encode("utf-8"))
+    base = os.path.splitext(os.path.basename(ruta))[0]
+    nombre = "{}.{}.{}.json".format(base, nivel, huella.hexdigest()[:12])
+    destino = os.path.join(carpeta, nombre)
+    if not os.path.exists(destino):
+        with open(ruta, encoding="utf-8") as archivo:
+            geojson = json.load(archivo)
+        simple = simplifica(geojson, parametros["tolerancia"], parametros["decimales"],
+                            propiedades)
+        os.makedirs(carpeta, exist_ok=True)
+        temporal = "{}.{}.tmp".format(destino, os.getpid())
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(simple, archivo, separators=(",", ":"), ensure_ascii=False)
+        os.replace(temporal, destino)
+    return nombre
+
+
+def _centroide_anillo(anillo):
+    # Área con signo y centroide de un anillo (fórmula del polígono)
+    x, y = np.asarray(anillo, dtype=float)[:, 0], np.asarray(anillo, dtype=float)[:, 1]
+    x1, y1 = np.roll(x, -1), np.roll(y, -1)
+    cruz = x * y1 - x1 * y
+    area = cruz.sum() / 2
+    if area == 0:
+        return 0.0, x.mean(), y.mean()
+    return area, ((x + x1) * cruz).sum() / (6 * area), ((y + y1) * cruz).sum() / (6 * area)
+
+
+def centroides(ruta, propiedad="ID"):
+    # {valor de la propiedad: (lon, lat)} con el centroide de cada polígono;
+    # en los multipolígonos se usa el de mayor área
+    with open(ruta, encoding="utf-8") as archivo:
+        geojson = json.load(archivo)
+    resultado = dict()
+    for f in geojson["features"]:
+        g = f.get("geometry")
+        clave = (f.get("properties") or {}).get(propiedad)
+        if g is None or clave is None:
+            continue
+        if g["type"] == "Polygon":
+            exteriores = [g["coordinates"][0]]
+        elif g["type"] == "MultiPolygon":
+            exteriores = [poligono[0] for poligono in g["coordinates"]]
+        else:
+            continue
+        area, lon, lat = max((_centroide_anillo(a) for a in exteriores), key=lambda c: abs(c[0]))
+        resultado[clave] = (lon, lat)
+    return resultado
@@ -0,0 +1,10 @@
+#%%
+# Configuración de gunicorn (la lee solo al correr desde app/):
+#   gunicorn -w 4 app_wbg:server
+
+
+def post_worker_init(worker):
+    # Precálculo de la vista por defecto y las más pedidas en cada worker, ya
+    # con la app cargada
+    import app_wbg
+    app_wbg.inicia_precalculo()
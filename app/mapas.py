@@ -0,0 +1,268 @@
+#%%
+# Construcción de los mapas de viajes por ZAT.
+# Cada mapa es una sola traza Choroplethmapbox: z es la clase (rango) de cada
+# ZAT y una escala de colores por tramos asigna un color fijo a cada clase,
+# de modo que la geometría de las ZAT viaja una sola vez por figura en lugar
+# de una vez por rango.
+# Clasificacion reúne los límites de los rangos, sus etiquetas y colores, y
+# asigna la clase de todas las ZAT de una vez con np.searchsorted.
+#
+# Las figuras se arman como diccionarios (el JSON de plotly) sin pasar por
+# go.Figure: el layout del mapa (estilo, zoom, centro, capas y plantilla de
+# colores) se valida con Plotly una sola vez por conjunto de capas y cada
+# figura copia ese layout y le pone su título y sus trazas.
+import json
+from functools import lru_cache
+
+import numpy as np
+import plotly.colors
+import plotly.express as px
+import plotly.graph_objects as go
+
+centro_mapa = {"lat": 4.657946861376187, "lon": -74.09476461866534}
+zoom_mapa = 8
+
+
+def escala_discreta(colores):
+    # Cada clase ocupa un tramo de igual ancho en [0, 1] con un solo color
+    n = len(colores)
+    escala = []
+    for i, color in enumerate(colores):
+        escala.append((i / n, color))
+        escala.append(((i + 1) / n, color))
+    return escala
+
+
+def colores_clases(n):
+    # Los primeros n colores de Plasma_r; si no alcanzan se interpolan
+    colores = px.colors.sequential.Plasma_r
+    if n <= len(colores):
+        return colores[:n]
+    return plotly.colors.sample_colorscale(colores, n)
+
+
+# Etiqueta de la única clase cuando no hay límites (p.ej. una sola ZAT o
+# todos los valores iguales)
+etiqueta_unica = "Todos los valores"
+
+
+def etiquetas_rangos(limites):
+    # "<a", "[a;b)", ..., ">=z" para los límites dados; sin límites hay una
+    # sola clase
+    if not len(limites):
+        return [etiqueta_unica]
+    etiquetas = ["<{}".format(limites[0])]
+    for anterior, limite in zip(limites[:-1], limites[1:]):
+        etiquetas.append("[{};{})".format(anterior, limite))
+    etiquetas.append(">={}".format(limites[-1]))
+    return etiquetas
+
+
+def limites_usuario(metodo, texto, defecto, tipo=float):
+    # Límites escritos por el usuario ("100, 500, 1000"); vacío usa
+    # ``defecto``. Solo el método "usuario" los usa: con los demás no se leen.
+    # ValueError si alguno no es número o no van de menor a mayor (p.ej. a
+    # medio escribir)
+    if metodo != "usuario":
+        return None
+    if texto is None or not texto.strip():
+        texto = defecto
+    limites = [tipo(x.strip()) for x in texto.split(",")]
+    if any(b <= a for a, b in zip(limites[:-1], limites[1:])):
+        raise ValueError("Límites fuera de orden: " + texto)
+    return limites
+
+
+def _finitos(valores):
+    valores = np.asarray(valores, dtype=float)
+    return valores[np.isfinite(valores)]
+
+
+def _redondea(limites, decimales):
+    # Límites calculados, redondeados para la leyenda y sin repetidos
+    limites = np.unique(np.round(np.asarray(limites, dtype=float), decimales))
+    if decimales <= 0:
+        return [int(l) for l in limites]
+    return [float(l) for l in limites]
+
+
+def cortes_cuantiles(valores, n_clases):
+    # Límites que dejan aproximadamente el mismo número de ZAT en cada clase
+    valores = _finitos(valores)
+    if len(valores) == 0 or n_clases < 2:
+        return []
+    cortes = np.quantile(valores, np.linspace(0, 1, n_clases + 1)[1:-1])
+    # Un corte en el mínimo dejaría una primera clase vacía
+    return cortes[cortes > valores.min()]
+
+
+def cortes_jenks(valores, n_clases, max_puntos=1000):
+    # Cortes naturales de Jenks (algoritmo exacto de Fisher): minimiza la
+    # suma de las varianzas dentro de las clases con programación dinámica.
+    # Cada paso evalúa todas las parejas (inicio, fin) de una vez como matriz;
+    # con más de ``max_puntos`` valores se trabaja sobre sus cuantiles.
+    x = np.sort(_finitos(valores))
+    if len(x) > max_puntos:
+        x = np.quantile(x, np.linspace(0, 1, max_puntos))
+    n = len(x)
+    if n_clases < 2:
+        return np.array([])
+    if len(np.unique(x)) <= n_clases:
+        # Un corte en cada valor distinto; con uno solo no hay cortes
+        return np.unique(x)[1:]
+
+    s1 = np.concatenate([[0.0], np.cumsum(x)])
+    s2 = np.concatenate([[0.0], np.cumsum(x * x)])
+    inicio = np.arange(n)[:, None]
+    fin = np.arange(n)[None, :]
+    cuenta = fin - inicio + 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Suma de cuadrados de las desviaciones de x[inicio..fin]
+        ssd = (s2[fin + 1] - s2[inicio]) - (s1[fin + 1] - s1[inicio]) ** 2 / cuenta
+    ssd[cuenta <= 0] = np.inf
+
+    costo = ssd[0]
+    inicios = []
+    for _ in range(1, n_clases):
+        # La nueva clase empieza en i >= 1 y termina en j
+        total = costo[:-1, None] + ssd[1:, :]
+        mejor = np.argmin(total, axis=0)
+        costo = total[mejor, np.arange(n)]
+        inicios.append(mejor + 1)
+
+    cortes = []
+    j = n - 1
+    for mejor in reversed(inicios):
+        i = mejor[j]
+        cortes.append(x[i])
+        j = i - 1
+    return np.array(sorted(cortes))
+
+
+class Clasificacion:
+    """Rangos de un mapa: límites, etiquetas, colores y escala de colores.
+
+    ``clases`` asigna el rango de un arreglo completo de valores con
+    np.searchsorted; un valor igual a un límite queda en el rango superior.
+    Con ``etiqueta_nulo`` los NaN van a una clase gris adicional al final.
+    """
+
+    color_nulo = "#bdbdbd"
+
+    def __init__(self, limites, etiqueta_nulo=None):
+        self.limites = list(limites)
+        self.etiquetas = etiquetas_rangos(self.limites)
+        self.colores = colores_clases(len(self.etiquetas))
+        self.etiqueta_nulo = etiqueta_nulo
+        if etiqueta_nulo is not None:
+            self.etiquetas.append(etiqueta_nulo)
+            self.colores = list(self.colores) + [self.color_nulo]
+        self.escala = escala_discreta(self.colores)
+        self._limites = np.asarray(self.limites, dtype=float)
+
+    @classmethod
+    def cuantiles(cls, valores, n_clases, decimales=0, etiqueta_nulo=None):
+        return cls(_redondea(cortes_cuantiles(valores, n_clases), decimales), etiqueta_nulo)
+
+    @classmethod
+    def jenks(cls, valores, n_clases, decimales=0, etiqueta_nulo=None):
+        return cls(_redondea(cortes_jenks(valores, n_clases), decimales), etiqueta_nulo)
+
+    @classmethod
+    def crea(cls, metodo, valores, limites=None, n_clases=5, decimales=0, etiqueta_nulo=None):
+        # metodo: "usuario" (límites dados), "cuantiles" o "jenks"
+        if metodo == "cuantiles":
+            return cls.cuantiles(valores, n_clases, decimales, etiqueta_nulo)
+        if metodo == "jenks":
+            return cls.jenks(valores, n_clases, decimales, etiqueta_nulo)
+        return cls(limites, etiqueta_nulo)
+
+    def clases(self, valores):
+        valores = np.asarray(valores, dtype=float)
+        clases = np.searchsorted(self._limites, valores, side="right")
+        if self.etiqueta_nulo is not None:
+            clases[np.isnan(valores)] = len(self.etiquetas) - 1
+        return clases
+
+
+@lru_cache(maxsize=None)
+def _layout_validado(capas_json, leyenda):
+    # Layout común de los mapas, validado por Plotly y convertido a
+    # diccionario una sola vez por conjunto de capas
+    fig = go.Figure()
+    fig.update_layout(
+        margin=dict(l=4, r=4, t=5, b=3),
+        mapbox=dict(
+            style='carto-positron',
+            zoom=zoom_mapa,
+            center=centro_mapa,
+            layers=json.loads(capas_json),
+        ),
+    )
+    if leyenda is not None:
+        fig.update_layout(legend=dict(title=leyenda))
+    return fig.to_plotly_json()["layout"]
+
+
+def layout_mapa(titulo, capas, leyenda=None):
+    # Copia del layout común con el título de la figura. Los valores
+    # anidados se comparten con la plantilla: no se deben modificar
+    layout = dict(_layout_validado(json.dumps(capas, sort_keys=True), leyenda))
+    layout["title"] = {"text": titulo}
+    return layout
+
+
+def figura_mapa(zats, valores, clasificacion, geojson, titulo, capas, formato=",.0f"):
+    # Cada ZAT toma el color de su rango en ``clasificacion``; la barra de
+    # colores muestra las etiquetas como leyenda discreta
+    etiquetas = clasificacion.etiquetas
+    n = len(etiquetas)
+    clases = clasificacion.clases(valores)
+    datos = []
+
+    if len(clases) > 0:
+        datos.append({"type": "choroplethmapbox",
+                      "geojson": geojson,
+                      "locations": np.asarray(zats),
+                      "z": clases,
+                      "zmin": -0.5, "zmax": n - 0.5,
+                      "featureidkey": "properties.ID",
+                      "colorscale": [list(tramo) for tramo in clasificacion.escala],
+                      "customdata": np.asarray(valores),
+                      "text": np.asarray(etiquetas, dtype=object)[clases],
+                      "hovertemplate": "ZAT %{location}<br>%{customdata:" + formato +
+                                       "}<extra>%{text}</extra>",
+                      "colorbar": {"tickvals": list(range(n)), "ticktext": list(etiquetas)},
+                      })
+
+    return {"data": datos, "layout": layout_mapa(titulo, capas)}
+
+
+def figura_flujos(lon_o, lat_o, lon_d, lat_d, viajes, etiquetas_od, titulo, capas,
+                  n_clases=5):
+    # Líneas de deseo de los flujos principales. Los flujos se agrupan en
+    # clases (cortes naturales); cada clase es una traza con su color y
+    # ancho, y sus líneas se separan con None dentro de la misma traza
+    datos = []
+    viajes = np.asarray(viajes, dtype=float)
+    if len(viajes) > 0:
+        clasificacion = Clasificacion.jenks(viajes, n_clases)
+        clases = clasificacion.clases(viajes)
+        n = len(clasificacion.etiquetas)
+        for k in range(n):
+            sel = np.flatnonzero(clases == k)
+            if len(sel) == 0:
+                continue
+            lon, lat, texto = [], [], []
+            for i in sel:
+                hover = "{}<br>{:,.0f} viajes".format(etiquetas_od[i], viajes[i])
+                lon += [lon_o[i], lon_d[i], None]
+                lat += [lat_o[i], lat_d[i], None]
+                texto += [hover, hover, None]
+            datos.append({"type": "scattermapbox", "lon": lon, "lat": lat, "mode": "lines",
+                          "line": {"width": 1.5 + 6 * k / max(n - 1, 1),
+                                   "color": clasificacion.colores[k]},
+                          "name": clasificacion.etiquetas[k],
+                          "text": texto, "hoverinfo": "text"})
+
+    return {"data": datos, "layout": layout_mapa(titulo, capas, leyenda="Viajes")}
@@ -0,0 +1,92 @@
+#%%
+# Matriz origen-destino dispersa (CSR) construida con NumPy.
+# La mayoría de las parejas ZAT-ZAT no tienen viajes, así que en lugar de la
+# tabla larga o de una matriz densa se guardan solo las celdas con valor:
+# indptr marca dónde empieza cada origen, indices son los destinos y datos
+# los viajes. Las sumas por fila o columna cuestan O(nnz) y la consulta de
+# los flujos principales no recorre la tabla completa. CuboOD.matriz la arma
+# con solo las filas de las celdas pedidas (año, tipo de día, horas).
+import numpy as np
+
+
+def _compacta(claves, valores):
+    # Suma los valores de claves repetidas; devuelve claves únicas ordenadas
+    claves, inversa = np.unique(claves, return_inverse=True)
+    return claves, np.bincount(inversa, weights=valores, minlength=len(claves))
+
+
+class MatrizOD:
+    """Matriz OD n x n en formato CSR (filas = origen, columnas = destino)."""
+
+    def __init__(self, indptr, indices, datos, n):
+        self.indptr = indptr
+        self.indices = indices
+        self.datos = datos
+        self.n = n
+
+    @classmethod
+    def desde_codigos(cls, cod_o, cod_d, viajes, n):
+        # Los pares repetidos se suman
+        claves, datos = _compacta(np.asarray(cod_o, dtype=np.int64) * n
+                                  + np.asarray(cod_d, dtype=np.int64), viajes)
+        return cls.desde_claves(claves, datos, n)
+
+    @classmethod
+    def desde_claves(cls, claves, datos, n):
+        # ``claves`` = origen * n + destino, únicas y ordenadas
+        filas = claves // n
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(filas, minlength=n), out=indptr[1:])
+        return cls(indptr, (claves % n).astype(np.int32), np.asarray(datos, dtype=np.float64), n)
+
+    @property
+    def nnz(self):
+        return len(self.datos)
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.datos.nbytes
+
+    def filas(self):
+        # Origen de cada celda guardada
+        return np.repeat(np.arange(self.n, dtype=np.int32), np.diff(self.indptr))
+
+    def sumas_filas(self):
+        return np.bincount(self.filas(), weights=self.datos, minlength=self.n)
+
+    def sumas_columnas(self):
+        return np.bincount(self.indices, weights=self.datos, minlength=self.n)
+
+    def transpuesta(self):
+        # La misma matriz ordenada por destino (CSC de la original)
+        return MatrizOD.desde_codigos(self.indices, self.filas(), self.datos, self.n)
+
+    def submatriz(self, origenes=None, destinos=None):
+        # Conserva solo las filas y columnas (códigos de ZAT) pedidas; la
+        # matriz resultante sigue siendo n x n
+        conservar = np.ones(self.nnz, dtype=bool)
+        if origenes is not None:
+            filas = np.zeros(self.n, dtype=bool)
+            filas[np.asarray(origenes, dtype=np.int64)] = True
+            conservar &= np.repeat(filas, np.diff(self.indptr))
+        if destinos is not None:
+            columnas = np.zeros(self.n, dtype=bool)
+            columnas[np.asarray(destinos, dtype=np.int64)] = True
+            conservar &= columnas[self.indices]
+        claves = self.filas()[conservar].astype(np.int64) * self.n + self.indices[conservar]
+        return MatrizOD.desde_claves(claves, self.datos[conservar], self.n)
+
+    def principales(self, n_top, intrazonales=False):
+        # Los n_top pares con más viajes, de mayor a menor: (origen, destino, viajes)
+        filas, columnas, datos = self.filas(), self.indices, self.datos
+        if not intrazonales:
+            externos = filas != columnas
+            filas, columnas, datos = filas[externos], columnas[externos], datos[externos]
+        if n_top <= 0:
+            sel = np.zeros(0, dtype=np.int64)
+        elif n_top < len(datos):
+            sel = np.argpartition(-datos, n_top - 1)[:n_top]
+        else:
+            sel = np.arange(len(datos))
+        sel = sel[np.argsort(-datos[sel], kind="stable")]
+        return filas[sel], columnas[sel], datos[sel]
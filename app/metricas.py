@@ -0,0 +1,233 @@
+#%%
+# Instrumentación de los callbacks del tablero.
+# Cada invocación registra tiempo de reloj, tiempo de CPU del hilo, aumento
+# de memoria y tamaño de la respuesta enviada al navegador, además del tiempo
+# de cada fase marcada dentro del callback (filtro, agregación, figura...).
+# La serialización de la respuesta, que hace Dash después del callback, se
+# mide desde el fin del callback hasta que Flask entrega la respuesta.
+# Todo se acumula en histogramas por proceso que se exponen en formato de
+# texto de Prometheus; las últimas invocaciones quedan para el panel de
+# depuración. Los trabajos de fondo de Dash corren en procesos hijos que
+# terminan al entregar el resultado: sus registros llegan al worker que los
+# lanzó por una cola en disco (una por worker) y se suman al leer las
+# métricas.
+import bisect
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+import diskcache
+import psutil
+
+limites_segundos = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+limites_bytes = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7, 1e8)
+
+
+class Histograma:
+    """Histograma acumulable con límites fijos (como los de Prometheus)."""
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.cuentas = [0] * (len(limites) + 1)
+        self.suma = 0.0
+        self.n = 0
+
+    def observa(self, valor):
+        self.cuentas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.n += 1
+
+    def acumuladas(self):
+        # Cuentas acumuladas por límite, terminando en +Inf
+        total, resultado = 0, []
+        for cuenta in self.cuentas:
+            total += cuenta
+            resultado.append(total)
+        return resultado
+
+
+# Métricas: nombre -> (descripción, límites)
+_metricas = {
+    "callback_segundos": ("Tiempo de reloj del callback", limites_segundos),
+    "callback_cpu_segundos": ("Tiempo de CPU del hilo en el callback", limites_segundos),
+    "callback_memoria_bytes": ("Aumento de memoria durante el callback", limites_bytes),
+    "callback_respuesta_bytes": ("Tamaño de la respuesta enviada al navegador", limites_bytes),
+    "callback_fase_segundos": ("Tiempo de reloj de cada fase del callback", limites_segundos),
+}
+
+
+def _memoria():
+    # Con tracemalloc, el pico de memoria reservada por Python y NumPy desde
+    # el último reset_peak; si no, la memoria residente actual del proceso
+    if tracemalloc.is_tracing():
+        return tracemalloc.get_traced_memory()[1]
+    return psutil.Process().memory_info().rss
+
+
+class Metricas:
+    """Registro de las invocaciones de los callbacks de un proceso."""
+
+    def __init__(self, n_recientes=200, rastrear_memoria=False, carpeta_fondo=None):
+        self._lock = threading.Lock()
+        self._histogramas = dict()
+        self._local = threading.local()
+        self.recientes = deque(maxlen=n_recientes)
+        # Colas de los trabajos de fondo, una subcarpeta por pid del worker
+        self.carpeta_fondo = carpeta_fondo
+        self._cola = None
+        if rastrear_memoria and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _observa(self, metrica, valor, **etiquetas):
+        clave = (metrica, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            if clave not in self._histogramas:
+                self._histogramas[clave] = Histograma(_metricas[metrica][1])
+            self._histogramas[clave].observa(valor)
+
+    def instrumenta(self, funcion):
+        # Decorador de los callbacks; se pone debajo de @app.callback
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            registro = {"callback": funcion.__name__, "fases": dict()}
+            self._local.actual = registro
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+                memoria = tracemalloc.get_traced_memory()[0]
+            else:
+                memoria = _memoria()
+            inicio, inicio_cpu = time.perf_counter(), time.thread_time()
+            try:
+                resultado = funcion(*args, **kwargs)
+            finally:
+                self._local.actual = None
+            registro["segundos"] = time.perf_counter() - inicio
+            registro["cpu_segundos"] = time.thread_time() - inicio_cpu
+            registro["memoria_bytes"] = max(_memoria() - memoria, 0)
+            if getattr(self._local, "fondo", False) and self.carpeta_fondo:
+                # La respuesta la arma el worker al consultar el trabajo; su
+                # tamaño no se atribuye
+                registro["respuesta_bytes"] = None
+                registro["hora"] = time.strftime("%H:%M:%S")
+                self._cola_de(os.getppid()).append(registro)
+                return resultado
+            registro["fin"] = time.perf_counter()
+            # Se completa con el tamaño de la respuesta en registra_respuesta
+            self._local.pendiente = registro
+            self._acumula(registro)
+            return resultado
+        return envoltura
+
+    def trabajo_fondo(self, funcion):
+        # Decorador de la función que Dash corre como trabajo de fondo, por
+        # fuera de instrumenta: sus registros se mandan al worker
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            self._local.fondo = True
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                self._local.fondo = False
+        return envoltura
+
+    def _cola_de(self, pid):
+        return diskcache.Deque(directory=os.path.join(self.carpeta_fondo, str(pid)))
+
+    def _acumula(self, registro):
+        nombre = registro["callback"]
+        self._observa("callback_segundos", registro["segundos"], callback=nombre)
+        self._observa("callback_cpu_segundos", registro["cpu_segundos"], callback=nombre)
+        self._observa("callback_memoria_bytes", registro["memoria_bytes"], callback=nombre)
+        for fase, segundos in registro["fases"].items():
+            self._observa("callback_fase_segundos", segundos, callback=nombre, fase=fase)
+
+    def recibe_fondo(self):
+        # Suma los registros que dejaron los trabajos de fondo de este worker
+        if not self.carpeta_fondo:
+            return
+        pid = os.getpid()
+        with self._lock:
+            if self._cola is None or self._cola[0] != pid:
+                self._cola = (pid, self._cola_de(pid))
+            cola = self._cola[1]
+        while True:
+            try:
+                registro = cola.popleft()
+            except IndexError:
+                break
+            self._acumula(registro)
+            with self._lock:
+                self.recientes.append(registro)
+
+    @contextmanager
+    def fase(self, nombre):
+        # Mide una parte del callback en curso; fuera de un callback no hace nada
+        registro = getattr(self._local, "actual", None)
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            if registro is not None:
+                registro["fases"][nombre] = registro["fases"].get(nombre, 0) + \
+                    time.perf_counter() - inicio
+
+    def registra_respuesta(self, respuesta):
+        # Para Flask after_request: tamaño de la respuesta y tiempo de
+        # serialización del último callback atendido por este hilo
+        registro = getattr(self._local, "pendiente", None)
+        if registro is None:
+            return respuesta
+        self._local.pendiente = None
+        nombre = registro["callback"]
+        serializacion = time.perf_counter() - registro.pop("fin")
+        registro["fases"]["serializacion"] = serializacion
+        registro["respuesta_bytes"] = respuesta.calculate_content_length() or 0
+        registro["hora"] = time.strftime("%H:%M:%S")
+        self._observa("callback_fase_segundos", serializacion, callback=nombre,
+                      fase="serializacion")
+        self._observa("callback_respuesta_bytes", registro["respuesta_bytes"], callback=nombre)
+        with self._lock:
+            self.recientes.append(registro)
+        return respuesta
+
+    def prometheus(self):
+        # Histogramas en formato de texto de Prometheus; la etiqueta worker
+        # distingue los procesos de gunicorn
+        self.recibe_fondo()
+        worker = str(os.getpid())
+        with self._lock:
+            histogramas = sorted(self._histogramas.items())
+            lineas = []
+            for metrica, (descripcion, _) in _metricas.items():
+                lineas += ["# HELP tablero_{} {}".format(metrica, descripcion),
+                           "# TYPE tablero_{} histogram".format(metrica)]
+                for (nombre, etiquetas), h in histogramas:
+                    if nombre != metrica:
+                        continue
+                    texto = ",".join('{}="{}"'.format(k, v)
+                                     for k, v in etiquetas + (("worker", worker),))
+                    for limite, cuenta in zip(list(h.limites) + ["+Inf"], h.acumuladas()):
+                        lineas.append('tablero_{}_bucket{{{},le="{}"}} {}'.format(
+                            metrica, texto, limite, cuenta))
+                    lineas.append("tablero_{}_sum{{{}}} {}".format(metrica, texto, h.suma))
+                    lineas.append("tablero_{}_count{{{}}} {}".format(metrica, texto, h.n))
+        return "\n".join(lineas) + "\n"
+
+    def tabla_recientes(self):
+        # Últimas invocaciones, de la más reciente a la más antigua
+        self.recibe_fondo()
+        with self._lock:
+            recientes = list(self.recientes)[::-1]
+        return [{"Hora": r["hora"], "Callback": r["callback"],
+                 "Reloj (ms)": round(r["segundos"] * 1000, 1),
+                 "CPU (ms)": round(r["cpu_segundos"] * 1000, 1),
+                 "Memoria (kB)": round(r["memoria_bytes"] / 1024),
+                 "Respuesta (kB)": "" if r["respuesta_bytes"] is None
+                                   else round(r["respuesta_bytes"] / 1024, 1),
+                 "Fases (ms)": ", ".join("{} {:.1f}".format(f, s * 1000)
+                                         for f, s in r["fases"].items())}
+                for r in recientes]
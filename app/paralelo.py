@@ -0,0 +1,90 @@
+#%%
+# Construcción de figuras en paralelo.
+# Las figuras de un clic (mapas de origen, destino y flujos; gráficos por
+# tipo de día) son independientes y casi todo su costo es validación y
+# serialización de Plotly en Python, que no se reparte entre hilos por el
+# GIL. Se reparten entre procesos y los resultados vuelven en el orden de
+# las tareas, sin importar cuál termina primero.
+#
+# Los procesos salen de un servidor de forkserver (spawn donde no existe) y
+# no de un fork del worker, que tiene hilos (precálculo, peticiones, el del
+# propio pool) cuyos locks podrían quedar tomados en la copia. Cada proceso
+# importa una vez los módulos de las funciones que recibe, que viajan por
+# nombre; esas funciones no deben depender de estado armado en el worker
+# (cubos, caches), solo de sus argumentos. Si el proceso que creó el pool
+# muere (p.ej. un trabajo de fondo de Dash que terminó), salen solos.
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _vigila_padre(pid_padre):
+    # Inicializador de cada proceso del pool. Su padre es el servidor de
+    # forkserver, no el proceso que creó el pool: se pregunta por este
+    def vigila():
+        while _vivo(pid_padre):
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=vigila, daemon=True).start()
+
+
+def _contexto():
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in metodos else "spawn")
+
+
+class PoolFiguras:
+    """Pool de procesos perezoso para tareas independientes.
+
+    ``n_procesos`` = 0 usa uno por núcleo; con 1 las tareas corren en serie
+    en el mismo proceso.
+    """
+
+    def __init__(self, n_procesos=0):
+        self.n_procesos = n_procesos or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    @property
+    def paralelo(self):
+        return self.n_procesos > 1
+
+    def _ejecutor(self):
+        # Un pool por proceso: el heredado por fork (p.ej. en un trabajo de
+        # fondo) no sirve en el hijo
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ProcessPoolExecutor(
+                    self.n_procesos, mp_context=_contexto(),
+                    initializer=_vigila_padre, initargs=(self._pid,))
+            return self._pool
+
+    def mapa(self, tareas):
+        # ``tareas`` = [(funcion, argumentos), ...]; devuelve los resultados
+        # en el mismo orden
+        tareas = list(tareas)
+        if not self.paralelo or len(tareas) <= 1:
+            return [funcion(*args) for funcion, args in tareas]
+        try:
+            futuros = [self._ejecutor().submit(funcion, *args) for funcion, args in tareas]
+            return [futuro.result() for futuro in futuros]
+        except BrokenProcessPool:
+            # Un proceso del pool murió: se descarta el pool y se corre en serie
+            with self._lock:
+                self._pool = None
+            return [funcion(*args) for funcion, args in tareas]
@@ -0,0 +1,124 @@
+#%%
+# Codificación binaria de los arreglos de las figuras que viajan en los
+# stores. Cada arreglo numérico de las trazas se envía como
+# {"dtype": ..., "bdata": base64} (el formato de arreglos tipados de
+# plotly.js) con el tipo más chico que lo representa sin pérdida: los ID de
+# ZAT y las clases van como enteros de 1 o 2 bytes y los viajes como float32
+# cuando alcanza la precisión. Los textos repetidos (la etiqueta del rango de
+# cada ZAT) van como diccionario: {"categorias": [...], "codigos": arreglo}.
+# En el navegador assets/pestanas.js los convierte en arreglos tipados y
+# listas de texto antes de dibujar, sin pasar por el parser de JSON número a
+# número.
+import base64
+import json
+
+import numpy as np
+
+# Arreglos más cortos se dejan como texto
+min_elementos = 8
+
+# Enteros de menor a mayor tamaño
+_enteros = ["i1", "u1", "i2", "u2", "i4", "u4"]
+
+
+def _tipo_minimo(arreglo):
+    # dtype más chico que representa ``arreglo`` sin pérdida, o None
+    if arreglo.dtype.kind in "iu":
+        minimo, maximo = arreglo.min(), arreglo.max()
+        for tipo in _enteros:
+            info = np.iinfo(tipo)
+            if info.min <= minimo and maximo <= info.max:
+                return tipo
+        return None
+    if arreglo.dtype.kind == "f":
+        with np.errstate(over="ignore"):
+            reducido = arreglo.astype(np.float32)
+        if np.array_equal(reducido, arreglo, equal_nan=True):
+            return "f4"
+        # Con pocos decimales el texto puede ser más corto que 8 bytes en base64
+        if np.isfinite(arreglo).all() and \
+                len(json.dumps(arreglo.tolist())) < len(arreglo) * 32 / 3:
+            return None
+        return "f8"
+    return None
+
+
+def _es_texto(valor):
+    return all(isinstance(x, str) for x in valor)
+
+
+def codifica_textos(valor):
+    # Lista de textos con muchos repetidos como categorías y códigos
+    categorias, codigos = np.unique(np.asarray(valor, dtype=object).astype(str),
+                                    return_inverse=True)
+    if len(categorias) * 2 > len(valor):
+        return valor
+    return {"categorias": categorias.tolist(), "codigos": codifica_arreglo(codigos)}
+
+
+def codifica_arreglo(valor):
+    # El arreglo codificado, o el valor sin cambios si no es numérico o
+    # texto 1-D
+    if isinstance(valor, (list, tuple)):
+        if len(valor) < min_elementos:
+            return valor
+        if _es_texto(valor):
+            return codifica_textos(valor)
+        if not all(isinstance(x, (int, float, np.number)) and not isinstance(x, bool)
+                   for x in valor):
+            return valor
+        valor = np.asarray(valor)
+    if not isinstance(valor, np.ndarray) or valor.ndim not in (1, 2) or \
+            valor.size < min_elementos:
+        return valor
+    if valor.ndim == 1 and valor.dtype.kind in "OU" and _es_texto(valor):
+        return codifica_textos(valor)
+    if valor.dtype.kind == "O":
+        # p.ej. customdata de plotly express con columnas numéricas
+        try:
+            valor = valor.astype(float)
+        except (TypeError, ValueError):
+            return valor
+    tipo = _tipo_minimo(valor.ravel())
+    if tipo is None:
+        return valor
+    codificado = {"dtype": tipo,
+                  "bdata": base64.b64encode(valor.astype("<" + tipo).tobytes()).decode("ascii")}
+    if valor.ndim == 2:
+        # Filas x columnas, como "shape" en plotly.js
+        codificado["shape"] = "{},{}".format(*valor.shape)
+    return codificado
+
+
+def _codifica(valor):
+    if isinstance(valor, dict):
+        return {k: _codifica(v) for k, v in valor.items()}
+    return codifica_arreglo(valor)
+
+
+def codifica_figura(figura):
+    # Copia de la figura (diccionario) con los arreglos de las trazas
+    # codificados; el layout no se toca
+    figura = dict(figura)
+    figura["data"] = [_codifica(traza) for traza in figura.get("data", [])]
+    return figura
+
+
+def _decodifica(valor):
+    if isinstance(valor, dict):
+        if set(valor) in ({"dtype", "bdata"}, {"dtype", "bdata", "shape"}):
+            arreglo = np.frombuffer(base64.b64decode(valor["bdata"]), dtype="<" + valor["dtype"])
+            if "shape" in valor:
+                arreglo = arreglo.reshape([int(n) for n in valor["shape"].split(",")])
+            return arreglo
+        if set(valor) == {"categorias", "codigos"}:
+            return np.asarray(valor["categorias"], dtype=object)[_decodifica(valor["codigos"])]
+        return {k: _decodifica(v) for k, v in valor.items()}
+    return valor
+
+
+def decodifica_figura(figura):
+    # Inverso de codifica_figura
+    figura = dict(figura)
+    figura["data"] = [_decodifica(traza) for traza in figura.get("data", [])]
+    return figura
@@ -0,0 +1,246 @@
+#%%
+# Mide el tablero de punta a punta sobre datos sintéticos (ver sinteticos.py).
+# Cada callback se llama como lo haría el navegador, con un POST a
+# /_dash-update-component, y se registra el tiempo y el tamaño de la
+# respuesta. "frio" vacía antes de cada repetición las caches de agregados y
+# figuras (costo de un filtro nuevo); "caliente" repite la misma petición.
+# El arranque mide la importación de la app y la primera carga de la página
+# con la carpeta de cache vacía (construcción de los cubos).
+#
+# Los resultados se agregan a benchmarks/resultados.jsonl con el commit, para
+# comparar entre versiones:
+#   python benchmarks/corre.py --zats 900 --densidad 0.02
+#   python benchmarks/corre.py --compara
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import sinteticos
+
+raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+carpeta_app = os.path.join(raiz, "app")
+ruta_resultados = os.path.join(raiz, "benchmarks", "resultados.jsonl")
+
+
+def commit_actual():
+    # Commit de HEAD y si hay cambios sin guardar
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=raiz,
+                                         text=True).strip()
+        sucio = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "app"], cwd=raiz) != 0
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido", False
+    return commit, sucio
+
+
+class Cliente:
+    """Llama los callbacks de la app por HTTP con el cliente de pruebas de Flask."""
+
+    def __init__(self, app):
+        self.app = app
+        self.http = app.server.test_client()
+
+    def clave_salida(self, salida):
+        # Clave de callback_map que contiene la salida "id.propiedad"
+        return [k for k in self.app.callback_map if salida in k.strip(".").split("...")][0]
+
+    def llama(self, salida, valores, cambiados):
+        clave = self.clave_salida(salida)
+        cb = self.app.callback_map[clave]
+
+        def espec(items):
+            return [{"id": i["id"], "property": i["property"],
+                     "value": valores.get("{}.{}".format(i["id"], i["property"]))}
+                    for i in items]
+
+        if clave.startswith(".."):
+            salidas = [{"id": s.split(".")[0], "property": s.split(".")[1]}
+                       for s in clave.strip(".").split("...")]
+        else:
+            salidas = {"id": clave.split(".")[0], "property": clave.split(".")[1]}
+        cuerpo = {"output": clave, "outputs": salidas, "inputs": espec(cb["inputs"]),
+                  "state": espec(cb.get("state", [])), "changedPropIds": cambiados}
+        inicio = time.perf_counter()
+        respuesta = self.http.post("/_dash-update-component", json=cuerpo)
+        segundos = time.perf_counter() - inicio
+        if respuesta.status_code == 204:
+            return None, segundos, 0
+        if respuesta.status_code != 200:
+            raise RuntimeError("{} respondió {}: {}".format(salida, respuesta.status_code,
+                                                            respuesta.data[:500]))
+        return respuesta.get_json()["response"], segundos, len(respuesta.data)
+
+
+def escenarios(A, seleccion):
+    # (nombre, salida, valores, cambiados) en el orden en que los dispara la
+    # interfaz. Los valores de los stores se completan al ir respondiendo.
+    # El cambio de pestañas del mapa corre en el navegador (assets/pestanas.js)
+    # y no pasa por el servidor; los gráficos se piden al abrir su pestaña
+    anios = A.anios_dispo()
+    base = {"dd-o.value": "Todas", "dd-d.value": "Todas", "dd-prop.value": A.prop_defecto,
+            "button-filt-data.n_clicks": 1, "button-gen-mapa-od.n_clicks": 1,
+            "check_comp.value": None, "dd-v-anio.value": anios[-1], "dd-v-t-dia.value": "lab",
+            "rs-h-i-od.value": [6, 9], "in-rang.value": "100, 500, 1000, 2000",
+            "dd-clasif.value": "usuario", "in-n-clases.value": 5,
+            "check_tipo_comp.value": "Absoluto", "dd-v-anio-base.value": anios[0],
+            "dd-v-anio-comparacion.value": anios[-1], "tabs-v.active_tab": "tab-v-o"}
+    if seleccion:
+        base["dd-o.value"] = [int(z) for z in A.zat_o_dispo()[:seleccion]]
+    filtra = "store-val-inter-od.data"
+    pasos = [
+        ("filtra_df_od", filtra, {}, ["button-filt-data.n_clicks"]),
+        ("genera_grafs", "store-val-grafs.data", {}, ["button-filt-data.n_clicks"]),
+        ("genera_mapa_od", "store-graf-od.data", {}, ["button-gen-mapa-od.n_clicks"]),
+        ("genera_mapa_od (horas)", "store-graf-od.data", {"rs-h-i-od.value": [16, 19]},
+         ["rs-h-i-od.value"]),
+    ]
+    for tabs, grafica, prefijo, nombre in (("tabs-part-mod", "fig-part-mod", "tab-part-mod-",
+                                            "render_part_mod"),
+                                           ("tabs-h-i", "fig-h-i", "tab-h-i-", "render_h_i"),
+                                           ("tabs-distancia", "fig-dist", "tab-dist-",
+                                            "render_dist")):
+        for sufijo in ("hab", "sab", "dom"):
+            pasos.append(("{} ({})".format(nombre, sufijo), grafica + ".figure",
+                          {tabs + ".active_tab": prefijo + sufijo}, [tabs + ".active_tab"]))
+    for tipo_comp in ("Absoluto", "Porcentaje"):
+        pasos.append(("genera_mapa_od_comp ({})".format(tipo_comp.lower()),
+                      "store-graf-od-comp.data",
+                      {"check_comp.value": ["Si"], "check_tipo_comp.value": tipo_comp,
+                       "in-rang.value": None}, ["button-gen-mapa-od.n_clicks"]))
+    pasos.append(("genera_dd_v_anio", "dd-v-anio.disabled", {"check_comp.value": ["Si"]},
+                  ["check_comp.value"]))
+    pasos.append(("genera_v_anio_comp", "dd-v-anio-comparacion.options",
+                  {"dd-v-anio-base.value": anios[0]}, ["dd-v-anio-base.value"]))
+    return base, pasos
+
+
+def vacia_caches(A):
+    A.cache_agregados.clear()
+    A.memo_figuras.clear()
+    A.memo_agregados.clear()
+
+
+def mide(A, cliente, repeticiones, seleccion):
+    valores, pasos = escenarios(A, seleccion)
+    resultados = dict()
+    # Los stores que producen unos callbacks son entradas de los siguientes
+    productores = {"store-val-inter-od.data", "store-val-grafs.data", "store-graf-od.data",
+                   "store-graf-od-comp.data"}
+    for nombre, salida, cambios, cambiados in pasos:
+        valores.update(cambios)
+        medidas = {"frio": [], "caliente": []}
+        tamano = 0
+        for modo in ("frio", "caliente"):
+            for _ in range(repeticiones):
+                if modo == "frio":
+                    vacia_caches(A)
+                respuesta, segundos, tamano = cliente.llama(salida, valores, cambiados)
+                medidas[modo].append(segundos)
+        if salida in productores and respuesta is not None:
+            id_salida, propiedad = salida.split(".")
+            valores[salida] = respuesta[id_salida][propiedad]
+        resultados[nombre] = {
+            modo: {"mediana_ms": round(float(np.median(t)) * 1000, 2),
+                   "min_ms": round(float(np.min(t)) * 1000, 2),
+                   "p90_ms": round(float(np.percentile(t, 90)) * 1000, 2)}
+            for modo, t in medidas.items()}
+        resultados[nombre]["respuesta_bytes"] = tamano
+    return resultados
+
+
+def corre(args):
+    parametros = {"zats": args.zats, "anios": args.anios, "densidad": args.densidad,
+                  "semilla": args.semilla}
+    carpeta = os.path.join(args.datos, "z{zats}_a{a}_d{densidad}_s{semilla}".format(
+        a="-".join(map(str, args.anios)), **parametros))
+    if not os.path.exists(os.path.join(carpeta, "assets")):
+        print("Generando datos en", carpeta)
+        sinteticos.escribe(carpeta, args.zats, args.anios, args.densidad, args.semilla)
+    cache = os.path.join(carpeta, "cache")
+    shutil.rmtree(cache, ignore_errors=True)
+
+    # Sin precálculo ni trabajos de fondo: cada callback se mide dentro de
+    # su propia petición
+    os.environ.update({"CARPETA_CACHE": cache, "N_PRECALCULO": "0", "MODO_DATOS": args.modo,
+                       "CALLBACKS_FONDO": "0"})
+    os.chdir(carpeta)
+    sys.path.insert(0, carpeta_app)
+    inicio = time.perf_counter()
+    import app_wbg as A
+    cliente = Cliente(A.app)
+    cliente.http.get("/_dash-layout")
+    arranque = time.perf_counter() - inicio
+
+    resultados = mide(A, cliente, args.repeticiones, args.seleccion)
+    commit, sucio = commit_actual()
+    registro = {"fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+                "commit": commit, "cambios_sin_commit": sucio, "etiqueta": args.etiqueta,
+                "python": sys.version.split()[0], "modo_datos": args.modo,
+                "seleccion_zat": args.seleccion, "parametros": parametros,
+                "filas_od": int(len(A.cubo("od"))), "arranque_s": round(arranque, 3),
+                "callbacks": resultados}
+    with open(args.salida, "a", encoding="utf-8") as archivo:
+        archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    imprime([registro])
+
+
+def imprime(registros):
+    # Tabla de medianas en frío por callback, una columna por corrida
+    nombres = list(registros[-1]["callbacks"])
+    encabezado = ["callback"] + ["{}{}".format(r["commit"], "*" if r["cambios_sin_commit"] else "")
+                                 for r in registros]
+    filas = [["arranque (s)"] + [str(r["arranque_s"]) for r in registros]]
+    for nombre in nombres:
+        fila = [nombre]
+        for r in registros:
+            c = r["callbacks"].get(nombre)
+            fila.append("-" if c is None else "{:.1f} / {:.1f} ms  {:.0f} kB".format(
+                c["frio"]["mediana_ms"], c["caliente"]["mediana_ms"], c["respuesta_bytes"] / 1024))
+        filas.append(fila)
+    anchos = [max(len(f[i]) for f in filas + [encabezado]) for i in range(len(encabezado))]
+    for fila in [encabezado] + filas:
+        print("  ".join(c.ljust(a) for c, a in zip(fila, anchos)))
+
+
+def compara(args):
+    # Últimas corridas de cada commit con los mismos parámetros que la última
+    with open(args.salida, encoding="utf-8") as archivo:
+        registros = [json.loads(linea) for linea in archivo if linea.strip()]
+    ultimo = registros[-1]
+    iguales = [r for r in registros
+               if (r["parametros"], r["modo_datos"], r["seleccion_zat"]) ==
+               (ultimo["parametros"], ultimo["modo_datos"], ultimo["seleccion_zat"])]
+    por_commit = dict()
+    for r in iguales:
+        por_commit[(r["commit"], r["cambios_sin_commit"])] = r
+    imprime(list(por_commit.values())[-args.ultimos:])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de los callbacks del tablero")
+    parser.add_argument("--zats", type=int, default=900)
+    parser.add_argument("--anios", type=int, nargs="+", default=[2019, 2023])
+    parser.add_argument("--densidad", type=float, default=0.02)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--modo", choices=["memoria", "disco"], default="memoria")
+    parser.add_argument("--seleccion", type=int, default=0,
+                        help="filtrar por las primeras N ZAT de origen (0 = todas)")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--etiqueta", default="")
+    parser.add_argument("--datos", default=os.path.join(raiz, "benchmarks", "datos"))
+    parser.add_argument("--salida", default=ruta_resultados)
+    parser.add_argument("--compara", action="store_true",
+                        help="mostrar las corridas guardadas por commit en lugar de medir")
+    parser.add_argument("--ultimos", type=int, default=5)
+    args = parser.parse_args()
+    if args.compara:
+        compara(args)
+    else:
+        corre(args)
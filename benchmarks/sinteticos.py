@@ -0,0 +1,164 @@
+#%%
+# Matrices OD sintéticas con el mismo esquema que leen los cubos del tablero,
+# para medir el rendimiento sin los datos originales (los Parquet del repo
+# son punteros de LFS).
+#
+# Las ZAT son celdas de una cuadrícula centrada en Bogotá. Se sortean
+# registros base (anio, tipo_dia, origen, destino, periodo2, proposito,
+# modo, rango_dist, viajes): los orígenes según una población lognormal y
+# los destinos cerca del origen, así que la matriz queda dispersa y con
+# estructura de gravedad. Las cuatro tablas del tablero son agregaciones de
+# esos mismos registros, por lo que sus totales son consistentes.
+#
+# Uso: python benchmarks/sinteticos.py carpeta --zats 900 --anios 2019 2023
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+tipos_dia = ["lab", "sab", "dom"]
+propositos = ["HBO", "HBW", "HBEdu", "NHB"]
+modos = ["Transporte público", "Privado", "No motorizado"]
+rangos_dist = ["[0-0.5)", "[0.5-1)", "[1-2)", "[2-5)", "[5-10)", "[10-20)", "[20-50)", "+50"]
+cortes_dist = [0.5, 1, 2, 5, 10, 20, 50]
+
+# Perfil horario de inicio de los viajes por tipo de día (picos AM y PM)
+horas = np.arange(24)
+perfiles = {
+    "lab": np.exp(-(horas - 7) ** 2 / 3) + 0.8 * np.exp(-(horas - 17.5) ** 2 / 4) + 0.05,
+    "sab": np.exp(-(horas - 11) ** 2 / 12) + 0.4 * np.exp(-(horas - 17) ** 2 / 8) + 0.05,
+    "dom": np.exp(-(horas - 12) ** 2 / 16) + 0.05,
+}
+# Participación relativa de cada tipo de día en el número de viajes
+pesos_dia = {"lab": 1.0, "sab": 0.6, "dom": 0.4}
+
+centro = (-74.09476461866534, 4.657946861376187)
+lado_celda = 0.01  # grados (~1.1 km)
+
+
+def cuadricula(n_zats):
+    # Posición (columna, fila) de cada ZAT y sus identificadores
+    ancho = int(np.ceil(np.sqrt(n_zats)))
+    i = np.arange(n_zats)
+    ids = (i + 1) * 10
+    return ids, i % ancho, i // ancho, ancho
+
+
+def registros(n_zats, anios, densidad, semilla=0, viajes_par=25.0):
+    # Registros base; ``densidad`` es la fracción de los pares OD con viajes
+    # en cada año y tipo de día
+    rng = np.random.default_rng(semilla)
+    ids, col, fila, ancho = cuadricula(n_zats)
+    poblacion = rng.lognormal(0, 0.8, n_zats)
+    poblacion /= poblacion.sum()
+    n_pares = max(int(densidad * n_zats * n_zats), 1)
+
+    partes = []
+    for k, anio in enumerate(anios):
+        # Crecimiento leve entre años
+        escala = 1 + 0.03 * k
+        for t_dia in tipos_dia:
+            n = int(n_pares * pesos_dia[t_dia])
+            o = rng.choice(n_zats, n, p=poblacion)
+            # Destino: desplazamiento normal sobre la cuadrícula (gravedad)
+            dc = np.rint(rng.normal(0, ancho / 6, n)).astype(int)
+            df = np.rint(rng.normal(0, ancho / 6, n)).astype(int)
+            d = np.clip(fila[o] + df, 0, ancho - 1) * ancho + np.clip(col[o] + dc, 0, ancho - 1)
+            d = np.where(d < n_zats, d, o)
+            pares = np.unique(np.stack([o, d], axis=1), axis=0)
+            # Cada par tiene varios registros de hora y propósito
+            repeticiones = rng.poisson(2, len(pares)) + 1
+            o = np.repeat(pares[:, 0], repeticiones)
+            d = np.repeat(pares[:, 1], repeticiones)
+            m = len(o)
+            dist = np.hypot(col[o] - col[d], fila[o] - fila[d]) * 1.1 + rng.uniform(0.1, 1, m)
+            # Más viajes no motorizados en distancias cortas
+            p_nm = np.exp(-dist / 2) * 0.6
+            azar = rng.random(m)
+            modo = np.where(azar < p_nm, 2, np.where(azar < p_nm + (1 - p_nm) * 0.6, 0, 1))
+            perfil = perfiles[t_dia] / perfiles[t_dia].sum()
+            partes.append(pd.DataFrame({
+                "anio": anio,
+                "tipo_dia": t_dia,
+                "origen": ids[o],
+                "destino": ids[d],
+                "periodo2": rng.choice(24, m, p=perfil),
+                "proposito": rng.choice(propositos, m, p=[0.3, 0.35, 0.2, 0.15]),
+                "modo": np.array(modos)[modo],
+                "rango_dist": np.array(rangos_dist)[np.searchsorted(cortes_dist, dist)],
+                "viajes": rng.gamma(1.5, viajes_par / 1.5, m) * escala,
+            }))
+    return pd.concat(partes, ignore_index=True)
+
+
+def _rectangulo(x, y, ancho, alto):
+    return [[[x, y], [x + ancho, y], [x + ancho, y + alto], [x, y + alto], [x, y]]]
+
+
+def geometrias(n_zats):
+    # ZAT (un cuadrado por celda con la propiedad ID), localidades (bloques
+    # de 5 x 5 celdas) y dos vías principales que cruzan la cuadrícula
+    ids, col, fila, ancho = cuadricula(n_zats)
+    x0 = centro[0] - ancho * lado_celda / 2
+    y0 = centro[1] - ancho * lado_celda / 2
+    zat = [{"type": "Feature", "properties": {"ID": int(z)},
+            "geometry": {"type": "Polygon",
+                         "coordinates": _rectangulo(x0 + c * lado_celda, y0 + f * lado_celda,
+                                                    lado_celda, lado_celda)}}
+           for z, c, f in zip(ids, col, fila)]
+    bloques = int(np.ceil(ancho / 5))
+    localidades = [{"type": "Feature", "properties": {"ID": i * bloques + j},
+                    "geometry": {"type": "Polygon",
+                                 "coordinates": _rectangulo(x0 + j * 5 * lado_celda,
+                                                            y0 + i * 5 * lado_celda,
+                                                            5 * lado_celda, 5 * lado_celda)}}
+                   for i in range(bloques) for j in range(bloques)]
+    lado = ancho * lado_celda
+    vias = [{"type": "Feature", "properties": {},
+             "geometry": {"type": "LineString", "coordinates": linea}}
+            for linea in ([[x0, centro[1]], [x0 + lado, centro[1]]],
+                          [[centro[0], y0], [centro[0], y0 + lado]])]
+    return {nombre: {"type": "FeatureCollection", "features": f}
+            for nombre, f in (("BTA_ZAT", zat), ("BTA_Localidades", localidades),
+                              ("BTA_Vias_principales", vias))}
+
+
+def escribe(carpeta, n_zats=900, anios=(2019, 2023), densidad=0.02, semilla=0):
+    # Escribe en ``carpeta``/assets los archivos con los nombres que usa el tablero
+    assets = os.path.join(carpeta, "assets")
+    os.makedirs(assets, exist_ok=True)
+    base = registros(n_zats, list(anios), densidad, semilla)
+    llaves = ["anio", "tipo_dia", "origen", "destino", "proposito"]
+
+    od = base.groupby(llaves + ["periodo2"], as_index=False)["viajes"].sum()
+    for anio, df in od.groupby("anio"):
+        df.sort_values(["origen", "destino"]).to_parquet(
+            os.path.join(assets, "odmatrix_od_h_{:02d}.parquet".format(anio % 100)), index=False)
+
+    part_mod = base.groupby(llaves + ["modo"], as_index=False)["viajes"].sum()
+    part_mod.to_parquet(os.path.join(assets, "odmatrix_part_mod.parquet"), index=False)
+
+    h_i = base.assign(periodo=["P{:02d}".format(h) for h in base["periodo2"]])
+    h_i = h_i.groupby(llaves + ["modo", "periodo"], as_index=False)["viajes"].sum()
+    h_i.to_parquet(os.path.join(assets, "odmatrix_h_i.parquet"), index=False)
+
+    dist = base.groupby(llaves + ["modo", "rango_dist"], as_index=False)["viajes"].sum()
+    dist.to_parquet(os.path.join(assets, "odmatrix_dist.parquet"), index=False)
+
+    for nombre, geojson in geometrias(n_zats).items():
+        with open(os.path.join(assets, nombre + ".geojson"), "w", encoding="utf-8") as archivo:
+            json.dump(geojson, archivo)
+    return {"filas_od": len(od), "filas_base": len(base)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera matrices OD sintéticas")
+    parser.add_argument("carpeta")
+    parser.add_argument("--zats", type=int, default=900)
+    parser.add_argument("--anios", type=int, nargs="+", default=[2019, 2023])
+    parser.add_argument("--densidad", type=float, default=0.02)
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args()
+    print(escribe(args.carpeta, args.zats, args.anios, args.densidad, args.semilla))
@@ -0,0 +1,72 @@
+# Los módulos de la app se importan por nombre desde app/, igual que al
+# correr app_wbg.py
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+# Tabla OD chica con las columnas de la matriz del tablero: llaves repetidas
+# (el cubo las suma), viajes nulos y una fila sin propósito
+DIMS_OD = ["anio", "tipo_dia", "periodo2"]
+ZATS = np.arange(1, 18)  # 16 y 17 no aparecen en la tabla
+
+
+@pytest.fixture(scope="session")
+def df_od():
+    rng = np.random.default_rng(0)
+    n = 800
+    df = pd.DataFrame({
+        "anio": rng.choice([2019, 2021], n),
+        "tipo_dia": rng.choice(["lab", "sab", "dom"], n),
+        "periodo2": rng.integers(0, 24, n),
+        "origen": rng.integers(1, 16, n),
+        "destino": rng.integers(1, 16, n),
+        "proposito": rng.choice(["HBW", "HBO", "HBEdu", "NHB"], n).astype(object),
+        "viajes": rng.gamma(2, 50, n).round(1),
+    })
+    df.loc[rng.choice(n, 20, replace=False), "viajes"] = np.nan
+    df.loc[5, "proposito"] = None
+    return df
+
+
+@pytest.fixture(scope="session")
+def dataset_od(df_od, tmp_path_factory):
+    ruta = tmp_path_factory.mktemp("datos") / "odmatrix_od_h_19.parquet"
+    df_od.to_parquet(ruta, index=False)
+    return ds.dataset(str(ruta), format="parquet")
+
+
+@pytest.fixture(scope="module", params=["memoria", "sin_resumenes", "disco"])
+def cubo_od(request, dataset_od, tmp_path_factory):
+    # El cubo de la tabla en memoria (con y sin resúmenes) y fuera de memoria
+    from cubo import CuboOD, crea_cubo
+    ruta = str(tmp_path_factory.mktemp("cache") / "cubo_od_prueba.arrow")
+    resumenes = () if request.param == "sin_resumenes" else tuple(CuboOD.llaves_resumenes)
+    return crea_cubo(dataset_od, "origen", "destino", "proposito", DIMS_OD, "viajes", ZATS,
+                     en_disco=request.param == "disco", ruta_cache=ruta, resumenes=resumenes)
+
+
+def referencia(df, columnas, origenes=None, destinos=None, propositos=None):
+    # Lo que debe dar el cubo, con pandas: sin las filas con llaves
+    # faltantes, filtrado y sumado con groupby
+    df = df.dropna(subset=DIMS_OD + ["origen", "destino", "proposito"])
+    for col, valores in (("origen", origenes), ("destino", destinos),
+                         ("proposito", propositos)):
+        if valores is not None:
+            df = df[df[col].isin(valores)]
+    return df.groupby(columnas, as_index=False)["viajes"].sum()
+
+
+def compara_tablas(obtenida, esperada, columnas):
+    obtenida = obtenida.sort_values(columnas).reset_index(drop=True)
+    esperada = esperada.sort_values(columnas).reset_index(drop=True)
+    assert len(obtenida) == len(esperada)
+    for col in columnas:
+        assert obtenida[col].tolist() == esperada[col].tolist()
+    np.testing.assert_allclose(obtenida["viajes"].to_numpy(float),
+                               esperada["viajes"].to_numpy(float), rtol=1e-6)
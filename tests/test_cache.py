@@ -0,0 +1,83 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache import CacheLRU, MemoDisco, clave_cache, tamano_bytes
+
+
+def arreglo(n_bytes):
+    return np.zeros(n_bytes, dtype=np.uint8)
+
+
+def test_tamano_bytes():
+    assert tamano_bytes(arreglo(100)) == 100
+    assert tamano_bytes({"a": arreglo(10), "b": [arreglo(5), arreglo(7)]}) == 22
+    df = pd.DataFrame({"x": np.zeros(10)})
+    assert tamano_bytes(df) == df.memory_usage(index=True, deep=True).sum()
+
+
+def test_expulsa_los_menos_usados():
+    cache = CacheLRU(300)
+    for clave in "abc":
+        assert cache.set(clave, arreglo(100))
+    assert cache.bytes == 300 and len(cache) == 3
+    # Leer "a" la deja como la más reciente: la siguiente en salir es "b"
+    assert cache.get("a") is not None
+    cache.set("d", arreglo(100))
+    assert "b" not in cache and all(c in cache for c in "acd")
+    # Una entrada grande saca las que hagan falta, de la más vieja a la más nueva
+    cache.set("e", arreglo(200))
+    assert [c for c in "abcde" if c in cache] == ["d", "e"]
+    assert cache.bytes == 300
+
+
+def test_reemplazo_actualiza_el_tamano():
+    cache = CacheLRU(300)
+    cache.set("a", arreglo(100))
+    cache.set("b", arreglo(100))
+    cache.set("a", arreglo(150))
+    assert cache.bytes == 250 and len(cache) == 2
+    # Reemplazar también la deja como la más reciente
+    cache.set("c", arreglo(100))
+    assert "b" not in cache and "a" in cache and cache.bytes == 250
+
+
+def test_entrada_mas_grande_que_el_presupuesto():
+    cache = CacheLRU(300)
+    cache.set("a", arreglo(100))
+    assert not cache.set("grande", arreglo(301))
+    assert "grande" not in cache and "a" in cache and cache.bytes == 100
+    cache.clear()
+    assert len(cache) == 0 and cache.bytes == 0
+    assert cache.get("a", "no") == "no"
+
+
+def test_memo_disco_vence_y_se_recalcula(tmp_path):
+    memo = MemoDisco(str(tmp_path), 2**20, ttl=0.5)
+    calculos = []
+
+    def calcula():
+        calculos.append(1)
+        return {"viajes": arreglo(10), "n": len(calculos)}
+
+    clave = clave_cache("od", [1, 2], "HBW")
+    assert memo.obtiene(clave, calcula)["n"] == 1
+    assert memo.obtiene(clave, calcula)["n"] == 1
+    # Otro proceso (otra instancia sobre la misma carpeta) ve la misma entrada
+    assert MemoDisco(str(tmp_path), 2**20, ttl=0.5).get(clave)["n"] == 1
+
+    time.sleep(0.6)
+    assert clave not in memo and memo.get(clave) is None
+    # Vencida se vuelve a calcular y queda guardada otra vez con su ttl
+    assert memo.obtiene(clave, calcula)["n"] == 2
+    assert memo.obtiene(clave, calcula)["n"] == 2
+    assert len(calculos) == 2
+
+
+def test_memo_disco_sin_ttl(tmp_path):
+    memo = MemoDisco(str(tmp_path), 2**20, ttl=None)
+    memo.set("a", 1)
+    assert "a" in memo and memo.get("a") == 1
+    memo.clear()
+    assert "a" not in memo
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import ZATS, referencia
+
+from comparacion import DESAPARECIDA, EN_AMBOS, NUEVA, Comparacion
+
+
+def test_par_a_mano():
+    suma = [[10, 0, 0, 5, 0], [15, 4, 0, 0, 0]]
+    presente = [[True, True, False, True, False], [True, True, True, False, False]]
+    dif = Comparacion(suma, presente).par(0, 1)
+    assert dif["presente"].tolist() == [True, True, True, True, False]
+    assert dif["absoluta"].tolist() == [5, 4, 0, -5, 0]
+    # Sin viajes en el año base el porcentaje es NaN, también con registros
+    np.testing.assert_allclose(dif["porcentaje"], [50, np.nan, np.nan, -100, np.nan])
+    assert dif["estado"][:4].tolist() == [EN_AMBOS, EN_AMBOS, NUEVA, DESAPARECIDA]
+
+
+def test_valores_constantes():
+    dif = Comparacion(np.full((2, 4), 7.0), np.ones((2, 4), dtype=bool)).par(0, 1)
+    assert not dif["absoluta"].any() and not dif["porcentaje"].any()
+    assert (dif["estado"] == EN_AMBOS).all()
+
+
+def test_todos_igual_a_cada_par():
+    rng = np.random.default_rng(4)
+    presente = rng.random((3, 6)) < 0.7
+    suma = np.where(presente, rng.integers(0, 4, (3, 6)) * 10.0, 0)
+    todos = Comparacion(suma, presente).todos()
+    for i_b in range(3):
+        for i_c in range(3):
+            dif = Comparacion(suma, presente).par(i_b, i_c)
+            for clave, valor in dif.items():
+                np.testing.assert_array_equal(todos[clave][i_b, i_c], valor)
+
+
+@pytest.mark.parametrize("filtros", [{}, {"propositos": ["HBEdu"]}, {"destinos": [4]},
+                                     {"origenes": [7]}, {"origenes": []}])
+@pytest.mark.parametrize("t_dia, horas", [("lab", (6, 9)), ("dom", (0, 23)), ("sab", (3, 3))])
+def test_par_igual_a_merge(cubo_od, df_od, filtros, t_dia, horas):
+    # Como la vista de comparación: viajes por ZAT de origen de 2019 y 2021
+    (suma, presente), = cubo_od.agrega(["origen"], **filtros)
+    cats = cubo_od.catalogos
+    i_dia = np.flatnonzero(cats["tipo_dia"] == t_dia)[0]
+    en_rango = (horas[0] <= cats["periodo2"]) & (cats["periodo2"] <= horas[1])
+    suma = suma[:, i_dia][:, en_rango].sum(axis=1)
+    presente = presente[:, i_dia][:, en_rango].any(axis=1)
+    i_b, i_c = (np.flatnonzero(cats["anio"] == a)[0] for a in (2019, 2021))
+    dif = Comparacion(suma, presente).par(i_b, i_c)
+
+    df = df_od[(df_od["tipo_dia"] == t_dia) & df_od["periodo2"].between(*horas)]
+    por_anio = referencia(df, ["anio", "origen"], **filtros)
+    esperada = pd.merge(por_anio[por_anio["anio"] == 2019], por_anio[por_anio["anio"] == 2021],
+                        on="origen", how="outer", suffixes=("_b", "_c"))
+    base = esperada["viajes_b"].fillna(0).to_numpy()
+    comp = esperada["viajes_c"].fillna(0).to_numpy()
+    i_zat = np.searchsorted(ZATS, esperada["origen"])
+
+    assert ZATS[dif["presente"]].tolist() == sorted(esperada["origen"])
+    np.testing.assert_allclose(dif["base"][i_zat], base)
+    np.testing.assert_allclose(dif["comparacion"][i_zat], comp)
+    np.testing.assert_allclose(dif["absoluta"][i_zat], comp - base, atol=1e-9)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        porcentaje = np.where(base != 0, (comp - base) * 100 / base, np.nan)
+    np.testing.assert_allclose(dif["porcentaje"][i_zat], porcentaje)
+    assert (dif["estado"][i_zat] == np.select([esperada["viajes_b"].isna(),
+                                                esperada["viajes_c"].isna()],
+                                               [NUEVA, DESAPARECIDA], EN_AMBOS)).all()
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pytest
+from conftest import DIMS_OD, ZATS, compara_tablas, referencia
+
+import cubo as modulo_cubo
+from cubo import AcumuladoEje, crea_cubo
+
+FILTROS = [
+    {},
+    {"origenes": [3, 5]},
+    {"destinos": [1]},
+    {"propositos": ["HBW"]},
+    {"origenes": [2], "destinos": [2, 7], "propositos": ["HBO", "NHB"]},
+    {"origenes": [4]},
+    {"destinos": list(range(1, 16))},
+]
+VACIOS = [{"origenes": []}, {"destinos": []}, {"propositos": []}, {"origenes": [16]},
+          {"origenes": [1], "destinos": [17]}]
+
+
+@pytest.mark.parametrize("eje", [None, "origen", "destino"])
+@pytest.mark.parametrize("filtros", FILTROS)
+def test_tabla_igual_a_groupby(cubo_od, df_od, filtros, eje):
+    columnas = DIMS_OD + ([eje] if eje else [])
+    compara_tablas(cubo_od.tabla("viajes", eje, **filtros),
+                   referencia(df_od, columnas, **filtros), columnas)
+
+
+@pytest.mark.parametrize("eje", [None, "origen"])
+@pytest.mark.parametrize("filtros", VACIOS)
+def test_seleccion_vacia_no_tiene_filas(cubo_od, filtros, eje):
+    (suma, presente), = cubo_od.agrega([eje], **filtros)
+    assert not presente.any() and not suma.any()
+    assert len(cubo_od.tabla("viajes", eje, **filtros)) == 0
+
+
+def test_varios_ejes_en_una_pasada(cubo_od):
+    filtros = {"destinos": [2, 3, 9], "propositos": ["HBEdu"]}
+    juntos = cubo_od.agrega([None, "origen", "destino"], **filtros)
+    for eje, (suma, presente) in zip([None, "origen", "destino"], juntos):
+        (suma_sola, presente_solo), = cubo_od.agrega([eje], **filtros)
+        np.testing.assert_allclose(suma, suma_sola)
+        assert (presente == presente_solo).all()
+
+
+def test_zats_de_los_filtros(cubo_od, df_od):
+    assert cubo_od.zats_o.tolist() == sorted(df_od["origen"].unique())
+    assert cubo_od.zats_d.tolist() == sorted(df_od["destino"].unique())
+
+
+@pytest.mark.parametrize("filtros", FILTROS + VACIOS)
+def test_pares_igual_a_groupby(cubo_od, df_od, filtros):
+    # Como la descarga: celda de salida año x tipo de día, horas de 6 a 9
+    cats = cubo_od.catalogos
+    i_anio, i_dia, i_hora = np.indices(cubo_od.forma).reshape(3, -1)
+    elegida = (6 <= cats["periodo2"][i_hora]) & (cats["periodo2"][i_hora] <= 9)
+    n_dias = cubo_od.forma[1]
+    salida = np.where(elegida, i_anio * n_dias + i_dia, -1)
+    partes = list(cubo_od.pares(salida, zats_por_lote=4, **filtros))
+    if partes:
+        celda, cod_o, cod_d, viajes = (np.concatenate(p) for p in zip(*partes))
+    else:
+        celda = cod_o = cod_d = np.zeros(0, dtype=np.int64)
+        viajes = np.zeros(0)
+    obtenida = pd.DataFrame({"anio": cats["anio"][celda // n_dias],
+                             "tipo_dia": cats["tipo_dia"][celda % n_dias],
+                             "origen": ZATS[cod_o], "destino": ZATS[cod_d],
+                             "viajes": viajes})
+    horas = df_od[df_od["periodo2"].between(6, 9)]
+    columnas = ["anio", "tipo_dia", "origen", "destino"]
+    compara_tablas(obtenida, referencia(horas, columnas, **filtros), columnas)
+
+
+def test_filas_igual_a_mascara(dataset_od, monkeypatch):
+    # Con fraccion_indice = 1 el índice responde siempre; debe elegir las
+    # mismas filas que la máscara, en el cubo y en sus resúmenes
+    monkeypatch.setattr(modulo_cubo, "fraccion_indice", 1.0)
+    cubo = crea_cubo(dataset_od, "origen", "destino", "proposito", DIMS_OD, "viajes", ZATS)
+    rng = np.random.default_rng(1)
+    n_base = int(np.prod(cubo.forma))
+    for fuente in [cubo] + list(cubo.resumenes.values()):
+        for _ in range(40):
+            filtros = dict()
+            if fuente.con_o and rng.random() < 0.6:
+                filtros["origenes"] = rng.choice(ZATS, rng.integers(0, 4)).tolist()
+            if fuente.con_d and rng.random() < 0.6:
+                filtros["destinos"] = rng.choice(ZATS, rng.integers(0, 4)).tolist()
+            if rng.random() < 0.5:
+                filtros["propositos"] = rng.choice(["HBW", "HBO", "NHB"],
+                                                   rng.integers(0, 3)).tolist()
+            if rng.random() < 0.5:
+                filtros["celdas"] = rng.choice(n_base, rng.integers(0, 30))
+            filas = fuente.filas(**filtros)
+            esperadas = np.flatnonzero(fuente.mascara(**filtros))
+            if filas is not None:
+                assert filas.tolist() == esperadas.tolist(), filtros
+
+
+def test_guardado_y_abierto_con_memory_map(dataset_od, tmp_path):
+    ruta = str(tmp_path / "cubo_od_a.arrow")
+    creado = crea_cubo(dataset_od, "origen", "destino", "proposito", DIMS_OD, "viajes", ZATS,
+                       ruta_cache=ruta)
+    abierto = crea_cubo(None, "origen", "destino", "proposito", DIMS_OD, "viajes",
+                        lambda: pytest.fail("no debe reconstruir"), ruta_cache=ruta)
+    assert set(abierto.resumenes) == set(creado.resumenes)
+    for eje in [None, "origen"]:
+        (a, pa_), = creado.agrega([eje], origenes=[1, 2, 3])
+        (b, pb), = abierto.agrega([eje], origenes=[1, 2, 3])
+        np.testing.assert_allclose(a, b)
+        assert (pa_ == pb).all()
+
+
+def test_acumulado_por_hora(cubo_od):
+    (suma, presente), = cubo_od.agrega(["origen"], propositos=["HBW", "HBO"])
+    horas = cubo_od.catalogos["periodo2"]
+    acumulado = AcumuladoEje(suma, presente, horas, eje=2)
+    for minimo, maximo in [(0, 23), (6, 9), (10, 10), (22, 23)]:
+        en_rango = (horas >= minimo) & (horas <= maximo)
+        suma_rango, presente_rango = acumulado.rango(minimo, maximo)
+        np.testing.assert_allclose(suma_rango, suma[:, :, en_rango].sum(axis=2), atol=1e-9)
+        assert (presente_rango == presente[:, :, en_rango].any(axis=2)).all()
+
+
+@pytest.mark.parametrize("en_disco", [False, True])
+def test_zats_negativas_se_descartan(df_od, tmp_path, en_disco):
+    # Un ID de ZAT negativo marca un registro sin zona: no cuenta ni con
+    # "Todas", aunque el catálogo se arme con todos los valores de la tabla
+    df = df_od.copy()
+    df.loc[df.index[:40], "origen"] = -1
+    df.loc[df.index[30:60], "destino"] = -2
+    df.to_parquet(tmp_path / "od.parquet", index=False)
+    dataset = ds.dataset(str(tmp_path / "od.parquet"), format="parquet")
+    zats = np.unique(np.concatenate([df["origen"], df["destino"]]))
+    cubo = crea_cubo(dataset, "origen", "destino", "proposito", DIMS_OD, "viajes", zats,
+                     en_disco=en_disco)
+    validas = df[(df["origen"] >= 0) & (df["destino"] >= 0)]
+    assert (cubo.zats >= 0).all() and (cubo.zats_o >= 0).all() and (cubo.zats_d >= 0).all()
+    for eje in [None, "origen", "destino"]:
+        columnas = DIMS_OD + ([eje] if eje else [])
+        compara_tablas(cubo.tabla("viajes", eje), referencia(validas, columnas), columnas)
+    assert len(cubo.tabla("viajes", origenes=[-1])) == 0
@@ -0,0 +1,93 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+from conftest import DIMS_OD, ZATS, compara_tablas, referencia
+
+from cubo import crea_cubo
+from exporta import escribe, esquema, lotes_arrow
+
+COLUMNAS = ["anio", "tipo_dia", "origen", "destino"]
+
+
+def exporta(cubo_od, formato, horas=(0, 23), anios=None, **filtros):
+    # Como exporta_od: celda de salida año x tipo de día sumando las horas
+    cats = cubo_od.catalogos
+    i_anio, i_dia, i_hora = np.indices(cubo_od.forma).reshape(3, -1)
+    elegida = (horas[0] <= cats["periodo2"][i_hora]) & (cats["periodo2"][i_hora] <= horas[1])
+    if anios is not None:
+        elegida &= np.isin(cats["anio"], anios)[i_anio]
+    salida = np.where(elegida, i_anio * cubo_od.forma[1] + i_dia, -1)
+    columnas = {"anio": cats["anio"], "tipo_dia": cats["tipo_dia"]}
+    esquema_od = esquema(columnas, cubo_od.zats)
+    pares = cubo_od.pares(salida, zats_por_lote=3, **filtros)
+    partes = list(escribe(lotes_arrow(pares, columnas, cubo_od.zats, esquema_od),
+                          esquema_od, formato))
+    datos = io.BytesIO(b"".join(partes))
+    if formato == "parquet":
+        return pq.read_table(datos), partes
+    return pd.read_csv(datos), partes
+
+
+@pytest.mark.parametrize("formato", ["csv", "parquet"])
+@pytest.mark.parametrize("horas, anios, filtros", [
+    ((0, 23), None, {}),
+    ((6, 9), [2019], {"propositos": ["HBW", "HBO"]}),
+    ((16, 19), None, {"origenes": [3], "destinos": [1, 2, 3, 4, 5]}),
+    ((7, 7), [2021], {"destinos": [9]}),
+])
+def test_exporta_igual_a_groupby(cubo_od, df_od, formato, horas, anios, filtros):
+    obtenida, _ = exporta(cubo_od, formato, horas, anios, **filtros)
+    if formato == "parquet":
+        obtenida = obtenida.to_pandas()
+    df = df_od[df_od["periodo2"].between(*horas)]
+    if anios is not None:
+        df = df[df["anio"].isin(anios)]
+    compara_tablas(obtenida, referencia(df, COLUMNAS, **filtros), COLUMNAS)
+
+
+@pytest.mark.parametrize("formato", ["csv", "parquet"])
+def test_sale_por_partes(cubo_od, formato):
+    # Cada grupo de 3 ZAT de origen se escribe y se envía por separado
+    _, partes = exporta(cubo_od, formato)
+    assert len(partes) >= len(cubo_od.zats_o) // 3
+    if formato == "parquet":
+        assert pq.ParquetFile(io.BytesIO(b"".join(partes))).num_row_groups == \
+            -(-len(cubo_od.zats_o) // 3)
+
+
+def test_esquema_parquet(cubo_od):
+    tabla, _ = exporta(cubo_od, "parquet", origenes=[1])
+    assert tabla.schema.names == COLUMNAS + ["viajes"]
+    assert str(tabla.schema.field("viajes").type) == "double"
+    assert tabla.schema.field("origen").type == tabla.schema.field("destino").type
+
+
+@pytest.mark.parametrize("filtros", [{"origenes": []}, {"propositos": []}, {"origenes": [16]},
+                                     {"origenes": [1], "destinos": [17]}])
+def test_seleccion_vacia(cubo_od, filtros):
+    # Sin filas el archivo queda con el encabezado y el esquema
+    tabla, _ = exporta(cubo_od, "parquet", **filtros)
+    assert tabla.num_rows == 0 and tabla.schema.names == COLUMNAS + ["viajes"]
+    csv, partes = exporta(cubo_od, "csv", **filtros)
+    assert len(csv) == 0 and list(csv.columns) == COLUMNAS + ["viajes"]
+    assert len(partes) == 1
+
+
+@pytest.mark.parametrize("en_disco", [False, True])
+def test_decimales_salen_como_en_la_tabla(tmp_path, en_disco):
+    # 12.3 y 0.1 no son exactos en float32: la descarga debe dar los valores
+    # de la tabla y no 12.300000190734863
+    df = pd.DataFrame({"anio": 2019, "tipo_dia": "lab", "periodo2": 8, "origen": [1, 2, 3],
+                       "destino": 4, "proposito": "HBW", "viajes": [12.3, 0.1, 7.0]})
+    df.to_parquet(tmp_path / "od.parquet", index=False)
+    cubo = crea_cubo(ds.dataset(str(tmp_path / "od.parquet"), format="parquet"), "origen",
+                     "destino", "proposito", DIMS_OD, "viajes", ZATS, en_disco=en_disco)
+    csv, partes = exporta(cubo, "csv")
+    texto = b"".join(partes).decode("utf-8").splitlines()
+    assert [linea.rsplit(",", 1)[1] for linea in texto[1:]] == ["12.3", "0.1", "7"]
+    tabla, _ = exporta(cubo, "parquet")
+    assert tabla.column("viajes").to_pylist() == [12.3, 0.1, 7.0]
@@ -0,0 +1,129 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from geometria import archivo_geometria, centroides, douglas_peucker, niveles, simplifica
+
+# Borde compartido entre dos cuadrados: de (1, 0) a (1, 1) con un zigzag de
+# 1e-5 que la tolerancia debe quitar
+BORDE = [[1.0, i / 20] for i in range(21)]
+for i in range(1, 20, 2):
+    BORDE[i][0] += 1e-5
+
+
+def cuadrado(x0, y0, lado):
+    return [[x0, y0], [x0 + lado, y0], [x0 + lado, y0 + lado], [x0, y0 + lado], [x0, y0]]
+
+
+@pytest.fixture
+def geojson():
+    izquierdo = [[0.0, 0.0]] + BORDE + [[0.0, 1.0], [0.0, 0.0]]
+    derecho = [[2.0, 0.0], [2.0, 1.0]] + BORDE[::-1] + [[2.0, 0.0]]
+    return {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"ID": 1, "nombre": "a"},
+         "geometry": {"type": "Polygon", "coordinates": [izquierdo]}},
+        {"type": "Feature", "properties": {"ID": 2, "nombre": "b"},
+         "geometry": {"type": "Polygon", "coordinates": [derecho]}},
+        {"type": "Feature", "properties": {"ID": 3},
+         "geometry": {"type": "MultiPolygon", "coordinates": [[cuadrado(5, 5, 0.1)],
+                                                              [cuadrado(3, 3, 1)]]}},
+        {"type": "Feature", "properties": {"ID": 4}, "geometry": None},
+        {"type": "Feature", "properties": {"ID": 5},
+         "geometry": {"type": "LineString", "coordinates": [[0, 0], [0.5, 1e-6], [1, 0]]}},
+    ]}
+
+
+@pytest.fixture
+def ruta(geojson, tmp_path):
+    ruta = tmp_path / "zat.geojson"
+    ruta.write_text(json.dumps(geojson), encoding="utf-8")
+    return str(ruta)
+
+
+def test_douglas_peucker():
+    recta = np.column_stack([np.linspace(0, 1, 10), np.zeros(10)])
+    assert np.flatnonzero(douglas_peucker(recta, 0.01)).tolist() == [0, 9]
+    esquina = np.array([[0, 0], [0.5, 0], [1, 0], [1, 0.5], [1, 1]], dtype=float)
+    assert np.flatnonzero(douglas_peucker(esquina, 0.01)).tolist() == [0, 2, 4]
+    # Sin tolerancia no se pierde ningún punto que no esté alineado
+    zigzag = np.array(BORDE)
+    assert douglas_peucker(zigzag, 0).all()
+
+
+def test_borde_compartido_igual_en_los_dos(geojson):
+    simple = simplifica(geojson, 0.001, 5, propiedades=("ID",))
+    izquierdo = simple["features"][0]["geometry"]["coordinates"][0]
+    derecho = simple["features"][1]["geometry"]["coordinates"][0]
+    en_borde_i = [p for p in izquierdo if abs(p[0] - 1) < 1e-3]
+    en_borde_d = [p for p in derecho if abs(p[0] - 1) < 1e-3]
+    assert set(map(tuple, en_borde_i)) == set(map(tuple, en_borde_d))
+    # El zigzag se quitó: el borde queda con sus dos extremos
+    assert sorted(set(map(tuple, en_borde_i))) == [(1.0, 0.0), (1.0, 1.0)]
+    for anillo in (izquierdo, derecho):
+        assert anillo[0] == anillo[-1] and len(anillo) >= 4
+
+
+def test_estructura_y_propiedades(geojson):
+    simple = simplifica(geojson, 0.001, 4, propiedades=("ID",))
+    assert [f["properties"] for f in simple["features"]] == [{"ID": i} for i in range(1, 6)]
+    tipos = [f["geometry"] and f["geometry"]["type"] for f in simple["features"]]
+    assert tipos == ["Polygon", "Polygon", "MultiPolygon", None, "LineString"]
+    # El cuadrado chico del multipolígono no colapsa y la línea conserva sus extremos
+    assert simple["features"][2]["geometry"]["coordinates"][0][0] == cuadrado(5, 5, 0.1)
+    assert simple["features"][4]["geometry"]["coordinates"] == [[0, 0], [1, 0]]
+    # Coordenadas redondeadas a los decimales pedidos
+    anillos = [anillo for f in simple["features"][:2] for anillo in f["geometry"]["coordinates"]]
+    anillos += [anillo for poligono in simple["features"][2]["geometry"]["coordinates"]
+                for anillo in poligono]
+    assert all(round(c, 4) == c for anillo in anillos for p in anillo for c in p)
+
+
+def test_archivo_geometria(ruta, tmp_path):
+    carpeta = str(tmp_path / "geo")
+    nombre = archivo_geometria(ruta, "bajo", carpeta, ("ID",))
+    destino = os.path.join(carpeta, nombre)
+    assert nombre.startswith("zat.bajo.") and os.path.exists(destino)
+    with open(destino, encoding="utf-8") as archivo:
+        escrito = json.load(archivo)
+    with open(ruta, encoding="utf-8") as archivo:
+        esperado = simplifica(json.load(archivo), niveles["bajo"]["tolerancia"],
+                              niveles["bajo"]["decimales"], ("ID",))
+    assert escrito == esperado
+
+    # La segunda vez se reutiliza; otro nivel u otras propiedades dan otro nombre
+    modificado = os.stat(destino).st_mtime_ns
+    assert archivo_geometria(ruta, "bajo", carpeta, ("ID",)) == nombre
+    assert os.stat(destino).st_mtime_ns == modificado
+    assert archivo_geometria(ruta, "alto", carpeta, ("ID",)) != nombre
+    assert archivo_geometria(ruta, "bajo", carpeta, ("ID", "nombre")) != nombre
+    assert not [n for n in os.listdir(carpeta) if n.endswith(".tmp")]
+
+
+def test_archivo_cambia_con_el_origen(ruta, geojson, tmp_path):
+    carpeta = str(tmp_path / "geo")
+    antes = archivo_geometria(ruta, "medio", carpeta)
+    geojson["features"].pop()
+    with open(ruta, "w", encoding="utf-8") as archivo:
+        json.dump(geojson, archivo)
+    assert archivo_geometria(ruta, "medio", carpeta) != antes
+
+
+def test_centroides(ruta):
+    puntos = centroides(ruta, "ID")
+    # Sin geometría y las líneas no tienen centroide
+    assert set(puntos) == {1, 2, 3}
+    np.testing.assert_allclose(puntos[1], (0.5, 0.5), atol=1e-4)
+    np.testing.assert_allclose(puntos[2], (1.5, 0.5), atol=1e-4)
+    # El multipolígono usa la parte de mayor área
+    np.testing.assert_allclose(puntos[3], (3.5, 3.5))
+
+
+def test_centroide_anillo_degenerado(tmp_path):
+    ruta = tmp_path / "degenerado.geojson"
+    linea = [[0, 0], [1, 1], [2, 2], [0, 0]]
+    ruta.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"ID": "7"},
+         "geometry": {"type": "Polygon", "coordinates": [linea]}}]}), encoding="utf-8")
+    np.testing.assert_allclose(centroides(str(ruta))["7"], (0.75, 0.75))
@@ -0,0 +1,100 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from mapas import (Clasificacion, cortes_jenks, etiqueta_unica, figura_flujos, figura_mapa,
+                   limites_usuario)
+
+capas = [{"source": "/geo/localidades.json", "sourcetype": "geojson", "type": "line"}]
+
+
+def jenks_exhaustivo(x, n_clases):
+    # Cortes que minimizan la suma de varianzas probando todas las particiones
+    x = np.sort(x)
+    mejor, cortes = np.inf, None
+    for inicios in itertools.combinations(range(1, len(x)), n_clases - 1):
+        grupos = np.split(x, inicios)
+        costo = sum(((g - g.mean()) ** 2).sum() for g in grupos)
+        if costo < mejor:
+            mejor, cortes = costo, [x[i] for i in inicios]
+    return cortes
+
+
+@pytest.mark.parametrize("semilla", range(5))
+def test_jenks_igual_a_busqueda_exhaustiva(semilla):
+    x = np.random.default_rng(semilla).gamma(2, 100, 9).round()
+    assert list(cortes_jenks(x, 3)) == jenks_exhaustivo(x, 3)
+
+
+def test_clases_limite_en_rango_superior():
+    c = Clasificacion([100, 500])
+    assert c.etiquetas == ["<100", "[100;500)", ">=500"]
+    assert c.clases([0, 100, 499, 500, 10**6]).tolist() == [0, 1, 1, 2, 2]
+
+
+def test_cuantiles_reparten_las_zat():
+    c = Clasificacion.cuantiles(np.arange(100), 4)
+    conteo = np.bincount(c.clases(np.arange(100)))
+    assert len(conteo) == 4 and (abs(conteo - 25) <= 1).all()
+
+
+@pytest.mark.parametrize("metodo", ["jenks", "cuantiles"])
+@pytest.mark.parametrize("valores", [[], [7.0], [3.0] * 10, [0.0, 0.0, 0.0]])
+def test_pocos_valores_distintos_dan_una_clase(metodo, valores):
+    c = Clasificacion.crea(metodo, valores, n_clases=5)
+    assert c.etiquetas == [etiqueta_unica]
+    assert len(c.escala) == 2
+    assert (c.clases(valores) == 0).all()
+
+
+def test_clase_nula_para_nan():
+    valores = np.array([np.nan, 1.0, 1.0])
+    c = Clasificacion.jenks(valores, 5, etiqueta_nulo="Sin base")
+    assert c.etiquetas == [etiqueta_unica, "Sin base"]
+    assert c.clases(valores).tolist() == [1, 0, 0]
+
+
+@pytest.mark.parametrize("valores", [[], [12.0], [5.0, 5.0, 5.0]])
+def test_figura_mapa_con_una_clase_o_sin_zat(valores):
+    c = Clasificacion.jenks(valores, 5)
+    zats = np.arange(len(valores))
+    fig = figura_mapa(zats, valores, c, "/geo/zat.json", "Origen", capas)
+    if not valores:
+        assert fig["data"] == []
+    else:
+        traza, = fig["data"]
+        assert list(traza["text"]) == [etiqueta_unica] * len(valores)
+        assert traza["zmax"] == 0.5
+    assert fig["layout"]["title"] == {"text": "Origen"}
+
+
+def test_figura_flujos_iguales_dibuja_todos():
+    n = 4
+    fig = figura_flujos(np.zeros(n), np.zeros(n), np.ones(n), np.ones(n), [50.0] * n,
+                        ["ZAT {}".format(i) for i in range(n)], "Flujos", capas)
+    traza, = fig["data"]
+    assert traza["name"] == etiqueta_unica
+    assert len(traza["lon"]) == 3 * n
+
+
+@pytest.mark.parametrize("texto", [None, "", "  ", "100,", "abc", "5, 1", "10,10"])
+@pytest.mark.parametrize("metodo", ["jenks", "cuantiles"])
+def test_rango_ignorado_fuera_de_usuario(metodo, texto):
+    # Como los callbacks de los mapas: el rango a medio escribir no importa
+    # si el método calcula sus propios límites
+    limites = limites_usuario(metodo, texto, "100,500,1000,2000", int)
+    assert limites is None
+    valores = np.array([1.0, 5.0, 20.0, 300.0, 4000.0, 4100.0])
+    c = Clasificacion.crea(metodo, valores, limites, n_clases=3)
+    traza, = figura_mapa(np.arange(6), valores, c, "/geo/zat.json", "Origen", capas)["data"]
+    assert len(set(traza["text"])) == 3
+
+
+def test_rango_del_usuario():
+    assert limites_usuario("usuario", None, "100,500", int) == [100, 500]
+    assert limites_usuario("usuario", " ", "100,500", int) == [100, 500]
+    assert limites_usuario("usuario", "-10, -1.5, 0", "1") == [-10, -1.5, 0]
+    for texto in ["100,", "abc", "5, 1", "10,10", "1.5"]:
+        with pytest.raises(ValueError):
+            limites_usuario("usuario", texto, "100,500", int)
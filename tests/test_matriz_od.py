@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from conftest import ZATS, referencia
+
+from matriz_od import MatrizOD
+
+
+def densa(matriz):
+    salida = np.zeros((matriz.n, matriz.n))
+    np.add.at(salida, (matriz.filas(), matriz.indices), matriz.datos)
+    return salida
+
+
+@pytest.fixture
+def pares():
+    rng = np.random.default_rng(2)
+    n = 6
+    cod_o = rng.integers(0, n, 40)
+    cod_d = rng.integers(0, n, 40)
+    viajes = rng.gamma(2, 10, 40)
+    esperada = np.zeros((n, n))
+    np.add.at(esperada, (cod_o, cod_d), viajes)
+    return MatrizOD.desde_codigos(cod_o, cod_d, viajes, n), esperada
+
+
+def test_desde_codigos_suma_repetidos(pares):
+    matriz, esperada = pares
+    np.testing.assert_allclose(densa(matriz), esperada)
+    assert matriz.nnz == np.count_nonzero(esperada)
+    assert matriz.indptr[-1] == matriz.nnz
+
+
+def test_sumas_y_transpuesta(pares):
+    matriz, esperada = pares
+    np.testing.assert_allclose(matriz.sumas_filas(), esperada.sum(axis=1))
+    np.testing.assert_allclose(matriz.sumas_columnas(), esperada.sum(axis=0))
+    np.testing.assert_allclose(densa(matriz.transpuesta()), esperada.T)
+
+
+@pytest.mark.parametrize("origenes, destinos", [(None, None), ([0, 3], None), (None, [5]),
+                                                ([1], [1, 2]), ([], None), (None, [])])
+def test_submatriz(pares, origenes, destinos):
+    matriz, esperada = pares
+    conservar = np.ones_like(esperada, dtype=bool)
+    if origenes is not None:
+        conservar[~np.isin(np.arange(matriz.n), origenes), :] = False
+    if destinos is not None:
+        conservar[:, ~np.isin(np.arange(matriz.n), destinos)] = False
+    np.testing.assert_allclose(densa(matriz.submatriz(origenes, destinos)),
+                               np.where(conservar, esperada, 0))
+
+
+@pytest.mark.parametrize("intrazonales", [False, True])
+@pytest.mark.parametrize("n_top", [0, 1, 5, 100])
+def test_principales(pares, n_top, intrazonales):
+    matriz, esperada = pares
+    if not intrazonales:
+        esperada = esperada.copy()
+        np.fill_diagonal(esperada, 0)
+    o, d, viajes = matriz.principales(n_top, intrazonales)
+    orden = np.sort(esperada[esperada > 0])[::-1]
+    np.testing.assert_allclose(viajes, orden[:n_top])
+    np.testing.assert_allclose(esperada[o, d], viajes)
+    assert intrazonales or not (o == d).any()
+
+
+def test_matriz_vacia():
+    vacia = MatrizOD.desde_codigos([], [], np.zeros(0), 4)
+    assert vacia.nnz == 0 and vacia.indptr.tolist() == [0] * 5
+    assert not vacia.sumas_filas().any() and not vacia.sumas_columnas().any()
+    assert all(len(x) == 0 for x in vacia.principales(3))
+
+
+@pytest.mark.parametrize("filtros", [{}, {"origenes": [3]}, {"destinos": [1, 2, 8]},
+                                     {"propositos": ["HBW", "NHB"]}, {"origenes": []},
+                                     {"origenes": [16]}])
+@pytest.mark.parametrize("anio, t_dia, horas", [(2019, "lab", (6, 9)), (2021, "dom", (0, 23)),
+                                                (2019, "sab", (12, 12))])
+def test_matriz_del_cubo_igual_a_groupby(cubo_od, df_od, filtros, anio, t_dia, horas):
+    # Como matriz_flujos: un año, un tipo de día y un rango de horas
+    cats = cubo_od.catalogos
+    i_horas = np.flatnonzero((horas[0] <= cats["periodo2"]) & (cats["periodo2"] <= horas[1]))
+    celdas = np.ravel_multi_index((np.flatnonzero(cats["anio"] == anio)[0],
+                                   np.flatnonzero(cats["tipo_dia"] == t_dia)[0], i_horas),
+                                  cubo_od.forma)
+    matriz = cubo_od.matriz(celdas, **filtros)
+
+    df = df_od[(df_od["anio"] == anio) & (df_od["tipo_dia"] == t_dia)
+               & df_od["periodo2"].between(*horas)]
+    esperada = referencia(df, ["origen", "destino"], **filtros)
+    np.testing.assert_allclose(densa(matriz)[np.searchsorted(ZATS, esperada["origen"]),
+                                             np.searchsorted(ZATS, esperada["destino"])],
+                               esperada["viajes"])
+    assert matriz.n == len(ZATS)
+    assert np.isclose(matriz.datos.sum(), esperada["viajes"].sum())
+
+
+def test_matriz_sin_celdas(cubo_od):
+    matriz = cubo_od.matriz([])
+    assert matriz.nnz == 0 and matriz.n == len(ZATS)
@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+import re
+import time
+
+from flask import Response
+
+from metricas import Histograma, Metricas, limites_segundos
+
+linea_muestra = re.compile(r'^(tablero_\w+)\{(.*)\} (\S+)$')
+
+
+def muestras(texto):
+    # {(nombre, etiquetas): valor} de las líneas que no son comentarios
+    resultado = dict()
+    for linea in texto.splitlines():
+        if linea.startswith("#"):
+            continue
+        nombre, etiquetas, valor = linea_muestra.match(linea).groups()
+        etiquetas = tuple(sorted(re.findall(r'(\w+)="([^"]*)"', etiquetas)))
+        resultado[nombre, etiquetas] = float(valor)
+    return resultado
+
+
+def serie(datos, nombre, **etiquetas):
+    # Valores de una métrica cuyas etiquetas incluyen ``etiquetas``
+    return {dict(e).get("le"): v for (n, e), v in datos.items()
+            if n == nombre and etiquetas.items() <= dict(e).items()}
+
+
+def test_histograma_acumulado():
+    h = Histograma((1, 5, 10))
+    for valor in (0.5, 1, 3, 10, 50):
+        h.observa(valor)
+    # Un valor igual al límite cuenta en ese límite (le = "menor o igual")
+    assert h.cuentas == [2, 1, 1, 1]
+    assert h.acumuladas() == [2, 3, 4, 5]
+    assert h.suma == 64.5 and h.n == 5
+
+
+def test_exposicion_prometheus():
+    metricas = Metricas()
+
+    @metricas.instrumenta
+    def genera_mapa(n):
+        with metricas.fase("filtro"):
+            pass
+        with metricas.fase("figura"):
+            time.sleep(0.01)
+        return n
+
+    for _ in range(3):
+        assert genera_mapa(2) == 2
+        metricas.registra_respuesta(Response("x" * 2000))
+    texto = metricas.prometheus()
+    assert texto.endswith("\n")
+    for metrica in ("callback_segundos", "callback_cpu_segundos", "callback_memoria_bytes",
+                    "callback_respuesta_bytes", "callback_fase_segundos"):
+        assert "# TYPE tablero_{} histogram".format(metrica) in texto
+        assert "# HELP tablero_{} ".format(metrica) in texto
+
+    datos = muestras(texto)
+    worker = str(os.getpid())
+    cubetas = serie(datos, "tablero_callback_segundos_bucket", callback="genera_mapa",
+                    worker=worker)
+    assert list(cubetas) == [str(l) for l in limites_segundos] + ["+Inf"]
+    assert list(cubetas.values()) == sorted(cubetas.values()) and cubetas["+Inf"] == 3
+    assert cubetas["0.005"] == 0
+    cuenta, = serie(datos, "tablero_callback_segundos_count", callback="genera_mapa").values()
+    suma, = serie(datos, "tablero_callback_segundos_sum", callback="genera_mapa").values()
+    assert cuenta == 3 and 0.03 <= suma < 3
+
+    respuesta, = serie(datos, "tablero_callback_respuesta_bytes_sum").values()
+    assert respuesta == 6000
+    # Una serie por fase, con las etiquetas del callback y el worker
+    for fase in ("filtro", "figura", "serializacion"):
+        assert serie(datos, "tablero_callback_fase_segundos_count", callback="genera_mapa",
+                     fase=fase, worker=worker) != {}
+    figura, = serie(datos, "tablero_callback_fase_segundos_sum", fase="figura").values()
+    assert figura >= 0.03
+
+    tabla = metricas.tabla_recientes()
+    assert len(tabla) == 3 and tabla[0]["Respuesta (kB)"] == round(2000 / 1024, 1)
+
+
+def test_respuesta_sin_callback_no_cuenta():
+    metricas = Metricas()
+    respuesta = Response("hola")
+    assert metricas.registra_respuesta(respuesta) is respuesta
+    assert serie(muestras(metricas.prometheus()), "tablero_callback_respuesta_bytes_count") == {}
+
+
+def trabajo(metricas, set_progress, pasos):
+    # Como genera_grafs: avisa el avance de cada paso y devuelve el resultado
+    for paso in range(pasos):
+        with metricas.fase("figura"):
+            set_progress((paso + 1, pasos))
+    return "listo"
+
+
+def test_trabajo_de_fondo(tmp_path):
+    # Como DiskcacheManager: el trabajo corre en un proceso hijo que termina
+    # al entregar el resultado; sus métricas llegan al worker por la cola
+    metricas = Metricas(carpeta_fondo=str(tmp_path))
+    funcion = metricas.trabajo_fondo(metricas.instrumenta(trabajo))
+    contexto = multiprocessing.get_context("fork")
+    avance, resultado = contexto.Queue(), contexto.Queue()
+
+    def corre():
+        resultado.put(funcion(metricas, avance.put, 3))
+
+    proceso = contexto.Process(target=corre)
+    proceso.start()
+    assert resultado.get(timeout=30) == "listo"
+    proceso.join(30)
+    assert proceso.exitcode == 0
+    assert [avance.get(timeout=5) for _ in range(3)] == [(1, 3), (2, 3), (3, 3)]
+
+    # Antes de leerlas no se han sumado; al exponerlas se suman una sola vez
+    assert not metricas.recientes
+    datos = muestras(metricas.prometheus())
+    assert serie(datos, "tablero_callback_segundos_count", callback="trabajo") == {None: 1}
+    assert serie(datos, "tablero_callback_fase_segundos_count", fase="figura") == {None: 1}
+    # El tamaño de la respuesta no se atribuye al trabajo
+    assert serie(datos, "tablero_callback_respuesta_bytes_count") == {}
+    datos = muestras(metricas.prometheus())
+    assert serie(datos, "tablero_callback_segundos_count", callback="trabajo") == {None: 1}
+
+    fila, = metricas.tabla_recientes()
+    assert fila["Callback"] == "trabajo" and fila["Respuesta (kB)"] == ""
+    assert fila["Fases (ms)"].startswith("figura ")
+
+
+def test_fuera_de_un_trabajo_no_usa_la_cola(tmp_path):
+    metricas = Metricas(carpeta_fondo=str(tmp_path))
+    metricas.instrumenta(lambda: None)()
+    assert not os.path.exists(os.path.join(str(tmp_path), str(os.getppid())))
+
+
+def test_sin_carpeta_no_hay_cola():
+    metricas = Metricas()
+    metricas.trabajo_fondo(metricas.instrumenta(lambda: None))()
+    # Sin carpeta el registro se acumula en el mismo proceso
+    datos = muestras(metricas.prometheus())
+    assert serie(datos, "tablero_callback_segundos_count", callback="<lambda>") == {None: 1}
@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+import pytest
+
+from transporte import codifica_arreglo, codifica_figura, decodifica_figura, min_elementos
+
+
+def ida_y_vuelta(figura):
+    # Como viaja en un store: codificada, a JSON (con el codificador que usa
+    # Dash) y de vuelta
+    return decodifica_figura(json.loads(pio.to_json(codifica_figura(figura), validate=False)))
+
+
+def iguales(obtenido, esperado):
+    if isinstance(esperado, dict):
+        assert set(obtenido) == set(esperado)
+        for k in esperado:
+            iguales(obtenido[k], esperado[k])
+    elif isinstance(esperado, (list, tuple, np.ndarray)):
+        esperado = np.asarray(esperado)
+        obtenido = np.asarray(obtenido)
+        assert obtenido.shape == esperado.shape
+        if esperado.dtype.kind in "iufb":
+            np.testing.assert_array_equal(obtenido.astype(float), esperado.astype(float))
+        else:
+            assert obtenido.tolist() == esperado.tolist()
+    else:
+        assert obtenido == esperado
+
+
+@pytest.mark.parametrize("arreglo, tipo", [
+    (np.arange(200), "u1"),
+    (np.arange(-5, 20), "i1"),
+    (np.arange(1, 300), "i2"),
+    (np.arange(10) * 100_000, "i4"),
+    (np.arange(10, dtype=np.uint32) * 300_000_000, "u4"),
+    (np.arange(10) / 4, "f4"),
+    (np.array([1.5, np.nan, 2.25] * 4), "f4"),
+    (np.random.default_rng(0).random(20), "f8"),
+])
+def test_tipo_minimo_sin_perdida(arreglo, tipo):
+    codificado = codifica_arreglo(arreglo)
+    assert codificado["dtype"] == tipo
+    iguales(ida_y_vuelta({"data": [{"x": arreglo}]})["data"][0]["x"], arreglo)
+
+
+@pytest.mark.parametrize("valor", [
+    list(range(min_elementos - 1)),
+    [True, False] * 8,
+    [1, "a"] * 8,
+    np.arange(10) * 2 ** 40,
+    np.zeros((2, 2, 3)),
+])
+def test_valores_que_quedan_igual(valor):
+    codificado = codifica_arreglo(valor)
+    assert codificado is valor
+
+
+def test_texto_repetido_como_categorias():
+    etiquetas = ["0 - 100", "100 - 500", "500 - 1000"] * 10
+    codificado = codifica_arreglo(etiquetas)
+    assert codificado["categorias"] == sorted(set(etiquetas))
+    assert ida_y_vuelta({"data": [{"text": etiquetas}]})["data"][0]["text"].tolist() == etiquetas
+    # Con pocos repetidos no conviene el diccionario
+    distintos = ["zat %d" % i for i in range(20)]
+    assert codifica_arreglo(distintos) is distintos
+
+
+def test_figura_completa():
+    rng = np.random.default_rng(3)
+    zats = np.arange(1, 41)
+    customdata = np.column_stack([rng.gamma(2, 50, 40), np.arange(40) % 5])
+    figura = go.Figure([
+        go.Choroplethmapbox(locations=zats.astype(str), z=rng.integers(0, 5, 40),
+                            text=np.array(["bajo", "alto"] * 20, dtype=object),
+                            customdata=customdata, marker={"opacity": 0.7}),
+        go.Scattermapbox(lon=rng.random(40), lat=rng.random(40), mode="lines",
+                         line={"width": 2}),
+        go.Bar(x=["HBW", "HBO"], y=[1.5, 2.0]),
+    ], layout={"title": {"text": "Viajes"}, "mapbox": {"zoom": 10}}).to_dict()
+    vuelta = ida_y_vuelta(figura)
+    assert vuelta["layout"] == figura["layout"]
+    assert len(vuelta["data"]) == len(figura["data"])
+    for obtenida, esperada in zip(vuelta["data"], figura["data"]):
+        iguales(obtenida, esperada)
+    # customdata de dos columnas conserva la forma
+    assert vuelta["data"][0]["customdata"].shape == (40, 2)
+
+
+def test_customdata_objeto_numerico():
+    customdata = np.array([[1, 2.5]] * 10, dtype=object)
+    codificado = codifica_arreglo(customdata)
+    assert codificado["shape"] == "10,2"
+    iguales(ida_y_vuelta({"data": [{"customdata": customdata}]})["data"][0]["customdata"],
+            customdata.astype(float))
+
+
+def test_figura_vacia():
+    assert ida_y_vuelta({"data": [], "layout": {}}) == {"data": [], "layout": {}}
+    assert ida_y_vuelta({"layout": {}}) == {"data": [], "layout": {}}